@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+logger = logging.getLogger(__name__)
+
+# Chiave di firma dei cookie: senza SESSION_SECRET le sessioni non
+# sopravvivono al riavvio né sono condivise tra più processi del server
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", str(12 * 3600)))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "256"))
+# Secondi dopo cui un utente in cache viene riletto: entro questo tempo un
+# logout o un cambio password valgono anche negli altri processi del server
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+
+def password_fingerprint(password_hash):
+    """Impronta breve dell'hash della password, inclusa nel token di sessione."""
+    return hashlib.sha256(password_hash.encode()).hexdigest()[:12]
+
+
+class SessionSigner:
+    """Firma e verifica i token di sessione, con scadenza, senza accedere al database.
+
+    Il token contiene lo username, l'impronta della password e la generazione
+    delle sessioni dell'utente: cambiando la password o facendo logout (che
+    incrementa la generazione) le sessioni precedenti non sono più valide.
+    """
+
+    def __init__(self, secret=SESSION_SECRET, max_age=SESSION_MAX_AGE):
+        if not secret:
+            logger.warning("SESSION_SECRET non impostato: uso una chiave temporanea")
+            secret = secrets.token_urlsafe(32)
+        self.max_age = max_age
+        self._serializer = URLSafeTimedSerializer(secret, salt="grezzi-session")
+
+    def dumps(self, user):
+        return self._serializer.dumps(
+            {
+                "u": user["username"],
+                "p": password_fingerprint(user["password_hash"]),
+                "g": user.get("session_generation", 0),
+            }
+        )
+
+    def loads(self, token):
+        """(username, impronta, generazione) del token, o None se non valido o scaduto."""
+        try:
+            payload = self._serializer.loads(token, max_age=self.max_age)
+        except SignatureExpired:
+            logger.info("Sessione scaduta.")
+            return None
+        except BadSignature:
+            logger.warning("Firma della sessione non valida.")
+            return None
+        # I token emessi prima della generazione appartengono alla prima
+        return payload["u"], payload["p"], payload.get("g", 0)
+
+
+class UserCache:
+    """Cache LRU in memoria dei record utente, indicizzata per username, con scadenza."""
+
+    def __init__(self, size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        with self._lock:
+            entry = self._users.get(username)
+            if entry is None:
+                return None
+            user, expires = entry
+            if time.monotonic() >= expires:
+                del self._users[username]
+                return None
+            self._users.move_to_end(username)
+            return user
+
+    def put(self, user):
+        with self._lock:
+            self._users[user["username"]] = (user, time.monotonic() + self.ttl)
+            self._users.move_to_end(user["username"])
+            while len(self._users) > self.size:
+                self._users.popitem(last=False)
+
+    def invalidate(self, username=None):
+        """Rimuove un utente dalla cache, o tutti."""
+        with self._lock:
+            if username is None:
+                self._users.clear()
+            else:
+                self._users.pop(username, None)
+
+
+signer = SessionSigner()
+user_cache = UserCache()
@@ -0,0 +1,474 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+
+from . import db, history, resolver
+from .clean import _split_city_cap_rows, clean_data, reconcile_cap_city, split_city_cap
+from .geo import GEO_CACHE_DIR, GEO_CSV, get_geo_index
+from .metrics import REGISTRY, STAGE_DURATION
+
+CITIES = ["Roma", "Milano", "Napoli", "Torino", "Palermo", "Genova", "Bologna", "Bari"]
+PROVINCES = ["RM", "MI", "NA", "TO", "PA", "GE", "BO", "BA"]
+
+# Dimensioni e intestazioni dei workbook sintetici
+SIZES = (10_000, 100_000, 1_000_000)
+LAYOUTS = {
+    "english": [
+        "Value", "Phone2", "Name", "Source", "Keywords", "Title", "META Description",
+        "META Keywords", "Domain", "Country", "City", "Address", "Category",
+        None, None, None,
+    ],
+    "italian": [
+        "Valore", "Telefono2", "Nome", "Fonte", "Parole chiave", "Titolo",
+        "META Description", "META Keywords", "Dominio", "Paese", "Cittа", "Indirizzo",
+        "Categoria", None, None, None,
+    ],
+}
+BENCH_DATA_DIR = os.getenv("BENCH_DATA_DIR", "bench_data")
+BENCH_BASELINE = os.getenv("BENCH_BASELINE", "bench_baseline.json")
+
+PROVIDERS = [
+    "gmail.com", "libero.it", "hotmail.it", "yahoo.it", "virgilio.it", "alice.it",
+    "outlook.it", "tiscali.it",
+]
+BUSINESSES = [
+    "pizzeria", "ristorante", "hotel", "studio", "farmacia", "autofficina", "bar",
+    "panificio", "ferramenta", "agriturismo",
+]
+CATEGORIES = [
+    ("Ristoranti", "Pizzerie"), ("Hotel", ""), ("Studi professionali", "Avvocati"),
+    ("Farmacie", ""), ("Officine", "Gommisti"), ("Bar", "Caffetterie"),
+    ("Panifici", ""), ("Ferramenta", ""), ("Agriturismi", "Bed and breakfast"),
+]
+STREETS = ["Via Roma", "Corso Italia", "Via Garibaldi", "Piazza Duomo", "Via Mazzini", "Viale Europa"]
+
+
+def random_city(rng):
+    """Genera un valore di City come quelli degli export, con rumore."""
+    i = rng.randrange(len(CITIES))
+    city, province = CITIES[i], PROVINCES[i]
+    cap = f"{rng.randrange(100, 98200):05d}"
+    return rng.choice(
+        [
+            f"{cap} {city} {province}",
+            f"{city} ({province}) {cap}",
+            f"{city} {province}",
+            f"{cap} {city}",
+            f"Via {city} {rng.randrange(1, 200)}, {cap} {city} {province}",
+            city,
+            city.upper(),
+            "",
+            None,
+            np.nan,
+            rng.randrange(10000, 99999),
+        ]
+    )
+
+
+def city_frame(rows, seed=0):
+    rng = random.Random(seed)
+    return pd.DataFrame({"City": [random_city(rng) for _ in range(rows)]})
+
+
+def typo(rng, domain):
+    """Introduce nel dominio un errore di battitura tipico degli export."""
+    name, _, tld = domain.rpartition(".")
+    i = rng.randrange(1, len(name))
+    kind = rng.randrange(5)
+    if kind == 0:
+        name = name[: i - 1] + name[i] + name[i - 1] + name[i + 1 :]
+    elif kind == 1:
+        name = name[:i] + name[i + 1 :]
+    elif kind == 2:
+        name = name[:i] + name[i] + name[i:]
+    elif kind == 3:
+        return f"{name},{tld}"
+    else:
+        return name
+    return f"{name}.{tld}"
+
+
+def random_email(rng, business, domain):
+    local = rng.choice(["info", "contatti", "amministrazione", business, f"{business}{rng.randrange(100)}"])
+    domain = domain if rng.random() < 0.6 else rng.choice(PROVIDERS)
+    roll = rng.random()
+    if roll < 0.12:
+        domain = typo(rng, domain)
+    elif roll < 0.17:
+        return rng.choice([f"{local}[at]{domain}", f"{local}@", f"{local} {domain}", "-"])
+    elif roll < 0.22:
+        return rng.choice(["", None])
+    email = f"{local}@{domain}"
+    if rng.random() < 0.1:
+        email = rng.choice([email.upper(), f" {email} ", email.capitalize()])
+    return email
+
+
+def random_location(rng, places):
+    """City e Address con CAP, provincia e formato variabili, a volte errati."""
+    cap, comune, province = places[rng.randrange(len(places))]
+    if rng.random() < 0.05:
+        cap = f"{rng.randrange(100, 98200):05d}"
+    if rng.random() < 0.05:
+        province = province.lower()
+    city = rng.choice(
+        [
+            f"{cap} {comune} {province}",
+            f"{cap} {comune} {province}",
+            f"{comune} ({province})",
+            f"{comune} {province}",
+            f"{cap} {comune}",
+            comune,
+            comune.upper(),
+            "",
+        ]
+    )
+    street = f"{rng.choice(STREETS)} {rng.randrange(1, 300)}"
+    address = rng.choice([f"{street}, {cap} {comune}", f"{street}, {comune}", street, ""])
+    return city, address
+
+
+def random_phone(rng):
+    mobile = f"3{rng.randrange(20, 94)}{rng.randrange(10**6, 10**7)}"
+    return rng.choice(
+        [
+            f"+39 {mobile[:3]} {mobile[3:]}",
+            mobile,
+            float(mobile),
+            f"0{rng.randrange(10, 99)} {rng.randrange(10**5, 10**7)}",
+            None,
+        ]
+    )
+
+
+def generate_workbook(path, rows, layout="english", seed=0):
+    """Scrive un export sintetico con rumore su email, CAP e provincia.
+
+    I luoghi sono estratti dal riferimento ISTAT; circa il 15% delle righe
+    ripete un'email già uscita, come negli export che si sovrappongono.
+    """
+    rng = random.Random(seed)
+    caps = get_geo_index().caps.reset_index()
+    places = list(caps[["cap", "comune", "sigla_provincia"]].itertuples(index=False, name=None))
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(LAYOUTS[layout])
+    emails = []
+    for i in range(rows):
+        business = rng.choice(BUSINESSES)
+        domain = f"{business}{rng.randrange(rows // 4 + 1)}.it"
+        if emails and rng.random() < 0.15:
+            email = emails[rng.randrange(len(emails))]
+        else:
+            email = random_email(rng, business, domain)
+            emails.append(email)
+        city, address = random_location(rng, places)
+        category = CATEGORIES[BUSINESSES.index(business) % len(CATEGORIES)]
+        website = f"https://www.{domain}/"
+        sheet.append(
+            [
+                email, random_phone(rng), email or business, website,
+                f"{business}, {category[0].lower()}", f"{business.capitalize()} {i}",
+                f"{business.capitalize()} a {city}", business, domain,
+                f"{website}contatti", "Italy", city, address, None, *category,
+            ]
+        )
+    workbook.save(path)
+
+
+def get_workbook(rows, layout, seed=0, data_dir=BENCH_DATA_DIR):
+    """Percorso del workbook sintetico, generato solo la prima volta."""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(data_dir, f"{layout}_{rows}_{seed}.xlsx"))
+    if not os.path.exists(path):
+        print(f"Generazione {path}...", file=sys.stderr)
+        generate_workbook(path, rows, layout, seed)
+    return path
+
+
+class StubNocoDB:
+    """Server HTTP locale che accetta le scritture di record come NocoDB."""
+
+    def __init__(self):
+        self.rows = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                records = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub._lock:
+                    first = stub.rows + 1
+                    stub.rows += len(records)
+                    stub.requests += 1
+                body = json.dumps([{"id": first + i} for i in range(len(records))]).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/v2/tables"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def stub_resolver(latency):
+    """Resolver DNS finto: un dominio su dieci non esiste."""
+
+    def resolve(domain):
+        time.sleep(latency)
+        if int(hashlib.md5(domain.encode()).hexdigest(), 16) % 10 == 0:
+            raise socket.gaierror(f"{domain}: Name or service not known")
+        return "127.0.0.1"
+
+    return resolve
+
+
+@contextlib.contextmanager
+def workspace():
+    """Cartella di lavoro temporanea con il riferimento geografico collegato."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="grezzi-bench-") as work:
+        for path in (GEO_CSV, GEO_CACHE_DIR):
+            if os.path.exists(path):
+                os.symlink(os.path.abspath(path), os.path.join(work, os.path.basename(path)))
+        for folder in ("daPulire", "puliti"):
+            os.makedirs(os.path.join(work, folder))
+        os.chdir(work)
+        try:
+            yield work
+        finally:
+            os.chdir(cwd)
+
+
+def bench_pipeline(workbook, dns_latency=0.002, trace_memory=False, workers=0):
+    """Esegue clean_data con DNS e NocoDB finti e misura fasi e memoria.
+
+    Il picco di memoria è il massimo RSS del processo; con `trace_memory`
+    viene riportato anche il picco delle allocazioni Python (tracemalloc),
+    che però rallenta sensibilmente l'esecuzione.
+    """
+    # Gli errori DNS del resolver finto sono attesi: non vanno stampati
+    logging.getLogger(__package__).setLevel(logging.CRITICAL)
+    get_geo_index()
+    with workspace() as work, StubNocoDB() as nocodb, mock.patch.object(
+        db, "NC_DATA_URL", nocodb.url
+    ), mock.patch.object(
+        history, "DATABASE_URL", f"sqlite:///{work}/history.db"
+    ), mock.patch("socket.gethostbyname", stub_resolver(dns_latency)), open(
+        os.devnull, "w"
+    ) as devnull, contextlib.redirect_stdout(devnull):
+        filename = os.path.basename(workbook)
+        shutil.copy(workbook, os.path.join("daPulire", filename))
+        resolver.CACHE.clear()
+        REGISTRY.drain()
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            clean_data("bench", filename, write_mode="insert", workers=workers)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+        finally:
+            tracemalloc.stop()
+        stages = REGISTRY.drain().get(STAGE_DURATION.name, {})
+        result = {
+            "total": round(elapsed, 3),
+            "stages": {key[0]: round(total, 3) for key, (_, total) in sorted(stages.items())},
+            # ru_maxrss è espresso in KB su Linux
+            "peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 1),
+            "rows_written": nocodb.rows,
+        }
+        if trace_memory:
+            result["traced_peak_mb"] = round(peak / 2**20, 1)
+        return result
+
+
+def run_case(workbook, dns_latency=0.002, trace_memory=False, workers=0):
+    """Esegue bench_pipeline in un processo nuovo, per misurarne la memoria da solo."""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(bench_pipeline, workbook, dns_latency, trace_memory, workers).result()
+
+
+def git_revision():
+    """Revisione git del codice misurato, o None fuori da un repository."""
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip() or None
+
+
+def stale_cases(results, baseline):
+    """Casi la cui baseline ha fasi diverse: misurata su un'altra pipeline, non confrontabile."""
+    stale = []
+    for case, result in results.items():
+        reference = baseline.get(case)
+        if reference is not None and sorted(reference["stages"]) != sorted(result["stages"]):
+            added = sorted(set(result["stages"]) - set(reference["stages"]))
+            removed = sorted(set(reference["stages"]) - set(result["stages"]))
+            stale.append(
+                f"{case} (revisione {reference.get('revision') or 'sconosciuta'}): "
+                f"fasi nuove {added}, fasi assenti {removed}"
+            )
+    return stale
+
+
+def find_regressions(results, baseline, threshold, min_seconds):
+    """Confronta i risultati con la baseline: tempi e memoria oltre la soglia."""
+    regressions = []
+    for case, result in results.items():
+        reference = baseline.get(case)
+        if reference is None:
+            continue
+        measures = [("total", result["total"], reference["total"])]
+        measures += [
+            (f"stage {stage}", seconds, reference["stages"][stage])
+            for stage, seconds in result["stages"].items()
+            if reference["stages"].get(stage, 0) >= min_seconds
+        ]
+        if reference.get("peak_mb"):
+            measures.append(("peak_mb", result["peak_mb"], reference["peak_mb"]))
+        for name, value, expected in measures:
+            if value > expected * (1 + threshold):
+                regressions.append(
+                    f"{case} {name}: {value} contro {expected} ({value / expected - 1:+.0%})"
+                )
+    return regressions
+
+
+def timed(func, df):
+    start = time.perf_counter()
+    result = func(df.copy())
+    return result, time.perf_counter() - start
+
+
+def bench_split_city_cap(rows):
+    """Confronta split_city_cap con la versione riga per riga."""
+    df = city_frame(rows)
+    expected, legacy_time = timed(_split_city_cap_rows, df)
+    result, vector_time = timed(split_city_cap, df)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    print(
+        f"split_city_cap {rows} righe: riga per riga {legacy_time:.3f}s, "
+        f"colonnare {vector_time:.3f}s, speedup {legacy_time / vector_time:.1f}x"
+    )
+
+
+def bench_reconcile(rows):
+    """Misura la riconciliazione CAP/città su un frame già separato."""
+    geo = get_geo_index()
+    df = split_city_cap(city_frame(rows)).fillna("").astype(str)
+    df["Address"] = df["City"]
+    _, elapsed = timed(lambda frame: reconcile_cap_city(frame, geo), df)
+    print(f"reconcile_cap_city {rows} righe: {elapsed:.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline di pulizia")
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=list(SIZES[:2]), help=f"righe (tipiche: {SIZES})"
+    )
+    parser.add_argument("--layouts", nargs="+", choices=sorted(LAYOUTS), default=sorted(LAYOUTS))
+    parser.add_argument("--dns-latency", type=float, default=0.002, help="secondi per dominio")
+    parser.add_argument("--baseline", default=BENCH_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="aggiorna la baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="peggioramento tollerato")
+    parser.add_argument("--min-seconds", type=float, default=0.5, help="fasi più brevi ignorate")
+    parser.add_argument("--tracemalloc", action="store_true", help="traccia le allocazioni Python")
+    parser.add_argument("--micro", action="store_true", help="solo split_city_cap e riconciliazione")
+    parser.add_argument(
+        "--workers", type=int, default=0, help="processi per le fasi riga per riga (0: seriale)"
+    )
+    args = parser.parse_args()
+
+    if args.micro:
+        for rows in args.rows:
+            bench_split_city_cap(rows)
+            bench_reconcile(rows)
+        return
+
+    results = {}
+    for layout in args.layouts:
+        for rows in args.rows:
+            # I casi paralleli hanno una baseline distinta da quella seriale
+            case = f"{layout}-{rows}" + (f"-w{args.workers}" if args.workers > 1 else "")
+            result = run_case(
+                get_workbook(rows, layout), args.dns_latency, args.tracemalloc, args.workers
+            )
+            results[case] = result
+            stages = ", ".join(f"{stage} {seconds}s" for stage, seconds in result["stages"].items())
+            print(
+                f"{case}: {result['total']}s ({rows / result['total']:.0f} righe/s), "
+                f"picco {result['peak_mb']} MB, {result['rows_written']} righe scritte\n  {stages}"
+            )
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.save_baseline:
+        revision = git_revision()
+        for case, result in results.items():
+            baseline[case] = {**result, "revision": revision}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline aggiornata: {args.baseline}")
+        return
+    stale = stale_cases(results, baseline)
+    if stale:
+        for case in stale:
+            print(f"BASELINE NON CONFRONTABILE {case}")
+        print("Rigenerare la baseline con --save-baseline")
+        sys.exit(2)
+    regressions = find_regressions(results, baseline, args.threshold, args.min_seconds)
+    for regression in regressions:
+        print(f"REGRESSIONE {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
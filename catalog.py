@@ -0,0 +1,153 @@
+import logging
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from datetime import datetime
+
+from .downloads import COMPRESSED_SUFFIXES
+
+logger = logging.getLogger(__name__)
+
+CATALOG_DB = os.getenv("CATALOG_DB", "catalog.sqlite3")
+
+# Colonne ammesse per l'ordinamento dell'elenco
+SORT_COLUMNS = ("created_at", "filename", "rows", "size", "table_id", "source")
+
+
+class OutputCatalog:
+    """Catalogo dei file puliti in uscita, salvato in SQLite.
+
+    Viene aggiornato da clean_data (anche nei processi worker) e letto da
+    /list_files senza scansionare la cartella. `updated_at` cambia a ogni
+    modifica e serve per le richieste condizionali.
+    """
+
+    def __init__(self, db_path=CATALOG_DB):
+        self.db_path = db_path
+        self._ready = False
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.db_path, timeout=30)) as conn:
+            conn.row_factory = sqlite3.Row
+            if not self._ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(
+                    """CREATE TABLE IF NOT EXISTS outputs (
+                        filename TEXT PRIMARY KEY,
+                        rows INTEGER,
+                        size INTEGER NOT NULL,
+                        source TEXT,
+                        input_hash TEXT,
+                        table_id TEXT,
+                        job_id TEXT,
+                        created_at TEXT NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS outputs_created_at ON outputs (created_at);
+                    CREATE INDEX IF NOT EXISTS outputs_table_id ON outputs (table_id);
+                    CREATE TABLE IF NOT EXISTS catalog_state (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        updated_at REAL NOT NULL
+                    );
+                    INSERT OR IGNORE INTO catalog_state (id, updated_at) VALUES (1, 0);"""
+                )
+                self._ready = True
+            with conn:
+                yield conn
+
+    def _touch(self, conn):
+        conn.execute("UPDATE catalog_state SET updated_at = ? WHERE id = 1", (time.time(),))
+
+    def add(self, path, rows=None, source=None, input_hash=None, table_id=None, job_id=None):
+        """Registra (o sostituisce) il file in uscita `path`."""
+        stat = os.stat(path)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO outputs "
+                "(filename, rows, size, source, input_hash, table_id, job_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    os.path.basename(path),
+                    rows,
+                    stat.st_size,
+                    source,
+                    input_hash,
+                    table_id,
+                    job_id,
+                    datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+                ),
+            )
+            self._touch(conn)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM outputs")
+            self._touch(conn)
+
+    def sync(self, folder):
+        """Allinea il catalogo alla cartella: aggiunge i file mancanti, rimuove i cancellati.
+
+        I file aggiunti così (creati prima del catalogo o fuori da clean_data)
+        non hanno numero di righe né origine.
+        """
+        # Le copie compresse accompagnano i file e non sono elencate
+        skipped = (*COMPRESSED_SUFFIXES, ".part")
+        on_disk = {}
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(skipped):
+                    on_disk[entry.name] = entry.stat()
+        with self._connect() as conn:
+            known = {row[0] for row in conn.execute("SELECT filename FROM outputs")}
+            missing = [name for name in on_disk if name not in known]
+            removed = [name for name in known if name not in on_disk]
+            conn.executemany(
+                "INSERT INTO outputs (filename, size, created_at) VALUES (?, ?, ?)",
+                [
+                    (
+                        name,
+                        on_disk[name].st_size,
+                        datetime.fromtimestamp(on_disk[name].st_mtime).isoformat(timespec="seconds"),
+                    )
+                    for name in missing
+                ],
+            )
+            conn.executemany("DELETE FROM outputs WHERE filename = ?", [(n,) for n in removed])
+            if missing or removed:
+                self._touch(conn)
+        if missing or removed:
+            logger.info(f"Catalogo: aggiunti {len(missing)} file, rimossi {len(removed)}")
+
+    def updated_at(self):
+        """Istante (epoch) dell'ultima modifica del catalogo."""
+        with self._connect() as conn:
+            return conn.execute("SELECT updated_at FROM catalog_state WHERE id = 1").fetchone()[0]
+
+    def list_outputs(
+        self, page=1, per_page=50, sort="created_at", descending=True, search=None, table_id=None
+    ):
+        """Pagina del catalogo filtrata per nome e tabella; restituisce (totale, righe)."""
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Ordinamento non valido: {sort}")
+        conditions, params = [], []
+        if search:
+            conditions.append("filename LIKE ? ESCAPE '\\'")
+            escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        if table_id:
+            conditions.append("table_id = ?")
+            params.append(table_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = "DESC" if descending else "ASC"
+        with self._connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM outputs {where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT * FROM outputs {where} ORDER BY {sort} {direction}, filename "
+                "LIMIT ? OFFSET ?",
+                (*params, per_page, (page - 1) * per_page),
+            ).fetchall()
+        return total, [dict(row) for row in rows]
+
+
+catalog = OutputCatalog()
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import re
 import socket
@@ -5,14 +6,41 @@ import glob
 import os
 import json
 import dotenv
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
-from . import db
+import sqlite3
+import time
+from openpyxl import load_workbook
+from sqlalchemy.exc import SQLAlchemyError
+from . import db, history, store
+from .catalog import catalog
+from .dedup import DEDUP_MODE, DedupFilter
+from .domains import DomainIndex
+from .downloads import PRECOMPRESS_OUTPUT, precompress
+from .emails import EMAIL_PATTERN, URL_DOMAIN_PATTERN, extract_domains, validate_emails
+from .geo import get_geo_index
+from .metrics import CITY_FIXES, EMAIL_FIXES, ROWS_IN, ROWS_OUT, STAGE_DURATION
+from .parallel import PARALLEL_WORKERS, ChunkPool
+from .phones import normalize_phones
+from .progress import ProgressTracker
+from .resolver import check_domains_reachable
 
 logger = logging.getLogger(__name__)
 
 dotenv.load_dotenv(".env")
 
+CAP_PATTERN = re.compile(r"(\d{4,5})")
+PROVINCE_PATTERN = re.compile(r"\b([A-Z]{2})\b")
+CAP_ADDRESS_PATTERN = re.compile(r"(\d{5})")
+
+# I CSV non ripulito e ripulito sono uscite secondarie, scritte in background
+WRITE_SIDE_CSV = os.getenv("WRITE_SIDE_CSV", "true").lower() == "true"
+_side_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="side-csv")
+
+# Righe per blocco nella lettura in streaming dei file xlsx
+XLS_CHUNK_ROWS = int(os.getenv("XLS_CHUNK_ROWS", "50000"))
+
 
 def write_log(msg):
     with open("log.txt", "a") as f:
@@ -20,13 +48,10 @@ def write_log(msg):
 
 
 def is_valid_email(email):
-    """Verifica se l'email ha un formato valido."""
-    logger.info(f"Validating email: {email}")
+    """Verifica se l'email ha un formato valido (per le colonne: validate_emails)."""
     if pd.isnull(email) or pd.isna(email):
         return False
-    else:
-        pattern = r"^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$"
-        return re.match(pattern, email) is not None
+    return EMAIL_PATTERN.fullmatch(email) is not None
 
 
 def is_domain_reachable(email):
@@ -43,34 +68,28 @@ def is_domain_reachable(email):
 
 
 def suggest_email_fix(email, common_domains=None):
-    """Prova a correggere errori comuni nelle email."""
-    logger.info(f"Suggesting email fix for: {email}")
-    if "@" not in email:
+    """Prova a correggere errori comuni nelle email.
+
+    `common_domains` è un DomainIndex costruito una volta per job; se è un
+    elenco di domini l'indice viene costruito al volo.
+    """
+    if not isinstance(email, str) or "@" not in email:
         return None
+    if not isinstance(common_domains, DomainIndex):
+        common_domains = DomainIndex(common_domains if common_domains is not None else ())
     username, domain = email.split("@", 1)
-    domain = domain.lower().strip()
-
-    for common in common_domains:
-        if not pd.isna(common):
-            if domain.startswith(common[:3]):
-                return f"{username}@{common}"
-        else:
-            continue
-    return None
+    fixed = common_domains.suggest(domain)
+    if fixed is None:
+        return None
+    return f"{username}@{fixed}"
 
 
 def extract_domain(url):
-    """Estrae la parte del dominio da un URL."""
-    logger.info(f"Extracting domain from URL: {url}")
+    """Estrae la parte del dominio da un URL (per le colonne: extract_domains)."""
     if pd.isnull(url) or pd.isna(url):
         return None
-    else:
-        pattern = r"(www\.)?([^/]+)"
-        match = re.search(pattern, url)
-        if match:
-            return match.group(2)
-        else:
-            return url
+    match = URL_DOMAIN_PATTERN.search(url)
+    return match.group(1) if match else url
 
 
 def remove_province(city):
@@ -84,7 +103,34 @@ def remove_province(city):
 
 
 def split_city_cap(df):
-    """Separa la città dal CAP."""
+    """Separa la città dal CAP.
+
+    Implementazione colonnare: CAP e provincia vengono estratti con
+    `.str.extract` e la città viene ripulita solo sulle righe con un match.
+    Il risultato coincide con quello di `_split_city_cap_rows`: se c'è un CAP,
+    la città perde solo il CAP (la sigla di provincia resta nel testo).
+    """
+    if "City" in df.columns:
+        city = df["City"].to_numpy(dtype=object)
+        is_text = np.fromiter((isinstance(v, str) for v in city), bool, len(city))
+        text = pd.Series(np.where(is_text, city, None), dtype=object)
+        cap = text.str.extract(CAP_PATTERN, expand=False)
+        province = text.str.extract(PROVINCE_PATTERN, expand=False)
+        # Il CAP ha la precedenza: è l'ultima sostituzione applicata alla città
+        token = cap.where(cap.notna(), province).to_numpy(dtype=object)
+        matched = pd.notna(token)
+        city = city.copy()
+        city[matched] = [
+            c.replace(t, "").strip() for c, t in zip(city[matched], token[matched])
+        ]
+        df["City"] = city
+        df["CAP"] = cap.where(cap.notna(), None).to_numpy(dtype=object)
+        df["Province"] = province.where(province.notna(), None).to_numpy(dtype=object)
+    return df
+
+
+def _split_city_cap_rows(df):
+    """Versione riga per riga di split_city_cap, usata come riferimento nei benchmark."""
     if "City" in df.columns:
         df["CAP"] = pd.StringDtype()
         df["Province"] = pd.StringDtype()
@@ -113,194 +159,410 @@ def split_city_cap(df):
     return df
 
 
-def parse_xls(file_path):
-
-    df = pd.read_excel(
-        file_path,
-        engine="openpyxl",
-    )
-    logger.info(f"Parsing file: {file_path}")
-    logger.info("Normalizzazione colonne")
-
+# Mappature delle colonne degli export, in inglese e in italiano
+ENGLISH_COLUMNS = {
+    "Value": "Email",
+    "Phone2": "Phone",
+    "Name": "Name_or_Email",
+    "Source": "Website",
+    "Keywords": "Description",
+    "Title": "Name",
+    "META Description": "Meta Description",
+    "META Keywords": "Meta Keywords",
+    "Domain": "Domain-1",
+    "Country": "Domain",
+    "City": "Country",
+    "Address": "City",
+    "Category": "Address",
+    "Unnamed: 14": "Category-I",
+    "Unnamed: 15": "Category-II",
+}
+ITALIAN_COLUMNS = {
+    "Valore": "Email",
+    "Telefono2": "Cell",
+    "Nome": "Name_or_Email",
+    "Fonte": "Website",
+    "Parole chiave": "Description",
+    "Titolo": "Name",
+    "META Description": "Meta Description",
+    "META Keywords": "Meta Keywords",
+    "Dominio": "Domain-1",
+    "Paese": "Domain",
+    "Cittа": "Country",
+    "Indirizzo": "City",
+    "Categoria": "Address",
+    "Unnamed: 14": "Category-I",
+    "Unnamed: 15": "Category-II",
+}
+
+
+def rename_columns(df):
+    """Normalizza i nomi delle colonne ed elimina quelle senza nome."""
     if "Value" in df.columns:
-        df = df.rename(
-            columns={
-                "Value": "Email",
-                "Phone2": "Phone",
-                "Name": "Name_or_Email",
-                "Source": "Website",
-                "Keywords": "Description",
-                "Title": "Name",
-                "META Description": "Meta Description",
-                "META Keywords": "Meta Keywords",
-                "Domain": "Domain-1",
-                "Country": "Domain",
-                "City": "Country",
-                "Address": "City",
-                "Category": "Address",
-                "Unnamed: 14": "Category-I",
-                "Unnamed: 15": "Category-II",
-            }
-        )
+        df = df.rename(columns=ENGLISH_COLUMNS)
     else:
-        df = df.rename(
-            columns={
-                "Valore": "Email",
-                "Telefono2": "Cell",
-                "Nome": "Name_or_Email",
-                "Fonte": "Website",
-                "Parole chiave": "Description",
-                "Titolo": "Name",
-                "META Description": "Meta Description",
-                "META Keywords": "Meta Keywords",
-                "Dominio": "Domain-1",
-                "Paese": "Domain",
-                "Cittа": "Country",
-                "Indirizzo": "City",
-                "Categoria": "Address",
-                "Unnamed: 14": "Category-I",
-                "Unnamed: 15": "Category-II",
-            }
-        )
+        df = df.rename(columns=ITALIAN_COLUMNS)
 
     # Remove all unnamed columns
     unnamed_cols = [col for col in df.columns if col.startswith('Unnamed:')]
     if unnamed_cols:
         logger.info(f"Dropping unnamed columns: {unnamed_cols}")
         df.drop(columns=unnamed_cols, inplace=True)
-    logger.info(f"Columns: {df.columns}")
-    logger.info(df.shape)
-    # logger.info("Drop non italiani")
-    # df = df[(df["Country"].str.lower() == "italy") & (df["Country"].str.strip() != "")]
+    return df
+
+
+def _header_names(header):
+    """Nomi di colonna come li produce `pd.read_excel` (vuote e duplicate)."""
+    names, seen = [], {}
+    for i, value in enumerate(header):
+        name = f"Unnamed: {i}" if value is None or value == "" else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def iter_xls_chunks(file_path, chunksize=XLS_CHUNK_ROWS):
+    """Legge il foglio in streaming e restituisce blocchi di righe già rinominati.
+
+    Usa la modalità read-only di openpyxl, quindi la memoria resta limitata
+    al blocco corrente indipendentemente dalla dimensione del file.
+    """
+    # La durata di lettura di ogni blocco comprende l'apertura del file per il primo
+    started = time.perf_counter()
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        # Le celle vuote in coda all'intestazione non vengono restituite
+        width = max(len(header), sheet.max_column or 0)
+        columns = _header_names(header + [None] * (width - len(header)))
+        chunk, emitted = [], False
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            if len(row) > len(columns):
+                columns = _header_names(header + [None] * (len(row) - len(header)))
+            chunk.append(row + (None,) * (len(columns) - len(row)))
+            if len(chunk) >= chunksize:
+                df = rename_columns(pd.DataFrame(chunk, columns=columns))
+                STAGE_DURATION.observe(time.perf_counter() - started, stage="read_excel")
+                yield df
+                chunk, emitted = [], True
+                started = time.perf_counter()
+        if chunk or not emitted:
+            df = rename_columns(pd.DataFrame(chunk, columns=columns))
+            STAGE_DURATION.observe(time.perf_counter() - started, stage="read_excel")
+            yield df
+    finally:
+        workbook.close()
+
+
+# Colonne dei telefoni negli export (inglesi e italiani): ogni file ne ha una
+PHONE_COLUMNS = ("Phone", "Cell")
+
+
+def phone_flag_columns(column):
+    """Colonne di validità, tipo e valore originale scritte per una colonna di telefoni."""
+    return f"{column} Valido", f"{column} Tipo", f"{column} Originale"
+
+
+def normalize_phone_columns(df):
+    """Scrive i telefoni validi in formato E.164, con validità e tipo per ogni colonna.
+
+    I numeri non validi vengono tolti dalla colonna, che in NocoDB è di tipo
+    telefono, e conservati come testo nella colonna "<colonna> Originale".
+    """
+    for column in PHONE_COLUMNS:
+        if column in df.columns:
+            phones = normalize_phones(df[column])
+            valid_column, type_column, original_column = phone_flag_columns(column)
+            original = df[column].where(~phones["valid"], None)
+            df[column] = phones["phone"]
+            df[valid_column] = phones["valid"]
+            df[type_column] = phones["type"]
+            df[original_column] = original
+    return df
+
+
+def prepare_chunk(df):
+    """Fasi riga per riga del parsing: città/CAP, telefoni, verifica email ed estrazione dominio.
+
+    Restituisce il blocco aggiornato e il risultato di validate_emails; non
+    dipende dagli altri blocchi, quindi può essere eseguita in parallelo.
+    """
     logger.info("Split città e CAP")
-    df = split_city_cap(df)
-    logger.info("Normalizzazione email")
-    if "Email" not in df.columns:
-        raise ValueError(f"Il file {file_path} non contiene una colonna 'Email'")
-    df["Email"] = df["Email"].astype(str).str.strip().str.lower()
+    with STAGE_DURATION.time(stage="split_city_cap"):
+        df = split_city_cap(df)
+    logger.info("Normalizzazione telefoni")
+    with STAGE_DURATION.time(stage="phone"):
+        df = normalize_phone_columns(df)
+    email_started = time.perf_counter()
+    logger.info("Normalizzazione e verifica email")
+    # Normalizzazione, validità e dominio calcolati una volta e riusati fino al DNS
+    checked = validate_emails(df["Email"])
+    df["Email"] = checked["email"]
 
-    # df["Email"] = df["Email"].strip().lower()
     logger.info("Estrazione dominio")
-    df["Domain-1"] = df["Domain"].apply(
-        lambda x: extract_domain(x) if not pd.isnull(x) or pd.isna(x) else None
-    )
+    df["Domain-1"] = extract_domains(df["Domain"])
+    STAGE_DURATION.observe(time.perf_counter() - email_started, stage="email")
+    return df, checked
+
+
+# Colonne lette e prodotte da prepare_chunk, per l'esecuzione nel pool di processi
+PREPARE_INPUTS = ("City", *PHONE_COLUMNS, "Email", "Domain")
+PREPARE_OUTPUTS = (
+    "City", "CAP", "Province",
+    *(name for column in PHONE_COLUMNS for name in (column, *phone_flag_columns(column))),
+    "Email", "Domain-1",
+)
+
+
+def prepare_columns(df):
+    """prepare_chunk sulle sole colonne necessarie, con `checked` come colonne prefissate."""
+    df, checked = prepare_chunk(df)
+    result = df[[column for column in PREPARE_OUTPUTS if column in df.columns]]
+    return pd.concat([result, checked.add_prefix("checked:")], axis=1)
+
+
+def _prepare_in_pool(df, pool):
+    inputs = df[[column for column in PREPARE_INPUTS if column in df.columns]]
+    result = pool.map_frame("prepare_columns", inputs)
+    # Stesso ordine di assegnazione di prepare_chunk, quindi stesso ordine delle colonne
+    for column in PREPARE_OUTPUTS:
+        if column in result.columns:
+            df[column] = result[column]
+    checked = result.filter(like="checked:").rename(columns=lambda c: c.split(":", 1)[1])
+    return df, checked
+
+
+def parse_chunk(df, domain_index, progress=None, dedup=None, pool=None):
+    """Applica a un blocco di righe la separazione città/CAP e la verifica email.
+
+    `domain_index` è condiviso da tutti i blocchi del job e viene arricchito
+    con i domini di ciascun blocco; `progress` è un ProgressTracker opzionale.
+    Con `dedup` (un DedupFilter) i duplicati vengono scartati o segnalati
+    prima della verifica DNS. Con `pool` (un ChunkPool) le fasi riga per riga
+    vengono eseguite in parallelo su porzioni del blocco.
+    """
+    logger.info(df.shape)
+    # logger.info("Drop non italiani")
+    # df = df[(df["Country"].str.lower() == "italy") & (df["Country"].str.strip() != "")]
+    if pool is None:
+        df, checked = prepare_chunk(df)
+    else:
+        df, checked = _prepare_in_pool(df, pool)
+    email_started = time.perf_counter()
     logger.info("Suggerimento email corretta")
-    df["Email Corretta"] = df["Email"].apply(
-        lambda x: (suggest_email_fix(x, df["Domain-1"]) if not is_valid_email(x) else x)
-    )
-    logger.info("Verifica email")
-    df["Email Valida"] = df["Email Corretta"].apply(lambda x: is_valid_email(x))
+    domain_index.add(df["Domain-1"])
+    corrected = checked["email"].where(checked["valid"], None)
+    invalid = ~checked["valid"]
+    if invalid.any():
+        fixes = checked.loc[invalid, "email"].map(
+            lambda email: suggest_email_fix(email, domain_index)
+        )
+        found = fixes.notna()
+        EMAIL_FIXES.inc(int(found.sum()), result="fixed")
+        EMAIL_FIXES.inc(int((~found).sum()), result="unfixed")
+        corrected[invalid] = fixes
+    df["Email Corretta"] = corrected
+    # Solo le correzioni vanno riverificate: le email valide restano tali
+    valid = checked["valid"].to_numpy().copy()
+    fixed = (corrected.notna() & invalid).to_numpy()
+    if fixed.any():
+        valid[fixed] = validate_emails(corrected[fixed], normalize=False)["valid"].to_numpy()
+    df["Email Valida"] = valid
+    STAGE_DURATION.observe(time.perf_counter() - email_started, stage="email")
+    rows = len(df)
+    if progress is not None:
+        progress.update("parse", rows)
+    if dedup is not None:
+        logger.info("Deduplica email")
+        with STAGE_DURATION.time(stage="dedup"):
+            df = dedup.apply(df)
+        checked = checked.loc[df.index]
     logger.info("Verifica dominio raggiungibile")
-    df["Dominio Raggiungibile"] = df["Email"].apply(
-        lambda x: is_domain_reachable(x) if is_valid_email(x) else False
-    )
-
+    with STAGE_DURATION.time(stage="dns"):
+        # Come in precedenza, il DNS verifica il dominio dell'email originale
+        df["Dominio Raggiungibile"] = check_domains_reachable(
+            df["Email"],
+            checked["valid"],
+            domains=checked["domain"],
+            on_error=lambda domain, e: write_log(f"DNS: Errore: {e}, Dominio: {domain}"),
+        )
+    if progress is not None:
+        progress.update("dns", rows)
     return df
 
 
-def save_files(filename):
-    """Salva il CSV non ripulito e il CSV ripulito."""
+def count_xls_rows(file_path):
+    """Numero di righe dati dichiarato dal foglio, senza leggerlo (può mancare)."""
+    workbook = load_workbook(file_path, read_only=True)
     try:
-        os.mkdir("output_csv")
-        os.mkdir("output_raw_csv")
-    except FileExistsError:
-        pass
-    # for f in file_paths:
-    df = parse_xls(filename)
+        max_row = workbook.worksheets[0].max_row
+        return max_row - 1 if max_row else None
+    finally:
+        workbook.close()
+
+
+def iter_parsed_chunks(
+    file_path, chunksize=XLS_CHUNK_ROWS, progress=None, dedup=None, pool=None
+):
+    """Legge e analizza il file a blocchi, con un indice dei domini per job."""
+    logger.info(f"Parsing file: {file_path}")
+    domain_index = DomainIndex()
+    for df in iter_xls_chunks(file_path, chunksize):
+        logger.info(f"Columns: {df.columns}")
+        if "Email" not in df.columns:
+            raise ValueError(f"Il file {file_path} non contiene una colonna 'Email'")
+        yield parse_chunk(df, domain_index, progress, dedup, pool)
+
+
+def parse_xls(file_path, pool=None):
+    """Legge e analizza l'intero file in un unico DataFrame."""
+    return pd.concat(list(iter_parsed_chunks(file_path, pool=pool)), ignore_index=True)
+
+
+def filter_valid(df):
+    """Tiene solo le righe con email valida e dominio non irraggiungibile.
+
+    Un dominio sconosciuto (risoluzione DNS scaduta) non basta a scartare la riga.
+    """
     logger.info("Pulizia dati")
     logger.debug(f"Initial rows: {df.head()}")
-    df_cleaned = df.dropna(subset=["Email Valida", "Dominio Raggiungibile"])
-    df_cleaned = df_cleaned[
-        df_cleaned["Email Valida"] & df_cleaned["Dominio Raggiungibile"]
-    ]
-    raw_entries = len(df)
+    return df[df["Email Valida"].eq(True) & df["Dominio Raggiungibile"].ne(False)]
+
+
+def side_output_paths(filename):
+    """Percorsi del CSV non ripulito e del CSV ripulito per il file indicato."""
     raw_output_path = os.path.join(
         "output_raw_csv", os.path.basename(filename.replace(".xlsx", "_raw.csv"))
     )
-    df.to_csv(raw_output_path, index=False)
-    cleaned_entries = len(df_cleaned)
     clean_output_path = os.path.join(
         "output_csv", os.path.basename(filename.replace(".xlsx", "_cleaned.csv"))
     )
-    df_cleaned.to_csv(clean_output_path, index=False)
+    return raw_output_path, clean_output_path
+
+
+def write_side_outputs(filename, df, df_cleaned, append=False):
+    """Scrive il CSV non ripulito e il CSV ripulito (in coda se `append`)."""
+    os.makedirs("output_csv", exist_ok=True)
+    os.makedirs("output_raw_csv", exist_ok=True)
+    raw_output_path, clean_output_path = side_output_paths(filename)
+    mode = "a" if append else "w"
+    with STAGE_DURATION.time(stage="side_csv_write"):
+        df.to_csv(raw_output_path, index=False, mode=mode, header=not append)
+        df_cleaned.to_csv(clean_output_path, index=False, mode=mode, header=not append)
+    return clean_output_path
+
+
+def log_file_counts(filename, raw_entries, cleaned_entries):
     logger.info(f"File: {filename}, Righe: {raw_entries}, Righe Pulite: {cleaned_entries}")
     with open("file_log.txt", "a") as f:
         f.write(f"File: {filename}, Righe: {raw_entries}, Righe Pulite: {cleaned_entries}\n")
+
+
+def save_files(filename):
+    """Salva il CSV non ripulito e il CSV ripulito."""
+    df = parse_xls(filename)
+    df_cleaned = filter_valid(df)
+    clean_output_path = write_side_outputs(filename, df, df_cleaned)
+    log_file_counts(filename, len(df), len(df_cleaned))
     return clean_output_path
 
 
-# Funzione per verificare e aggiornare la City
-def verify_and_update_city(row, cap_dict):
-    cap = row["CAP"]
-    city = row["City"]
-    correct_city = cap_dict.get(cap)
-    if correct_city and city != correct_city:
-        return correct_city
+def match_cities(df, geo, rows):
+    """Corregge città, provincia, regione e CAP delle righe `rows` cercando il comune per nome.
+
+    La ricerca approssimata di ComuneMatcher è memorizzata, quindi ogni
+    coppia distinta città/provincia viene cercata una volta. Provincia e
+    regione sono completate solo se vuote, il CAP solo per i comuni con un
+    unico CAP.
+    """
+    positions = np.flatnonzero((rows & (df["City"].str.strip() != "")).to_numpy())
+    if not len(positions):
+        return df
+    cities = df["City"].to_numpy()[positions]
+    provinces = df["Province"].to_numpy()[positions]
+    matches = [geo.matcher.match(city, province) for city, province in zip(cities, provinces)]
+    found = [match for match in matches if match is not None]
+    CITY_FIXES.inc(len(found), result="fixed")
+    CITY_FIXES.inc(len(matches) - len(found), result="unmatched")
+    if not found:
+        return df
+    positions = positions[[match is not None for match in matches]]
+    single_cap = np.array([match["cap_min"] == match["cap_max"] for match in found])
+    for column, field in (
+        ("City", "comune"),
+        ("Province", "sigla_provincia"),
+        ("Region", "regione"),
+        ("CAP", "cap_min"),
+    ):
+        values = df[column].to_numpy(dtype=object, copy=True)
+        current = values[positions]
+        correct = np.array([match[field] for match in found], dtype=object)
+        if column == "CAP":
+            correct = np.where((current == "") & single_cap, correct, current)
+        elif column != "City":
+            correct = np.where(current == "", correct, current)
+        values[positions] = correct
+        df[column] = values
+    return df
+
+
+def reconcile_cap_city(df, geo=None):
+    """Riconcilia CAP, città, provincia e regione con il riferimento dei comuni.
+
+    Pipeline colonnare: il CAP mancante viene estratto da `Address`, poi ogni
+    colonna è completata con una `map` sull'indice geografico per CAP. Le
+    righe con un CAP assente o sconosciuto (anche i CAP generici delle città
+    con più CAP, come 00100 per Roma) sono riconciliate per nome con
+    match_cities.
+    """
+    geo = geo if geo is not None else get_geo_index()
+    reference = geo.caps
+    fallback = df["Address"].astype(str).str.extract(CAP_ADDRESS_PATTERN, expand=False)
+    df["CAP"] = df["CAP"].mask((df["CAP"] == "") & fallback.notna(), fallback)
+
+    correct_city = df["CAP"].map(reference["comune"])
+    known_cap = correct_city.notna() & (correct_city != "")
+    df["City"] = df["City"].mask(known_cap, correct_city)
+    province = df["CAP"].map(reference["sigla_provincia"]).fillna("")
+    df["Province"] = df["Province"].mask(df["Province"] == "", province)
+    region = df["CAP"].map(reference["regione"]).fillna("")
+    if "Region" in df.columns:
+        df["Region"] = df["Region"].mask(df["Region"] == "", region)
     else:
-        return city
+        df["Region"] = region
+    df = match_cities(df, geo, ~known_cap)
+
+    df["Address"] = (
+        df["Address"].astype(str).str.replace(CAP_ADDRESS_PATTERN, "", regex=True).str.strip()
+    )
+    return df
 
 
-def verify_and_update_cap(row):
-    cap = row["CAP"]
-    if not cap:
-        c = re.search(r"\d{5}", str(row["Address"]))
-        if c is not None:
-            cap = c.group(0)
-
-    return cap
-
-
-def clean_data(table_id, filename):
-    # file_list = glob.glob(upload_path+"/*.xlsx")
-    file_path = "./daPulire/" + filename
-    clean_output_path = save_files(file_path)
-    with open("file_log.txt", "r") as f:
-        count = 0
-        lines = f.readlines()
-        for line in lines:
-            old = line.split(",")[1].split(":")[1].strip()
-            new = line.split(",")[2].split(":")[1].strip()
-            count = count + (int(old) - int(new))
-        logger.info(f"Righe totali rimosse: {count}")
-    # for f in file_list:
-    os.remove(file_path)
-    # file_list = glob.glob("./output_csv/*.csv")
-    # all_data = []
-    # for f in file_list:
-    df = pd.read_csv(clean_output_path, engine="python", encoding="utf-8", dtype=str)
-    # all_data.append(df)
-    # all_df = pd.concat(all_data, ignore_index=True)
-
-    for columns in df.columns:
-        df[columns] = df[columns].fillna("")
-    df = df.astype(str)
+def clean_frame(df):
+    """Normalizza le righe valide e le riconcilia con il riferimento geografico."""
+    # "Dominio Raggiungibile" è object (None se sconosciuto): tutto diventa testo,
+    # quindi la conversione implicita di fillna, deprecata, non serve
+    with pd.option_context("future.no_silent_downcasting", True):
+        df = df.fillna("").astype(str)
     df["Category"] = df["Category-I"] + df["Category-II"]
     df = df.drop(columns=["Category-I", "Category-II"])
 
-    cap_df = pd.read_csv(
-        "gi_comuni_cap.csv", sep=";", engine="python", encoding="utf-8", dtype=str
-    )
-    logger.info("Loaded city and CAP data")
-    cap_df["comune"] = cap_df["denominazione_ita"].str.lower()
-    cap_dict = cap_df.set_index("cap")["denominazione_ita"].to_dict()
-    cap_comune = cap_df.set_index("cap")["comune"].to_dict()
-
-    # Applica la funzione al DataFrame
-    df["City"] = df.apply(verify_and_update_city, axis=1, args=(cap_dict,))
-    df["CAP"] = df.apply(verify_and_update_cap, axis=1)
-    df["Address"] = df["Address"].apply(lambda x: re.sub(r"\d{5}", "", str(x)).strip())
+    logger.info("Riconciliazione CAP e città")
+    df = reconcile_cap_city(df, get_geo_index())
     logger.info("Uppercase province")
     df["Province"] = df["Province"].astype(str).str.upper()
 
     logger.info("Capitalizing city names")
     df["City"] = df["City"].astype(str).str.capitalize()
     logger.info(f"Shape before dropping unnamed columns: {df.shape}")
-    filename = (
-        "puliti/"
-        + filename.replace(".xlsx", "_clean_")
-        + datetime.now().strftime("%Y%m%d_%H%M%S")
-        + ".csv"
-    )
 
     # Remove all unnamed columns
     unnamed_cols = [col for col in df.columns if col.startswith('Unnamed:')]
@@ -308,7 +570,233 @@ def clean_data(table_id, filename):
         logger.info(f"Dropping unnamed columns: {unnamed_cols}")
         df.drop(columns=unnamed_cols, inplace=True)
     logger.debug(f"Columns after dropping: {df.columns}")
-    df.to_csv(filename, index=False)
-    logger.info(f"Shape after dropping unnamed columns: {df.shape}")
-    logger.info(f"File salvato: {filename}")
-    db.save_to_table(table_id, df)
+    return df
+
+
+def _write_chunk(table_id, df, table_sync, dedup):
+    """Salva in NocoDB un blocco pulito e ne registra le email per la deduplica.
+
+    La colonna Duplicato resta solo nel CSV: la tabella NocoDB non la prevede.
+    """
+    with STAGE_DURATION.time(stage="nocodb_write"):
+        records = df.drop(columns="Duplicato", errors="ignore")
+        if table_sync is not None:
+            table_sync.sync(records)
+        else:
+            db.save_to_table(table_id, records)
+    ROWS_OUT.inc(len(df))
+    if dedup is not None:
+        dedup.commit(df)
+
+
+def _iter_cached_chunks(cache_key, output_path, progress, dedup):
+    """Rilegge un risultato in cache e lo riscrive in `output_path`, a blocchi.
+
+    La deduplica viene riapplicata rispetto agli invii successivi al
+    risultato in cache; restituisce i blocchi pronti per NocoDB.
+    """
+    chunks = store.iter_result_chunks(cache_key, XLS_CHUNK_ROWS)
+    for i, df in enumerate(chunks):
+        rows = len(df)
+        if dedup is not None:
+            with STAGE_DURATION.time(stage="dedup"):
+                df = dedup.apply(df)
+        with STAGE_DURATION.time(stage="csv_write"):
+            df.to_csv(output_path, index=False, mode="a" if i else "w", header=i == 0)
+        if progress is not None:
+            for stage in ("parse", "dns", "reconcile"):
+                progress.update(stage, rows)
+        yield df, rows
+
+
+def _wait_side_output(side_output):
+    if side_output is None:
+        return
+    try:
+        side_output.result()
+    except Exception as e:
+        logger.error(f"Errore nella scrittura dei CSV intermedi: {e}")
+
+
+def clean_data(
+    table_id,
+    filename,
+    write_side_csv=WRITE_SIDE_CSV,
+    on_progress=None,
+    write_mode=db.NC_WRITE_MODE,
+    dedup_mode=DEDUP_MODE,
+    job_id=None,
+    input_hash=None,
+    workers=PARALLEL_WORKERS,
+    input_path=None,
+    push=True,
+):
+    """Esegue la pipeline completa in memoria e salva il risultato in NocoDB.
+
+    Il file viene letto ed elaborato a blocchi di XLS_CHUNK_ROWS righe: ogni
+    blocco passa dal parsing alla riconciliazione e a NocoDB senza copie
+    intermedie. I CSV non ripulito e ripulito sono uscite opzionali scritte
+    in background. `on_progress` riceve l'avanzamento di ogni fase.
+    Con `write_mode="upsert"` le righe già presenti in NocoDB non vengono
+    reinserite ma aggiornate solo se cambiate. `dedup_mode` ("drop", "flag"
+    o "off") controlla la deduplica delle email rispetto ai caricamenti
+    precedenti sulla stessa tabella. L'esito, anche in caso di errore, viene
+    registrato nella cronologia delle esecuzioni.
+
+    Con `input_hash` il file viene letto dall'archivio dei caricamenti e il
+    risultato resta in cache: se lo stesso file è già stato pulito con la
+    stessa configurazione viene eseguito solo l'invio a NocoDB.
+
+    Con `workers` maggiore di 1 le fasi riga per riga (città/CAP, email,
+    riconciliazione) vengono eseguite in un pool di processi, con lo stesso
+    risultato dell'esecuzione seriale.
+
+    Con `input_path` il file viene letto da quel percorso e lasciato al suo
+    posto; con `push=False` il risultato viene solo scritto su disco, senza
+    invio a NocoDB né registrazione per la deduplica. Restituisce un
+    riepilogo con righe lette e scritte, scarti e durata delle fasi.
+    """
+    if input_path is not None:
+        file_path = input_path
+    elif input_hash is not None:
+        file_path = store.upload_path(input_hash)
+    else:
+        file_path = "./daPulire/" + filename
+    started_at = datetime.now()
+    cache_key = cached = None
+    if input_hash is not None and store.RESULT_CACHE:
+        fingerprint = store.config_fingerprint(table_id, dedup_mode, XLS_CHUNK_ROWS)
+        cache_key = store.result_key(input_hash, fingerprint)
+        cached = store.load_result(cache_key)
+    progress = None
+    if on_progress is not None:
+        total = cached["rows_in"] if cached is not None else count_xls_rows(file_path)
+        progress = ProgressTracker(on_progress, total)
+    output_path = (
+        "puliti/"
+        + filename.replace(".xlsx", "_clean_")
+        + datetime.now().strftime("%Y%m%d_%H%M%S")
+        + ".csv"
+    )
+    raw_entries = cleaned_entries = 0
+    rejections = {"email_invalid": 0, "domain_unreachable": 0, "duplicate": 0}
+    side_output = None
+    pool = ChunkPool(workers) if workers > 1 and cached is None else None
+    with STAGE_DURATION.collect("stage") as timings:
+        try:
+            table_sync = db.TableSync(table_id) if push and write_mode == "upsert" else None
+            dedup = DedupFilter(table_id, dedup_mode) if dedup_mode != "off" else None
+            if cached is not None:
+                logger.info(f"Risultato in cache per {filename}: solo invio a NocoDB")
+                raw_entries = cached["rows_in"]
+                ROWS_IN.inc(raw_entries)
+                rejections.update(cached["rejections"])
+                chunks = _iter_cached_chunks(cache_key, output_path, progress, dedup)
+                for df, chunk_rows in chunks:
+                    if push:
+                        _write_chunk(table_id, df, table_sync, dedup)
+                    cleaned_entries += len(df)
+                    if progress is not None:
+                        progress.update("nocodb", chunk_rows)
+                if dedup is not None:
+                    rejections["duplicate"] += dedup.dropped
+            else:
+                chunks = iter_parsed_chunks(
+                    file_path, progress=progress, dedup=dedup, pool=pool
+                )
+                for i, df in enumerate(chunks):
+                    df_cleaned = filter_valid(df)
+                    # L'avanzamento è espresso in righe del file, confrontabili con il
+                    # totale, compresi i duplicati scartati
+                    chunk_rows = len(df)
+                    if dedup is not None:
+                        chunk_rows += dedup.dropped - rejections["duplicate"]
+                        rejections["duplicate"] = dedup.dropped
+                    valid = df["Email Valida"].eq(True)
+                    reachable = df["Dominio Raggiungibile"].ne(False)
+                    rejections["email_invalid"] += int((~valid).sum())
+                    rejections["domain_unreachable"] += int((valid & ~reachable).sum())
+                    raw_entries += chunk_rows
+                    ROWS_IN.inc(chunk_rows)
+                    if write_side_csv:
+                        # Al massimo un blocco in attesa di scrittura, per limitare la memoria
+                        _wait_side_output(side_output)
+                        side_output = _side_writer.submit(
+                            write_side_outputs, filename, df, df_cleaned, i > 0
+                        )
+                    del df
+
+                    with STAGE_DURATION.time(stage="reconcile"):
+                        if pool is not None:
+                            df = pool.map_frame("clean_frame", df_cleaned)
+                        else:
+                            df = clean_frame(df_cleaned)
+                    with STAGE_DURATION.time(stage="csv_write"):
+                        df.to_csv(output_path, index=False, mode="a" if i else "w", header=i == 0)
+                    logger.info(f"Shape after dropping unnamed columns: {df.shape}")
+                    if progress is not None:
+                        progress.update("reconcile", chunk_rows)
+                    if push:
+                        _write_chunk(table_id, df, table_sync, dedup)
+                    cleaned_entries += len(df)
+                    if progress is not None:
+                        progress.update("nocodb", chunk_rows)
+            if dedup is not None:
+                logger.info(f"Duplicati scartati: {dedup.dropped}")
+                dedup.close()
+            _wait_side_output(side_output)
+        except Exception as e:
+            history.record_run(
+                filename, table_id, job_id, "failed", str(e), started_at,
+                raw_entries, cleaned_entries, timings, rejections,
+            )
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+    logger.info(f"File salvato: {output_path}")
+
+    log_file_counts(file_path, raw_entries, cleaned_entries)
+    run_id = history.record_run(
+        filename, table_id, job_id, "completed", None, started_at,
+        raw_entries, cleaned_entries, timings, rejections,
+    )
+    if run_id is not None:
+        # I totali servono solo al log: le righe sono già state scritte
+        try:
+            logger.info(f"Righe totali rimosse: {history.get_totals()['rows_rejected']}")
+        except (SQLAlchemyError, ImportError) as e:
+            logger.warning(f"Errore nella lettura dei totali della cronologia: {e}")
+    try:
+        catalog.add(output_path, cleaned_entries, filename, input_hash, table_id, job_id)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Errore nella registrazione del file nel catalogo: {e}")
+    if PRECOMPRESS_OUTPUT:
+        # Copie compresse servite da /download senza comprimere a ogni richiesta
+        try:
+            with STAGE_DURATION.time(stage="compress"):
+                precompress(output_path)
+        except OSError as e:
+            logger.error(f"Errore nella compressione del file pulito: {e}")
+    if cache_key is not None and cached is None:
+        meta = {
+            "filename": filename,
+            "rows_in": raw_entries,
+            "rows_out": cleaned_entries,
+            "rejections": rejections,
+            "created_at": started_at.isoformat(),
+        }
+        try:
+            store.save_result(cache_key, output_path, meta)
+        except OSError as e:
+            logger.error(f"Errore nel salvataggio del risultato in cache: {e}")
+    # I file dell'archivio restano disponibili fino alla scadenza
+    if input_hash is None and input_path is None:
+        os.remove(file_path)
+    return {
+        "output_path": output_path,
+        "rows_in": raw_entries,
+        "rows_out": cleaned_entries,
+        "rejections": rejections,
+        "stages": dict(timings),
+    }
@@ -0,0 +1,297 @@
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing, contextmanager
+from datetime import datetime
+
+from . import db, store
+from .clean import WRITE_SIDE_CSV, clean_data
+from .dedup import DEDUP_MODE
+from .parallel import PARALLEL_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Registro dei file già elaborati, per riprendere un lotto interrotto
+CLI_CHECKPOINT = os.getenv("CLI_CHECKPOINT", "cli_checkpoint.sqlite3")
+
+
+class Checkpoint:
+    """File completati dai lotti da riga di comando, salvati in SQLite.
+
+    Un file è identificato dall'hash del contenuto, dalla tabella e
+    dall'invio a NocoDB: rinominato o spostato non viene rielaborato, mentre
+    lo stesso file inviato a un'altra tabella sì. Ogni esito viene scritto
+    appena il file termina, quindi dopo un'interruzione si riparte dai file
+    non ancora completati.
+    """
+
+    def __init__(self, db_path=CLI_CHECKPOINT):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS files (
+                    input_hash TEXT NOT NULL,
+                    table_id TEXT NOT NULL,
+                    pushed INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    rows_in INTEGER,
+                    rows_out INTEGER,
+                    duration REAL,
+                    finished_at TEXT NOT NULL,
+                    PRIMARY KEY (input_hash, table_id, pushed)
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        with closing(sqlite3.connect(self.db_path, timeout=30)) as conn:
+            with conn:
+                yield conn
+
+    def completed(self, table_id, push):
+        """Hash dei file già completati per la tabella e la modalità indicate."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT input_hash FROM files "
+                "WHERE table_id = ? AND pushed = ? AND status = 'completed'",
+                (table_id or "", int(push)),
+            )
+            return {row[0] for row in rows}
+
+    def record(self, result, table_id, push):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO files (input_hash, table_id, pushed, path, status, "
+                "error, rows_in, rows_out, duration, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    result["input_hash"],
+                    table_id or "",
+                    int(push),
+                    result["path"],
+                    result["status"],
+                    result.get("error"),
+                    result.get("rows_in"),
+                    result.get("rows_out"),
+                    result["duration"],
+                    datetime.now().isoformat(timespec="seconds"),
+                ),
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM files")
+
+
+def find_inputs(patterns):
+    """File .xlsx indicati da cartelle, glob o percorsi, senza duplicati e in ordine."""
+    found = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            found.extend(glob.glob(pattern, recursive=True))
+        elif os.path.isdir(pattern):
+            found.extend(glob.glob(os.path.join(pattern, "*.xlsx")))
+        elif os.path.isfile(pattern):
+            found.append(pattern)
+        else:
+            logger.warning(f"Nessun file per {pattern}")
+    paths = {}
+    for path in sorted(found):
+        # I file temporanei di Excel (~$nome.xlsx) non sono workbook
+        if os.path.isfile(path) and not os.path.basename(path).startswith("~$"):
+            paths.setdefault(os.path.realpath(path), path)
+    return list(paths.values())
+
+
+def _init_worker(log_level):
+    logging.basicConfig(level=log_level, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    from .geo import get_geo_index
+
+    get_geo_index()
+
+
+def clean_file(path, input_hash, table_id, options):
+    """Pulisce un file del lotto; gli errori diventano un esito, non un'eccezione."""
+    started = time.perf_counter()
+    result = {"path": path, "input_hash": input_hash}
+    try:
+        summary = clean_data(
+            table_id,
+            os.path.basename(path),
+            input_path=path,
+            input_hash=input_hash,
+            **options,
+        )
+    except Exception as e:
+        logger.exception(f"Errore nella pulizia di {path}")
+        result.update(status="failed", error=f"{type(e).__name__}: {e}")
+    else:
+        result.update(status="completed", **summary)
+    result["duration"] = time.perf_counter() - started
+    return result
+
+
+def _run_serial(tasks, table_id, options):
+    for path, input_hash in tasks:
+        yield clean_file(path, input_hash, table_id, options)
+
+
+def _run_parallel(tasks, table_id, options, workers, log_level):
+    context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_init_worker, initargs=(log_level,)
+    )
+    try:
+        futures = [
+            executor.submit(clean_file, path, input_hash, table_id, options)
+            for path, input_hash in tasks
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def run_batch(paths, table_id, options, workers=1, checkpoint=None, log_level=logging.WARNING):
+    """Pulisce i file `paths`, saltando quelli già completati secondo `checkpoint`.
+
+    Con `workers` maggiore di 1 i file sono elaborati in parallelo in processi
+    separati. Restituisce gli esiti dei file elaborati e il numero di quelli
+    saltati.
+    """
+    push = options.get("push", True)
+    done = checkpoint.completed(table_id, push) if checkpoint is not None else set()
+    tasks, queued, completed, duplicates = [], set(), 0, 0
+    for path in paths:
+        input_hash = store.file_hash(path)
+        if input_hash in done:
+            completed += 1
+        elif input_hash in queued:
+            # Lo stesso contenuto presente con più nomi viene elaborato una volta
+            duplicates += 1
+        else:
+            queued.add(input_hash)
+            tasks.append((path, input_hash))
+    if completed:
+        print(f"{completed} file già completati, saltati", file=sys.stderr)
+    if duplicates:
+        print(f"{duplicates} file con contenuto duplicato, saltati", file=sys.stderr)
+    skipped = completed + duplicates
+    if workers > 1 and len(tasks) > 1:
+        results = _run_parallel(tasks, table_id, options, min(workers, len(tasks)), log_level)
+    else:
+        results = _run_serial(tasks, table_id, options)
+    outcomes = []
+    for result in results:
+        if checkpoint is not None:
+            checkpoint.record(result, table_id, push)
+        outcomes.append(result)
+        if result["status"] == "completed":
+            print(
+                f"[{len(outcomes)}/{len(tasks)}] {result['path']}: {result['rows_in']} righe, "
+                f"{result['rows_out']} scritte, {result['duration']:.1f}s",
+                file=sys.stderr,
+            )
+        else:
+            print(
+                f"[{len(outcomes)}/{len(tasks)}] {result['path']}: ERRORE {result['error']}",
+                file=sys.stderr,
+            )
+    return outcomes, skipped
+
+
+def print_summary(outcomes, skipped, elapsed):
+    """Stampa file e righe al secondo e il tempo di ogni fase sommato sui file."""
+    completed = [r for r in outcomes if r["status"] == "completed"]
+    failed = len(outcomes) - len(completed)
+    rows_in = sum(r["rows_in"] for r in completed)
+    rows_out = sum(r["rows_out"] for r in completed)
+    stages = {}
+    for result in completed:
+        for stage, seconds in result["stages"].items():
+            stages[stage] = stages.get(stage, 0) + seconds
+    rate = 1 / elapsed if elapsed > 0 else 0
+    print(
+        f"{len(completed)} file completati, {failed} falliti, {skipped} saltati "
+        f"in {elapsed:.1f}s ({len(completed) * rate:.2f} file/s)"
+    )
+    print(f"{rows_in} righe lette, {rows_out} scritte ({rows_in * rate:.0f} righe/s)")
+    total = sum(stages.values())
+    for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+        print(f"  {stage}: {seconds:.2f}s ({seconds / total:.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pulizia in blocco dei file da riga di comando")
+    parser.add_argument("inputs", nargs="+", help="cartelle, glob o file .xlsx")
+    parser.add_argument("--table-id", help="tabella NocoDB di destinazione")
+    parser.add_argument(
+        "--no-push", action="store_true", help="scrive solo i CSV puliti, senza invio a NocoDB"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="file elaborati in parallelo")
+    parser.add_argument(
+        "--row-workers",
+        type=int,
+        default=PARALLEL_WORKERS,
+        help="processi per le fasi riga per riga di ogni file (0: seriale)",
+    )
+    parser.add_argument("--write-mode", choices=("insert", "upsert"), default=db.NC_WRITE_MODE)
+    parser.add_argument("--dedup-mode", choices=("drop", "flag", "off"), default=DEDUP_MODE)
+    parser.add_argument(
+        "--side-csv",
+        action=argparse.BooleanOptionalAction,
+        default=WRITE_SIDE_CSV,
+        help="scrive anche i CSV intermedi",
+    )
+    parser.add_argument("--checkpoint", default=CLI_CHECKPOINT, help="registro dei file completati")
+    parser.add_argument(
+        "--restart", action="store_true", help="ignora il registro e rielabora tutti i file"
+    )
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    if not args.no_push and not args.table_id:
+        parser.error("--table-id è obbligatorio senza --no-push")
+
+    log_level = args.log_level.upper()
+    logging.basicConfig(level=log_level, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    paths = find_inputs(args.inputs)
+    if not paths:
+        parser.error("nessun file .xlsx da elaborare")
+    os.makedirs("puliti", exist_ok=True)
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.clear()
+    options = {
+        "write_side_csv": args.side_csv,
+        "write_mode": args.write_mode,
+        # La deduplica confronta con gli invii precedenti alla tabella
+        "dedup_mode": args.dedup_mode if args.table_id else "off",
+        "workers": args.row_workers,
+        "push": not args.no_push,
+    }
+
+    started = time.perf_counter()
+    try:
+        outcomes, skipped = run_batch(
+            paths, args.table_id, options, args.workers, checkpoint, log_level
+        )
+    except BrokenProcessPool as e:
+        # I file completati sono già nel registro: rilanciando si riprende da lì
+        print(f"Lotto interrotto: {e}", file=sys.stderr)
+        sys.exit(2)
+    print_summary(outcomes, skipped, time.perf_counter() - started)
+    if any(result["status"] != "completed" for result in outcomes):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,166 @@
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 import pandas as pd
 from dotenv import load_dotenv
 import logging
 
+from .metrics import NOCODB_BATCH_DURATION, NOCODB_BATCH_ERRORS, NOCODB_RETRIES
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 # Carica le variabili d'ambiente
 TOKEN = os.getenv("TOKEN")
 
 # Salvataggio in nocodb
-NC_DATA_URL = "http://nocodb:8080/api/v2/tables"
-NC_META_URL = "http://nocodb:8080/api/v2/meta"
+NC_URL = os.getenv("NC_URL", "http://nocodb:8080")
+NC_DATA_URL = f"{NC_URL}/api/v2/tables"
+NC_META_URL = f"{NC_URL}/api/v2/meta"
+
+# Scrittura a blocchi: dimensione, blocchi concorrenti, tentativi e attesa iniziale
+NC_BATCH_SIZE = int(os.getenv("NC_BATCH_SIZE", "1000"))
+NC_MAX_CONCURRENCY = int(os.getenv("NC_MAX_CONCURRENCY", "4"))
+NC_MAX_RETRIES = int(os.getenv("NC_MAX_RETRIES", "5"))
+NC_BACKOFF = float(os.getenv("NC_BACKOFF", "0.5"))
+NC_TIMEOUT = float(os.getenv("NC_TIMEOUT", "60"))
+
+# Modalità di scrittura: "insert" aggiunge sempre, "upsert" sincronizza per chiave
+NC_WRITE_MODE = os.getenv("NC_WRITE_MODE", "insert")
+NC_SYNC_KEY = os.getenv("NC_SYNC_KEY", "Email Corretta").split(",")
+NC_PAGE_SIZE = int(os.getenv("NC_PAGE_SIZE", "1000"))
+HASH_COLUMN = "RowHash"
+
+# Errori temporanei per cui ha senso riprovare
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# Metodi che si possono ripetere senza effetti doppi; le POST (inserimenti)
+# sono ripetute solo se la richiesta non è stata elaborata
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "PATCH", "DELETE"}
+UNPROCESSED_STATUSES = {429, 503}
 
 headers = {
     "Content-Type": "application/json",
     "xc-token": TOKEN,
 }
 
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Sessione HTTP condivisa con connessioni keep-alive verso NocoDB."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update(headers)
+            adapter = HTTPAdapter(pool_maxsize=max(NC_MAX_CONCURRENCY, 10))
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def _not_sent(error):
+    """Vero se la connessione non è stata stabilita, quindi la richiesta non è partita."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+
+
+def request_with_retry(method, url, max_retries=NC_MAX_RETRIES, **kwargs):
+    """Esegue una richiesta a NocoDB, riprovando con backoff esponenziale.
+
+    Le richieste non idempotenti (POST) sono ripetute solo se non sono
+    arrivate a NocoDB o sono state rifiutate senza elaborarle (429, 503):
+    dopo un timeout di lettura il blocco potrebbe essere già salvato e
+    ripeterlo duplicherebbe le righe. Restituisce la risposta (None se non
+    ne è arrivata una valida) e l'esito: codice HTTP, tentativi ed eventuale
+    errore.
+    """
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    retry_statuses = RETRY_STATUSES if idempotent else UNPROCESSED_STATUSES
+    result = {"status": None, "attempts": 0, "ok": False}
+    for attempt in range(1, max_retries + 1):
+        result["attempts"] = attempt
+        delay = NC_BACKOFF * 2 ** (attempt - 1) * (1 + random.random())
+        try:
+            response = get_session().request(method, url, timeout=NC_TIMEOUT, **kwargs)
+            result["status"] = response.status_code
+            if response.ok:
+                result["ok"] = True
+                result.pop("error", None)
+                return response, result
+            result["error"] = response.text[:500]
+            if response.status_code not in retry_statuses:
+                return None, result
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+        except requests.RequestException as e:
+            result["error"] = str(e)
+            if not idempotent and not _not_sent(e):
+                logger.error(f"NocoDB: {method} non ripetuta, esito incerto: {e}")
+                return None, result
+        if attempt < max_retries:
+            NOCODB_RETRIES.inc()
+            logger.warning(
+                f"NocoDB: tentativo {attempt} fallito ({result['error'][:100]}), "
+                f"nuovo tentativo tra {delay:.1f}s"
+            )
+            time.sleep(delay)
+    return None, result
+
+
+def send_batch(url, records, method="POST", keep_response=False):
+    """Invia un blocco di record e restituisce l'esito (con la risposta se richiesta)."""
+    with NOCODB_BATCH_DURATION.time(method=method):
+        response, result = request_with_retry(method, url, json=records)
+    if not result["ok"]:
+        NOCODB_BATCH_ERRORS.inc(method=method)
+    result["rows"] = len(records)
+    if keep_response and response is not None:
+        result["response"] = response.json()
+    return result
+
+
+def send_batches(
+    url, batches, method="POST", max_concurrency=NC_MAX_CONCURRENCY, keep_response=False
+):
+    """Invia i blocchi con al più `max_concurrency` richieste contemporanee.
+
+    I blocchi vengono generati man mano, quindi in memoria restano solo quelli
+    in volo. Restituisce gli esiti nell'ordine dei blocchi.
+    """
+    results, pending = [], []
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="nocodb") as pool:
+        for records in batches:
+            if len(pending) >= max_concurrency:
+                results.append(pending.pop(0).result())
+            pending.append(pool.submit(send_batch, url, records, method, keep_response))
+        results.extend(future.result() for future in pending)
+    for i, result in enumerate(results):
+        result["batch"] = i
+        if result["ok"]:
+            logger.info(f"NocoDB: blocco {i} salvato ({result['rows']} righe)")
+        else:
+            logger.error(
+                f"NocoDB: blocco {i} non salvato dopo {result['attempts']} tentativi: "
+                f"{result['status']} {result.get('error', '')[:200]}"
+            )
+    return results
+
+
+def iter_record_batches(df, batch_size=NC_BATCH_SIZE):
+    """Converte il DataFrame in liste di record, un blocco alla volta."""
+    for start in range(0, len(df), batch_size):
+        yield df.iloc[start : start + batch_size].to_dict(orient="records")
+
 
 def save_to_nocodb(all_df, filename):
     """Salva il DataFrame in NocoDB."""
@@ -28,19 +171,186 @@ def save_to_nocodb(all_df, filename):
     logger.info(f"File salvato in nocodb: {filename}")
 
 
-def save_to_table(table_id: str, all_df: pd.DataFrame):
-    """Salva il DataFrame in una tabella specifica di NocoDB."""
-    # Converti il DataFrame in un dizionario
+def save_to_table(table_id: str, all_df: pd.DataFrame, batch_size: int = NC_BATCH_SIZE):
+    """Salva il DataFrame in una tabella specifica di NocoDB, a blocchi.
+
+    Solleva RuntimeError se qualche blocco non è stato salvato dopo i tentativi;
+    gli altri blocchi restano comunque salvati.
+    """
     logger.info(f"{table_id} {all_df.head()}")
-    data = all_df.to_dict(orient="records")
-    logger.info(f"{NC_DATA_URL}/{table_id}/records")
-    response = requests.post(
-        f"{NC_DATA_URL}/{table_id}/records", headers=headers, json=data
-    )
-    if response.status_code == 200:
-        logger.info(f"File salvato in NocoDB: {table_id}")
-    else:
-        logger.error(f"Errore nel salvataggio in NocoDB: {response.status_code}")
+    url = f"{NC_DATA_URL}/{table_id}/records"
+    logger.info(url)
+    results = send_batches(url, iter_record_batches(all_df, batch_size))
+    failed = [result for result in results if not result["ok"]]
+    if failed:
+        rows = sum(result["rows"] for result in failed)
+        raise RuntimeError(
+            f"Errore nel salvataggio in NocoDB: {len(failed)} blocchi su "
+            f"{len(results)} non salvati ({rows} righe)"
+        )
+    logger.info(f"File salvato in NocoDB: {table_id}")
+    return results
+
+
+def get_table_columns(table_id):
+    """Recupera i titoli delle colonne di una tabella e quello della chiave primaria."""
+    response, result = request_with_retry("GET", f"{NC_META_URL}/tables/{table_id}")
+    if response is None:
+        logger.error(f"Errore nel recupero delle colonne: {result['status']}")
+        return None, None
+    columns = response.json().get("columns", [])
+    primary_key = next((c["title"] for c in columns if c.get("pk")), "Id")
+    return [c["title"] for c in columns], primary_key
+
+
+def sync_keys(df, key_columns=NC_SYNC_KEY):
+    """Chiave stabile per riga: email corretta normalizzata (ed eventualmente dominio)."""
+    keys = df[key_columns[0]].astype(str).str.strip().str.lower()
+    for column in key_columns[1:]:
+        keys = keys + "|" + df[column].astype(str).str.strip().str.lower()
+    return keys
+
+
+def row_hashes(df):
+    """Hash del contenuto di ogni riga, per riconoscere le righe invariate."""
+    hashes = pd.util.hash_pandas_object(df.astype(str), index=False)
+    return hashes.map("{:016x}".format)
+
+
+class TableSync:
+    """Sincronizzazione idempotente di un job verso una tabella NocoDB.
+
+    Le chiavi già presenti vengono lette una sola volta, a pagine; poi ogni
+    blocco invia solo le righe nuove (inserimenti) e quelle cambiate
+    (aggiornamenti), confrontando l'hash del contenuto salvato in RowHash.
+    Delle righe di un blocco con la stessa chiave viene scritta solo l'ultima;
+    le altre sono contate in `stats["collapsed"]`.
+    """
+
+    def __init__(self, table_id, key_columns=NC_SYNC_KEY, page_size=NC_PAGE_SIZE):
+        self.table_id = table_id
+        self.key_columns = list(key_columns)
+        self.page_size = page_size
+        self.url = f"{NC_DATA_URL}/{table_id}/records"
+        self.existing = None
+        self.primary_key = "Id"
+        self.stats = {"inserted": 0, "updated": 0, "unchanged": 0, "collapsed": 0}
+
+    def load(self):
+        """Legge chiavi, id e hash delle righe già presenti nella tabella."""
+        columns, self.primary_key = get_table_columns(self.table_id)
+        missing = [
+            c for c in self.key_columns + [HASH_COLUMN] if columns is None or c not in columns
+        ]
+        if missing:
+            raise RuntimeError(
+                f"La tabella {self.table_id} non ha le colonne {missing}: "
+                "impossibile sincronizzare in modalità upsert"
+            )
+        fields = ",".join([self.primary_key, *self.key_columns, HASH_COLUMN])
+        pages, offset = [], 0
+        while True:
+            response, result = request_with_retry(
+                "GET",
+                self.url,
+                params={"fields": fields, "limit": self.page_size, "offset": offset},
+            )
+            if response is None:
+                raise RuntimeError(f"Errore nella lettura delle righe esistenti: {result}")
+            body = response.json()
+            page = body.get("list", [])
+            pages.extend(page)
+            offset += len(page)
+            if not page or body.get("pageInfo", {}).get("isLastPage", True):
+                break
+        existing = pd.DataFrame(pages, columns=[self.primary_key, *self.key_columns, HASH_COLUMN])
+        existing.index = sync_keys(existing.fillna(""), self.key_columns)
+        self.existing = existing[~existing.index.duplicated(keep="last")]
+        logger.info(f"NocoDB: {len(self.existing)} chiavi esistenti in {self.table_id}")
+
+    def sync(self, df):
+        """Inserisce le righe nuove e aggiorna quelle cambiate; salta le invariate."""
+        if self.existing is None:
+            self.load()
+        df = df.copy()
+        df[HASH_COLUMN] = row_hashes(df)
+        df.index = sync_keys(df, self.key_columns)
+        # Righe del blocco con la stessa chiave: in NocoDB ne resta una, l'ultima
+        collapsed = df.index.duplicated(keep="last")
+        if collapsed.any():
+            keys = df.index[collapsed].unique()
+            logger.warning(
+                f"NocoDB sync {self.table_id}: {int(collapsed.sum())} righe scartate "
+                f"perché con la stessa chiave di una riga successiva del blocco "
+                f"(per esempio {list(keys[:5])})"
+            )
+            self.stats["collapsed"] += int(collapsed.sum())
+            df = df[~collapsed]
+
+        known = df.index.isin(self.existing.index)
+        stored_hash = self.existing[HASH_COLUMN].reindex(df.index)
+        changed = known & (stored_hash != df[HASH_COLUMN]).to_numpy()
+        inserts, updates = df[~known], df[changed]
+        self.stats["unchanged"] += int(known.sum() - changed.sum())
+
+        results = send_batches(
+            self.url, iter_record_batches(inserts), "POST", keep_response=True
+        )
+        self._remember_inserts(inserts, results)
+        updates = updates.assign(
+            **{self.primary_key: self.existing[self.primary_key].reindex(updates.index).to_numpy()}
+        )
+        results += send_batches(self.url, iter_record_batches(updates), "PATCH")
+        self._remember(updates, updates[self.primary_key].tolist())
+
+        failed = [result for result in results if not result["ok"]]
+        if failed:
+            raise RuntimeError(
+                f"Errore nella sincronizzazione con NocoDB: {len(failed)} blocchi su "
+                f"{len(results)} non salvati"
+            )
+        self.stats["inserted"] += len(inserts)
+        self.stats["updated"] += len(updates)
+        logger.info(f"NocoDB sync {self.table_id}: {self.stats}")
+        return self.stats
+
+    def _remember_inserts(self, inserts, results):
+        """Registra gli id delle righe inserite, blocco per blocco.
+
+        NocoDB restituisce gli id nell'ordine dei record inviati. Se un blocco
+        salvato non riporta un id per record, le chiavi vengono rilette dalla
+        tabella invece di dimenticare le righe del blocco.
+        """
+        start, reload = 0, False
+        for result in results:
+            batch = inserts.iloc[start : start + result["rows"]]
+            start += result["rows"]
+            if not result["ok"]:
+                continue
+            response = result.get("response")
+            records = response if isinstance(response, list) else []
+            ids = [r.get(self.primary_key) if isinstance(r, dict) else None for r in records]
+            if len(ids) == len(batch) and None not in ids:
+                self._remember(batch, ids)
+            else:
+                reload = True
+        if reload:
+            logger.warning(
+                f"NocoDB: id mancanti nella risposta di un inserimento in {self.table_id}, "
+                "rilettura delle chiavi"
+            )
+            self.load()
+
+    def _remember(self, df, ids):
+        """Aggiorna le chiavi note con le righe appena scritte (blocchi successivi)."""
+        if df.empty:
+            return
+        written = pd.DataFrame(
+            {self.primary_key: ids, HASH_COLUMN: df[HASH_COLUMN].to_numpy()}, index=df.index
+        )
+        for column in self.key_columns:
+            written[column] = df[column].to_numpy()
+        self.existing = pd.concat([self.existing[~self.existing.index.isin(df.index)], written])
 
 
 def get_all_tables(base_id):
@@ -150,13 +460,23 @@ def create_table(base_id, table_name):
                 "title": "Category-II",
                 "uidt": "SingleLineText",
             },
+            {
+                "title": "Email Corretta",
+                "uidt": "Email",
+            },
+            {
+                "title": HASH_COLUMN,
+                "uidt": "SingleLineText",
+            },
         ],
     }
     response = requests.post(CREATE_TABLE_URL, headers=headers, json=data)
     if response.status_code == 200:
         logger.info(f"Tabella creata: {table_name}")
+        return True
     else:
         logger.error(f"Errore nella creazione della tabella: {response.content}")
+        return False
 
 
 def get_bases():
@@ -0,0 +1,302 @@
+import glob
+import hashlib
+import itertools
+import logging
+import math
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from .store import output_setting
+
+logger = logging.getLogger(__name__)
+
+# "drop" scarta i duplicati, "flag" li segnala nella colonna Duplicato del CSV, "off" disattiva
+DEDUP_MODE = os.getenv("DEDUP_MODE", "flag")
+DEDUP_DIR = output_setting("DEDUP_DIR", os.getenv("DEDUP_DIR", "dedup"))
+DEDUP_CAPACITY = int(os.getenv("DEDUP_CAPACITY", "1000000"))
+DEDUP_FALSE_POSITIVE = float(os.getenv("DEDUP_FALSE_POSITIVE", "0.01"))
+# Email del job non ancora registrate nell'indice tenute in memoria
+DEDUP_SEEN_LIMIT = int(os.getenv("DEDUP_SEEN_LIMIT", "500000"))
+
+SQLITE_BATCH = 500
+
+
+def email_digests(emails):
+    """Digest da 16 byte delle email normalizzate (minuscole, senza spazi)."""
+    normalized = pd.Series(emails, dtype=object).astype(str).str.strip().str.lower()
+    return [hashlib.blake2b(e.encode(), digest_size=16).digest() for e in normalized]
+
+
+class BloomFilter:
+    """Filtro di Bloom su array numpy, con posizioni calcolate per doppio hashing."""
+
+    def __init__(self, capacity, false_positive=DEDUP_FALSE_POSITIVE, bits=None, count=0):
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(false_positive) / math.log(2) ** 2), 64)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bits if bits is not None else np.zeros((self.size + 7) // 8, np.uint8)
+        self.count = count
+
+    def _positions(self, digests):
+        pairs = np.frombuffer(b"".join(digests), dtype="<u8").reshape(-1, 2)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            positions = pairs[:, :1] + steps * (pairs[:, 1:] | np.uint64(1))
+        return positions % np.uint64(self.size)
+
+    def contains(self, digests):
+        if not digests:
+            return np.zeros(0, bool)
+        positions = self._positions(digests)
+        bits = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=1)
+
+    def add(self, digests):
+        if not digests:
+            return
+        positions = self._positions(digests).ravel()
+        masks = np.left_shift(1, (positions & np.uint64(7)).astype(np.uint8)).astype(np.uint8)
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), masks)
+        self.count += len(digests)
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.array([self.capacity, self.count], np.int64))
+            np.save(f, self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            capacity, count = np.load(f)
+            bits = np.load(f)
+        return cls(int(capacity), bits=bits, count=int(count))
+
+
+class DedupIndex:
+    """Indice persistente delle email già viste per una tabella NocoDB.
+
+    I digest sono salvati in SQLite; un filtro di Bloom salvato accanto evita
+    di interrogare il database per le email nuove, che sono la maggioranza.
+    Le modifiche al filtro avvengono in una transazione IMMEDIATE sul
+    database, che le serializza tra processi: ogni scrittore ricarica il
+    filtro salvato dagli altri prima di aggiungere le proprie chiavi.
+    """
+
+    def __init__(self, table_id, directory=DEDUP_DIR):
+        os.makedirs(directory, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_-]", "_", table_id)
+        self.table_id = table_id
+        self.bloom_path = os.path.join(directory, f"{name}.bloom")
+        self._conn = sqlite3.connect(os.path.join(directory, f"{name}.sqlite3"), timeout=60)
+        self._conn.executescript(
+            """CREATE TABLE IF NOT EXISTS keys (key BLOB PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                table_id TEXT,
+                lookups INTEGER NOT NULL DEFAULT 0,
+                hits INTEGER NOT NULL DEFAULT 0,
+                file_duplicates INTEGER NOT NULL DEFAULT 0
+            );"""
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO stats (id, table_id) VALUES (1, ?)", (table_id,)
+        )
+        self._conn.commit()
+        self._bloom = None
+        self._bloom_version = None
+
+    def _key_count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+
+    @contextmanager
+    def _locked(self):
+        """Transazione IMMEDIATE: un solo processo alla volta modifica chiavi e filtro."""
+        if self._conn.in_transaction:
+            yield
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+
+    def _saved_version(self):
+        # os.replace crea un nuovo file a ogni salvataggio: l'inode cambia
+        # anche quando la risoluzione di mtime non basta a distinguerli
+        try:
+            stat = os.stat(self.bloom_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _rebuild_bloom(self, capacity):
+        logger.info(f"Dedup {self.table_id}: ricostruzione filtro (capacità {capacity})")
+        bloom = BloomFilter(capacity)
+        cursor = self._conn.execute("SELECT key FROM keys")
+        while rows := cursor.fetchmany(100_000):
+            bloom.add([row[0] for row in rows])
+        bloom.save(self.bloom_path)
+        return bloom
+
+    def _get_bloom(self):
+        """Filtro aggiornato: ricaricato se un altro processo lo ha salvato."""
+        version = self._saved_version()
+        if self._bloom is None or version != self._bloom_version:
+            if version is None:
+                with self._locked():
+                    # Un altro processo può averlo ricostruito nel frattempo
+                    if self._saved_version() is None:
+                        count = self._key_count()
+                        self._rebuild_bloom(max(DEDUP_CAPACITY, count * 2))
+            self._bloom = BloomFilter.load(self.bloom_path)
+            self._bloom_version = self._saved_version()
+        return self._bloom
+
+    def contains(self, digests):
+        """Maschera delle chiavi già presenti nell'indice."""
+        found = np.zeros(len(digests), bool)
+        candidates = np.flatnonzero(self._get_bloom().contains(digests))
+        for start in range(0, len(candidates), SQLITE_BATCH):
+            batch = candidates[start : start + SQLITE_BATCH]
+            keys = [digests[i] for i in batch]
+            placeholders = ",".join("?" * len(keys))
+            present = {
+                row[0]
+                for row in self._conn.execute(
+                    f"SELECT key FROM keys WHERE key IN ({placeholders})", keys
+                )
+            }
+            found[batch] = [key in present for key in keys]
+        return found
+
+    def add(self, digests):
+        """Aggiunge le chiavi all'indice e al filtro di Bloom."""
+        if not digests:
+            return
+        with self._locked():
+            bloom = self._get_bloom()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO keys (key) VALUES (?)", ((d,) for d in digests)
+            )
+            if bloom.count + len(digests) > bloom.capacity:
+                self._bloom = self._rebuild_bloom(bloom.capacity * 4)
+            else:
+                bloom.add(digests)
+                bloom.save(self.bloom_path)
+            self._bloom_version = self._saved_version()
+
+    def record_lookups(self, lookups, hits, file_duplicates):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE stats SET lookups = lookups + ?, hits = hits + ?, "
+                "file_duplicates = file_duplicates + ? WHERE id = 1",
+                (lookups, hits, file_duplicates),
+            )
+
+    def stats(self):
+        lookups, hits, file_duplicates = self._conn.execute(
+            "SELECT lookups, hits, file_duplicates FROM stats WHERE id = 1"
+        ).fetchone()
+        bloom = self._get_bloom()
+        return {
+            "table_id": self.table_id,
+            "keys": self._key_count(),
+            "lookups": lookups,
+            "hits": hits,
+            "file_duplicates": file_duplicates,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "bloom_bytes": int(bloom.bits.nbytes),
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+class DedupFilter:
+    """Deduplica delle righe di un job rispetto al file stesso e all'indice.
+
+    `apply` segnala o scarta i duplicati prima della verifica DNS; `commit`
+    registra le email delle righe effettivamente scritte in NocoDB.
+    Le email viste nel job e non ancora registrate restano in memoria, al
+    più le ultime `seen_limit`.
+    """
+
+    def __init__(
+        self, table_id, mode=DEDUP_MODE, directory=DEDUP_DIR, seen_limit=DEDUP_SEEN_LIMIT
+    ):
+        self.mode = mode
+        self.index = DedupIndex(table_id, directory)
+        self.dropped = 0
+        self.seen_limit = seen_limit
+        # Dizionario usato come insieme ordinato, per scartare le più vecchie
+        self._seen = {}
+
+    def apply(self, df, column="Email Corretta", valid_column="Email Valida"):
+        # Dalla cache la colonna torna come testo: "False" non va letto come vero
+        valid = df[valid_column].astype(str).eq("True").to_numpy()
+        digests = email_digests(df.loc[valid, column])
+        in_file = np.array([d in self._seen for d in digests], bool)
+        in_file |= pd.Series(digests, dtype=object).duplicated().to_numpy()
+        self._remember(digests)
+        seen_before = self.index.contains(digests)
+        self.index.record_lookups(len(digests), int(seen_before.sum()), int(in_file.sum()))
+        duplicate = np.zeros(len(df), bool)
+        duplicate[valid] = in_file | seen_before
+        logger.info(
+            f"Dedup: {int(seen_before.sum())} già presenti, "
+            f"{int(in_file.sum())} duplicati nel file"
+        )
+        if self.mode == "drop":
+            if not duplicate.any():
+                return df
+            self.dropped += int(duplicate.sum())
+            return df[~duplicate].copy()
+        df["Duplicato"] = duplicate
+        return df
+
+    def _remember(self, digests):
+        self._seen.update(dict.fromkeys(digests))
+        excess = len(self._seen) - self.seen_limit
+        if excess > 0:
+            for digest in list(itertools.islice(self._seen, excess)):
+                del self._seen[digest]
+
+    def commit(self, df, column="Email Corretta"):
+        if "Duplicato" in df.columns:
+            df = df[df["Duplicato"].astype(str) != "True"]
+        digests = email_digests(df[column])
+        self.index.add(digests)
+        # Ora le trova l'indice: non serve più tenerle in memoria
+        for digest in digests:
+            self._seen.pop(digest, None)
+
+    def close(self):
+        self.index.close()
+
+
+def all_stats(directory=DEDUP_DIR):
+    """Statistiche di tutti gli indici presenti nella cartella."""
+    stats = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.sqlite3"))):
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute("SELECT table_id FROM stats WHERE id = 1").fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            continue
+        index = DedupIndex(row[0], directory)
+        try:
+            stats.append(index.stats())
+        finally:
+            index.close()
+    return stats
@@ -0,0 +1,135 @@
+import re
+from collections import Counter
+
+import pandas as pd
+
+# Provider di posta più diffusi, in ordine di priorità in caso di parità
+COMMON_DOMAINS = (
+    "gmail.com",
+    "libero.it",
+    "hotmail.it",
+    "hotmail.com",
+    "yahoo.it",
+    "yahoo.com",
+    "outlook.it",
+    "outlook.com",
+    "live.it",
+    "live.com",
+    "virgilio.it",
+    "alice.it",
+    "tiscali.it",
+    "tin.it",
+    "icloud.com",
+    "fastwebnet.it",
+    "email.it",
+    "inwind.it",
+    "iol.it",
+    "msn.com",
+    "me.com",
+    "protonmail.com",
+    "pec.it",
+    "legalmail.it",
+    "arubapec.it",
+    "postecert.it",
+    "aruba.it",
+)
+
+DOMAIN_PATTERN = re.compile(r"^[a-z0-9-]+(\.[a-z0-9-]+)+$")
+
+# Trigrammi presenti in troppi domini (es. "com$") non aiutano a selezionare
+MAX_POSTINGS = 2000
+MAX_CANDIDATES = 32
+
+
+def trigrams(text):
+    """Restituisce l'insieme dei trigrammi della stringa, con delimitatori."""
+    padded = f"^{text}$"
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_distance(a, b, bound):
+    """Distanza di Levenshtein tra a e b, o bound + 1 se la supera."""
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+    return min(previous[-1], bound + 1)
+
+
+class DomainIndex:
+    """Indice a trigrammi dei domini noti per correggere le email in tempo costante.
+
+    Viene costruito una volta per job con i provider comuni e i domini del file;
+    i suggerimenti sono memorizzati per dominio, che si ripete molto tra le righe.
+    """
+
+    def __init__(self, domains=(), providers=COMMON_DOMAINS, max_distance=2):
+        self.max_distance = max_distance
+        self._domains = []
+        self._ids = {}
+        self._postings = {}
+        self._memo = {}
+        self.add(providers)
+        self.add(domains)
+
+    def __len__(self):
+        return len(self._domains)
+
+    def __contains__(self, domain):
+        return domain in self._ids
+
+    def add(self, domains):
+        """Aggiunge domini all'indice, ignorando valori nulli o non validi."""
+        for domain in pd.unique(pd.Series(list(domains), dtype=object).dropna()):
+            if not isinstance(domain, str):
+                continue
+            domain = domain.lower().strip()
+            if domain in self._ids or not DOMAIN_PATTERN.match(domain):
+                continue
+            self._ids[domain] = len(self._domains)
+            self._domains.append(domain)
+            for gram in trigrams(domain):
+                self._postings.setdefault(gram, []).append(self._ids[domain])
+        self._memo.clear()
+
+    def _candidates(self, domain):
+        postings = [
+            self._postings[gram] for gram in trigrams(domain) if gram in self._postings
+        ]
+        selective = [p for p in postings if len(p) <= MAX_POSTINGS]
+        counts = Counter()
+        for posting in selective or postings:
+            counts.update(posting)
+        return [self._domains[i] for i, _ in counts.most_common(MAX_CANDIDATES)]
+
+    def suggest(self, domain):
+        """Restituisce il dominio noto più vicino a `domain`, o None."""
+        domain = domain.lower().strip()
+        if domain in self._memo:
+            return self._memo[domain]
+        if domain in self._ids:
+            self._memo[domain] = domain
+            return domain
+        bound = self.max_distance if len(domain) > 5 else 1
+        best, best_key = None, None
+        for candidate in self._candidates(domain):
+            distance = bounded_distance(domain, candidate, bound)
+            if "." not in domain:
+                # "gmail" va confrontato anche con "gmail" di "gmail.com"
+                label = candidate.rsplit(".", 1)[0]
+                distance = min(distance, bounded_distance(domain, label, bound))
+            if distance > bound:
+                continue
+            key = (distance, self._ids[candidate])
+            if best_key is None or key < best_key:
+                best, best_key = candidate, key
+        self._memo[domain] = best
+        return best
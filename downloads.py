@@ -0,0 +1,179 @@
+import logging
+import os
+import re
+import zipfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # zstd facoltativo: senza il pacchetto si usa solo gzip
+    zstandard = None
+
+# Copie compresse dei file puliti scritte da clean_data accanto all'originale
+PRECOMPRESS_OUTPUT = os.getenv("PRECOMPRESS_OUTPUT", "true").lower() == "true"
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "9"))
+
+STREAM_CHUNK = 256 * 1024
+
+# Codifiche supportate, in ordine di preferenza a parità di q, con l'estensione della copia
+ENCODINGS = {"zstd": ".zst", "gzip": ".gz"} if zstandard is not None else {"gzip": ".gz"}
+COMPRESSED_SUFFIXES = (".gz", ".zst")
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+class RangeNotSatisfiable(Exception):
+    """L'intervallo richiesto è fuori dal file."""
+
+
+def _compressor(encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    # wbits 31: formato gzip, con intestazione e CRC
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def precompress(path):
+    """Scrive accanto a `path` le copie compresse per ogni codifica; restituisce i percorsi."""
+    written = []
+    for encoding, suffix in ENCODINGS.items():
+        target = path + suffix
+        with open(target + ".part", "wb") as dst:
+            for chunk in iter_compressed(path, encoding):
+                dst.write(chunk)
+        os.replace(target + ".part", target)
+        written.append(target)
+    return written
+
+
+def negotiate_encoding(accept_encoding):
+    """Codifica preferita tra ENCODINGS secondo Accept-Encoding, o None per l'originale."""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name] = q
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compressed_sibling(path, encoding):
+    """Copia compressa di `path` per `encoding`, se esiste e non è più vecchia dell'originale."""
+    sibling = path + ENCODINGS[encoding]
+    try:
+        if os.stat(sibling).st_mtime >= os.stat(path).st_mtime:
+            return sibling
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def parse_range(header, size):
+    """Intervallo (inizio, fine inclusa) di un header Range a intervallo singolo.
+
+    Restituisce None se l'header manca o non è supportato (più intervalli,
+    unità diverse da bytes): in quel caso si risponde con il file intero.
+    """
+    if not header:
+        return None
+    match = RANGE_PATTERN.fullmatch(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Ultimi N byte
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def iter_file(path, start=0, end=None):
+    """Contenuto di `path` tra `start` e `end` (inclusa), a blocchi."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = (end - start + 1) if end is not None else None
+        while remaining is None or remaining > 0:
+            size = STREAM_CHUNK if remaining is None else min(STREAM_CHUNK, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+def iter_compressed(path, encoding):
+    """Contenuto di `path` compresso al volo con `encoding`."""
+    compressor = _compressor(encoding)
+    for chunk in iter_file(path):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _StreamSink:
+    """Destinazione non posizionabile per zipfile: accumula i byte da inviare."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def iter_zip(paths):
+    """Archivio zip dei file indicati, prodotto in streaming senza file temporanei.
+
+    Su una destinazione non posizionabile zipfile scrive dimensioni e CRC
+    dopo ogni file (data descriptor), quindi l'archivio può essere inviato
+    man mano che viene compresso.
+    """
+    sink = _StreamSink()
+    archive = zipfile.ZipFile(
+        sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=GZIP_LEVEL
+    )
+    with archive:
+        for path in paths:
+            info = zipfile.ZipInfo.from_file(path, os.path.basename(path))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, "w") as entry:
+                for chunk in iter_file(path):
+                    entry.write(chunk)
+                    if data := sink.take():
+                        yield data
+            if data := sink.take():
+                yield data
+    yield sink.take()
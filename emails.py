@@ -0,0 +1,82 @@
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+from .metrics import EMAIL_CHECKS
+
+logger = logging.getLogger(__name__)
+
+# Stessi criteri di is_valid_email, separati per parte locale e dominio
+EMAIL_PATTERN = re.compile(r"[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
+LOCAL_PATTERN = re.compile(r"[a-zA-Z0-9_.+-]+")
+DOMAIN_PART_PATTERN = re.compile(r"[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+")
+URL_DOMAIN_PATTERN = re.compile(r"(?:www\.)?([^/]+)")
+
+# Motivi di scarto, in ordine di verifica
+REASONS = ("empty", "missing_at", "invalid_local", "invalid_domain")
+
+
+def normalize_emails(emails):
+    """Email come testo, senza spazi esterni e in minuscolo (None diventa "none")."""
+    return pd.Series(emails, dtype=object).astype(str).str.strip().str.lower()
+
+
+def validate_emails(emails, normalize=True):
+    """Verifica una colonna di email in un'unica passata.
+
+    Restituisce un DataFrame con lo stesso indice e le colonne `email`
+    (normalizzata se `normalize`), `valid`, `domain` (la parte dopo la prima
+    "@", solo per le email valide) e `reason` (None per le valide, altrimenti
+    uno dei REASONS). I conteggi per esito finiscono nelle metriche.
+    """
+    if normalize:
+        emails = normalize_emails(emails)
+    else:
+        emails = pd.Series(emails, dtype=object)
+    text = emails.where(emails.map(type) == str)
+    valid = text.str.fullmatch(EMAIL_PATTERN).eq(True).to_numpy()
+    if len(text):
+        parts = text.str.partition("@")
+    else:
+        parts = pd.DataFrame(index=text.index, columns=[0, 1, 2], dtype=object)
+    domain = parts[2].to_numpy(dtype=object)
+
+    reason = np.full(len(emails), None, dtype=object)
+    invalid = ~valid
+    if invalid.any():
+        is_empty = text.isna() | text.isin(["", "nan", "none"])
+        missing_at = ~is_empty & parts[1].ne("@")
+        bad_local = ~(is_empty | missing_at) & ~parts[0].str.fullmatch(LOCAL_PATTERN).eq(True)
+        reason[invalid] = "invalid_domain"
+        reason[invalid & bad_local.to_numpy()] = "invalid_local"
+        reason[invalid & missing_at.to_numpy()] = "missing_at"
+        reason[invalid & is_empty.to_numpy()] = "empty"
+
+    result = pd.DataFrame(
+        {
+            "email": emails.to_numpy(dtype=object),
+            "valid": valid,
+            "domain": np.where(valid, domain, None),
+            "reason": reason,
+        },
+        index=emails.index,
+    )
+    counts = result["reason"].fillna("valid").value_counts()
+    for outcome, count in counts.items():
+        EMAIL_CHECKS.inc(int(count), result=outcome)
+    logger.info(f"Email verificate: {counts.to_dict()}")
+    return result
+
+
+def extract_domains(urls):
+    """Dominio di una colonna di URL, con la stessa regola di extract_domain.
+
+    I valori senza corrispondenza restano invariati, quelli nulli diventano None.
+    """
+    urls = pd.Series(urls, dtype=object)
+    is_text = urls.map(type) == str
+    domains = urls.where(is_text).str.extract(URL_DOMAIN_PATTERN, expand=False)
+    domains = domains.where(domains.notna(), urls)
+    return domains.where(urls.notna(), None).astype(object)
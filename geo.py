@@ -0,0 +1,268 @@
+import glob
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from .domains import bounded_distance, trigrams
+from .store import output_setting
+
+logger = logging.getLogger(__name__)
+
+GEO_CSV = os.getenv("GEO_CSV", "gi_comuni_cap.csv")
+GEO_CACHE_DIR = os.getenv("GEO_CACHE_DIR", ".cache")
+
+# Somiglianza minima (da 0 a 1) perché una città venga sostituita dal comune trovato
+CITY_MATCH_THRESHOLD = output_setting(
+    "CITY_MATCH_THRESHOLD", float(os.getenv("CITY_MATCH_THRESHOLD", "0.8"))
+)
+MAX_CITY_CANDIDATES = 32
+# Nomi distinti ricordati dalla ricerca approssimata prima di ripartire da zero
+CITY_MEMO_SIZE = 100_000
+NAME_SEPARATORS = re.compile(r"[^a-z0-9]+")
+
+# Colonne del CSV ISTAT conservate nell'indice: (campo, colonna sorgente)
+TEXT_FIELDS = [
+    ("cap", "cap"),
+    ("comune", "denominazione_ita"),
+    ("sigla_provincia", "sigla_provincia"),
+    ("provincia", "denominazione_provincia"),
+    ("regione", "denominazione_regione"),
+    ("codice_istat", "codice_istat"),
+]
+FLOAT_FIELDS = [("lat", "lat"), ("lon", "lon")]
+
+
+def _file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+
+def _build_records(csv_path):
+    """Legge il CSV dei comuni e lo converte in un array strutturato compatto."""
+    # keep_default_na=False: "NA" è la sigla di Napoli e "None" un comune
+    df = pd.read_csv(
+        csv_path, sep=";", encoding="utf-8", dtype=str, keep_default_na=False
+    )
+    columns = {}
+    for field, source in TEXT_FIELDS:
+        encoded = df[source].str.strip().str.encode("utf-8")
+        width = max(int(encoded.str.len().max() or 0), 1)
+        columns[field] = (f"S{width}", encoded.to_numpy())
+    for field, source in FLOAT_FIELDS:
+        values = pd.to_numeric(df[source].str.replace(",", "."), errors="coerce")
+        columns[field] = ("f8", values.to_numpy())
+    records = np.empty(len(df), dtype=[(name, kind) for name, (kind, _) in columns.items()])
+    for name, (_, values) in columns.items():
+        records[name] = values
+    return records
+
+
+def load_records(csv_path=GEO_CSV, cache_dir=GEO_CACHE_DIR):
+    """Restituisce l'array dei comuni mappato in memoria in sola lettura.
+
+    La cache binaria è identificata dall'hash del CSV: se il CSV cambia viene
+    ricostruita, e le versioni precedenti vengono rimosse.
+    """
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    cache_path = os.path.join(cache_dir, f"{stem}.{_file_digest(csv_path)}.npy")
+    if not os.path.exists(cache_path):
+        logger.info(f"Costruzione cache geografica: {cache_path}")
+        os.makedirs(cache_dir, exist_ok=True)
+        records = _build_records(csv_path)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, records, allow_pickle=False)
+        os.replace(tmp_path, cache_path)
+        for old in glob.glob(os.path.join(cache_dir, f"{stem}.*.npy")):
+            if old != cache_path:
+                os.remove(old)
+    return np.load(cache_path, mmap_mode="r", allow_pickle=False)
+
+
+def normalize_city(name):
+    """Nome di città confrontabile: minuscolo, senza accenti, apostrofi e trattini."""
+    text = unicodedata.normalize("NFKD", str(name))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return NAME_SEPARATORS.sub(" ", text.lower()).strip()
+
+
+class ComuneMatcher:
+    """Ricerca approssimata dei comuni per nome, con un indice a trigrammi.
+
+    Come in DomainIndex, i candidati sono i comuni con più trigrammi in comune
+    con il nome cercato, poi confrontati con la distanza di Levenshtein; con
+    una provincia nota (anche come sigla in fondo al nome, "Taviano LE") la
+    ricerca è limitata ai suoi comuni. I risultati sono
+    memorizzati per nome e provincia, che si ripetono molto tra le righe.
+    """
+
+    def __init__(self, frame, threshold=CITY_MATCH_THRESHOLD):
+        self.threshold = threshold
+        # Un record per comune, con il primo e l'ultimo dei suoi CAP
+        frame = frame.sort_values(["codice_istat", "cap"])
+        first = frame.drop_duplicates("codice_istat").set_index("codice_istat")
+        last = frame.drop_duplicates("codice_istat", keep="last").set_index("codice_istat")
+        comuni = first[["comune", "sigla_provincia", "regione"]].assign(
+            cap_min=first["cap"], cap_max=last["cap"]
+        )
+        self._records = comuni.to_dict("records")
+        self._names = [normalize_city(name) for name in comuni["comune"]]
+        self._exact = {}
+        self._postings = {}
+        self._provinces = {}
+        for i, (name, record) in enumerate(zip(self._names, self._records)):
+            self._exact.setdefault(name, []).append(i)
+            for gram in trigrams(name):
+                self._postings.setdefault(gram, []).append(i)
+            self._provinces.setdefault(record["sigla_provincia"], set()).add(i)
+        self._memo = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def match(self, name, province=None):
+        """Comune più vicino a `name`, nella provincia `province` se nota.
+
+        Restituisce un dizionario con comune, sigla_provincia, regione, il
+        primo e l'ultimo CAP (cap_min, cap_max) e score, la somiglianza da 0
+        a 1; None se nessun comune supera la soglia o se il nome è ambiguo
+        (più comuni omonimi senza provincia).
+        """
+        key = (name, province)
+        if key in self._memo:
+            return self._memo[key]
+        if len(self._memo) >= CITY_MEMO_SIZE:
+            self._memo.clear()
+        result = self._match(normalize_city(name), (province or "").strip().upper())
+        self._memo[key] = result
+        return result
+
+    def _match(self, query, province):
+        allowed = self._provinces.get(province)
+        words = query.split()
+        tail = words[-1].upper() if len(words) > 1 else ""
+        if tail in self._provinces and (allowed is None or tail == province):
+            # "Roma RM", "Roma (RM)": la sigla nel nome indica la provincia
+            result = self._search(" ".join(words[:-1]), self._provinces[tail])
+            if result is not None or tail == province:
+                return result
+        return self._search(query, allowed)
+
+    def _search(self, query, allowed):
+        if not query:
+            return None
+        exact = [i for i in self._exact.get(query, ()) if allowed is None or i in allowed]
+        if exact:
+            return self._result(exact, 1.0)
+        grams = trigrams(query)
+        counts = Counter()
+        for gram in grams:
+            counts.update(self._postings.get(gram, ()))
+        if allowed is not None:
+            counts = Counter({i: n for i, n in counts.items() if i in allowed})
+        best, best_score = [], 0.0
+        for i, shared in counts.most_common(MAX_CITY_CANDIDATES):
+            candidate = self._names[i]
+            longest = max(len(query), len(candidate))
+            bound = int(longest * (1 - self.threshold))
+            # Ogni modifica toglie al più tre trigrammi: con pochi in comune
+            # la distanza supera di sicuro il limite
+            if shared < len(grams) - 3 * bound:
+                continue
+            distance = bounded_distance(query, candidate, bound)
+            if distance > bound:
+                continue
+            score = 1 - distance / longest
+            if score > best_score:
+                best, best_score = [i], score
+            elif score == best_score:
+                best.append(i)
+        return self._result(best, best_score)
+
+    def _result(self, ids, score):
+        if len(ids) != 1:
+            return None
+        return {**self._records[ids[0]], "score": round(score, 3)}
+
+
+class GeoIndex:
+    """Indice immutabile del riferimento comuni/CAP.
+
+    I record sono condivisi tra processi tramite mmap; le viste pandas per
+    CAP e per comune vengono costruite alla prima richiesta.
+    """
+
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def _frame(self):
+        data = {}
+        for field, _ in TEXT_FIELDS:
+            data[field] = np.char.decode(np.asarray(self.records[field]), "utf-8")
+        for field, _ in FLOAT_FIELDS:
+            data[field] = np.asarray(self.records[field])
+        return pd.DataFrame(data)
+
+    @cached_property
+    def caps(self):
+        """Riferimento indicizzato per CAP (in caso di CAP condiviso vale l'ultimo)."""
+        return self._frame().drop_duplicates("cap", keep="last").set_index("cap")
+
+    @cached_property
+    def comuni(self):
+        """Riferimento indicizzato per nome del comune in minuscolo."""
+        df = self._frame()
+        df["key"] = df["comune"].str.lower()
+        return df.drop_duplicates("key").set_index("key")
+
+    @cached_property
+    def caps_by_comune(self):
+        """Elenco ordinato dei CAP di ogni comune, indicizzato per codice ISTAT."""
+        return self._frame().groupby("codice_istat")["cap"].agg(sorted)
+
+    @cached_property
+    def matcher(self):
+        """Ricerca approssimata dei comuni per nome (vedi ComuneMatcher)."""
+        return ComuneMatcher(self._frame())
+
+    def lookup_cap(self, cap):
+        """Restituisce il record del CAP come dizionario, o None."""
+        if cap not in self.caps.index:
+            return None
+        return {"cap": cap, **self.caps.loc[cap].to_dict()}
+
+    def lookup_comune(self, name):
+        """Restituisce il record del comune (ricerca esatta, senza maiuscole), o None."""
+        key = str(name).strip().lower()
+        if key not in self.comuni.index:
+            return None
+        return self.comuni.loc[key].to_dict()
+
+
+_index = None
+_index_stat = None
+_lock = threading.Lock()
+
+
+def get_geo_index(csv_path=GEO_CSV):
+    """Restituisce l'indice condiviso del processo, ricaricandolo se il CSV cambia."""
+    global _index, _index_stat
+    stat = os.stat(csv_path)
+    key = (csv_path, stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if _index is None or _index_stat != key:
+            _index = GeoIndex(load_records(csv_path))
+            _index_stat = key
+            logger.info(f"Indice geografico caricato: {len(_index)} record")
+        return _index
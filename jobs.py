@@ -0,0 +1,379 @@
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from multiprocessing.connection import wait
+
+from .metrics import JOB_QUEUE_DEPTH, JOBS_FINISHED, JOBS_RUNNING, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Parametri dello scheduler, configurabili da ambiente
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "20"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "3600"))
+# Secondi concessi a un job terminato per chiudere il proprio pool di processi
+JOB_KILL_GRACE = float(os.getenv("JOB_KILL_GRACE", "30"))
+JOB_DB = os.getenv("JOB_DB", "jobs.sqlite3")
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class QueueFull(Exception):
+    """La coda dei job ha raggiunto la capienza massima."""
+
+
+def _exit_on_sigterm(signum, frame):
+    # SystemExit esegue i blocchi finally: il ChunkPool del job viene chiuso
+    # e la memoria condivisa delle porzioni rimossa
+    raise SystemExit(f"Job terminato dal segnale {signum}")
+
+
+def _init_job_process():
+    """Rende il processo del job capo di un gruppo e gestisce SIGTERM."""
+    os.setpgrp()
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
+
+
+def _kill_group(process):
+    """Uccide il processo del job e i processi figli (il suo ChunkPool)."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+
+
+def _run_job(job_id, table_id, filename, input_hash, conn):
+    """Esegue la pulizia di un file nel processo worker.
+
+    Insieme a ogni evento di avanzamento vengono inviati al processo
+    principale gli incrementi delle metriche raccolte nel worker. Il
+    processo guida un proprio gruppo, che comprende i processi del
+    ChunkPool; a SIGTERM esce chiudendo il pool.
+    """
+    _init_job_process()
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+
+    def on_progress(event):
+        conn.send(("progress", event))
+        conn.send(("metrics", REGISTRY.drain()))
+
+    try:
+        from .clean import clean_data
+
+        clean_data(
+            table_id, filename, on_progress=on_progress, job_id=job_id, input_hash=input_hash
+        )
+        conn.send(("metrics", REGISTRY.drain()))
+        conn.send(("completed", None))
+    except Exception as e:
+        logger.exception(f"Errore nel job {job_id}")
+        conn.send(("metrics", REGISTRY.drain()))
+        conn.send(("failed", str(e)))
+    finally:
+        conn.close()
+
+
+class JobManager:
+    """Coda persistente dei job di pulizia eseguiti in processi worker.
+
+    I job sono salvati in SQLite e sopravvivono ai riavvii; al massimo
+    `workers` processi sono attivi contemporaneamente e la coda accetta al
+    più `queue_size` job in attesa o in esecuzione. Un job annullato o
+    scaduto riceve SIGTERM e occupa il suo posto finché il processo non
+    esce; dopo `kill_grace` secondi viene ucciso con tutto il suo gruppo.
+    """
+
+    def __init__(
+        self,
+        db_path=JOB_DB,
+        workers=JOB_WORKERS,
+        queue_size=JOB_QUEUE_SIZE,
+        timeout=JOB_TIMEOUT,
+        kill_grace=JOB_KILL_GRACE,
+        upload_folder="daPulire",
+        on_finish=None,
+        on_progress=None,
+    ):
+        self.db_path = db_path
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.kill_grace = kill_grace
+        self.upload_folder = upload_folder
+        self.on_finish = on_finish
+        self.on_progress = on_progress
+        self._context = multiprocessing.get_context("spawn")
+        # job_id -> (processo, estremo di lettura della pipe)
+        self._running = {}
+        # job_id -> istante del SIGTERM, per i job annullati o scaduti
+        self._terminated = {}
+        # job_id -> {fase: ultimo evento di avanzamento}
+        self._progress = {}
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                table_id TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                error TEXT,
+                input_hash TEXT
+            )"""
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "input_hash" not in columns:
+            # Database creato prima dell'archivio dei caricamenti
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN input_hash TEXT")
+        self._conn.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor
+
+    def _set_status(self, job_id, status, error=None):
+        finished = datetime.now().isoformat() if status not in ACTIVE_STATUSES else None
+        self._execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+            (status, finished, error, job_id),
+        )
+
+    def start(self):
+        """Rimette in coda i job interrotti e avvia il dispatcher."""
+        restarted = self._execute(
+            "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'"
+        ).rowcount
+        if restarted:
+            logger.warning(f"Job rimessi in coda dopo il riavvio: {restarted}")
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._dispatch_loop, name="job-dispatcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Ferma il dispatcher; i job in esecuzione torneranno in coda al riavvio."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            running = list(self._running.values())
+            self._running.clear()
+            self._terminated.clear()
+        for process, _ in running:
+            process.terminate()
+        deadline = time.monotonic() + self.kill_grace
+        for process, reader in running:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                _kill_group(process)
+                process.join()
+            reader.close()
+
+    def queue_depth(self):
+        """Numero di job in attesa o in esecuzione."""
+        row = self._execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", ACTIVE_STATUSES
+        ).fetchone()
+        return row[0]
+
+    def update_metrics(self):
+        """Aggiorna le metriche istantanee della coda."""
+        JOB_QUEUE_DEPTH.set(self.queue_depth())
+        JOBS_RUNNING.set(len(self._running))
+
+    def active_inputs(self):
+        """Hash dei file caricati dai job in attesa o in esecuzione."""
+        rows = self._execute(
+            "SELECT DISTINCT input_hash FROM jobs "
+            "WHERE status IN (?, ?) AND input_hash IS NOT NULL",
+            ACTIVE_STATUSES,
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def capacity(self):
+        """Posti ancora disponibili nella coda."""
+        return max(self.queue_size - self.queue_depth(), 0)
+
+    def submit(self, table_id, filename, input_hash=None):
+        """Accoda un job; solleva QueueFull se la coda è piena.
+
+        Con `input_hash` il file viene letto dall'archivio dei caricamenti
+        invece che da `upload_folder`.
+        """
+        with self._lock:
+            if self.capacity() <= 0:
+                raise QueueFull(f"Coda piena: {self.queue_size} job attivi")
+            job_id = uuid.uuid4().hex
+            self._execute(
+                "INSERT INTO jobs (id, table_id, filename, status, created_at, input_hash) "
+                "VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, table_id, filename, datetime.now().isoformat(), input_hash),
+            )
+        logger.info(f"Job accodato: {job_id} ({filename})")
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """Restituisce lo stato del job, con l'avanzamento per fase, o None."""
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {**dict(row), "progress": self._progress.get(job_id, {})}
+
+    def list_jobs(self, limit=50):
+        """Restituisce gli ultimi job, dal più recente."""
+        rows = self._execute(
+            "SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [self.get(row["id"]) for row in rows]
+
+    def cancel(self, job_id):
+        """Annulla un job in coda o termina quello in esecuzione."""
+        with self._lock:
+            job = self.get(job_id)
+            if job is None or job["status"] not in ACTIVE_STATUSES:
+                return False
+            # Il processo terminato viene raccolto dal dispatcher
+            running = self._running.get(job_id)
+            if running is not None:
+                self._terminate(job_id, running[0])
+            self._set_status(job_id, "cancelled")
+        JOBS_FINISHED.inc(status="cancelled")
+        if job["input_hash"] is None:
+            self._remove_upload(job["filename"])
+        logger.info(f"Job annullato: {job_id}")
+        return True
+
+    def _remove_upload(self, filename):
+        try:
+            os.remove(os.path.join(self.upload_folder, filename))
+        except FileNotFoundError:
+            pass
+
+    def _start_next(self):
+        row = self._execute(
+            "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return False
+        reader, writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_run_job,
+            args=(row["id"], row["table_id"], row["filename"], row["input_hash"], writer),
+            name=f"job-{row['id']}",
+        )
+        process.start()
+        writer.close()
+        self._running[row["id"]] = (process, reader)
+        self._execute(
+            "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+            (datetime.now().isoformat(), row["id"]),
+        )
+        logger.info(f"Job avviato: {row['id']} (pid {process.pid})")
+        return True
+
+    def _terminate(self, job_id, process):
+        """Chiede al processo del job di uscire; viene raccolto dal dispatcher."""
+        if job_id not in self._terminated:
+            self._terminated[job_id] = time.monotonic()
+            process.terminate()
+
+    def _finish(self, job_id, status, error=None):
+        """Registra l'esito del job, se è ancora in esecuzione, e lo notifica."""
+        with self._lock:
+            job = self.get(job_id)
+            if job is None or job["status"] != "running":
+                return
+            self._set_status(job_id, status, error)
+        logger.info(f"Job {job_id} terminato: {status}")
+        JOBS_FINISHED.inc(status=status)
+        if self.on_finish is not None:
+            try:
+                self.on_finish(self.get(job_id))
+            except Exception as e:
+                logger.error(f"Errore nella notifica di fine job: {e}")
+
+    def _reap(self, job_id):
+        """Libera il posto di un job il cui processo è uscito."""
+        with self._lock:
+            running = self._running.pop(job_id, None)
+            self._terminated.pop(job_id, None)
+        if running is not None:
+            running[0].join()
+            running[1].close()
+
+    def _handle_message(self, job_id, message):
+        kind, payload = message
+        if kind == "metrics":
+            REGISTRY.merge(payload)
+            return
+        if kind != "progress":
+            self._finish(job_id, kind, payload)
+            return
+        self._progress.setdefault(job_id, {})[payload["stage"]] = payload
+        if self.on_progress is not None:
+            try:
+                self.on_progress(job_id, payload)
+            except Exception as e:
+                logger.error(f"Errore nella notifica di avanzamento: {e}")
+
+    def _poll(self, job_id, process, reader):
+        """Legge i messaggi del worker e gestisce uscite anomale e timeout."""
+        try:
+            while reader.poll():
+                self._handle_message(job_id, reader.recv())
+        except (EOFError, OSError):
+            pass
+        if job_id not in self._running:
+            return
+        if not process.is_alive():
+            self._finish(job_id, "failed", f"Processo terminato con codice {process.exitcode}")
+            self._reap(job_id)
+            return
+        terminated = self._terminated.get(job_id)
+        if terminated is not None:
+            if time.monotonic() - terminated > self.kill_grace:
+                logger.warning(f"Job {job_id} non uscito dopo SIGTERM: ucciso con i figli")
+                _kill_group(process)
+            return
+        started = datetime.fromisoformat(self.get(job_id)["started_at"]).timestamp()
+        if time.time() - started > self.timeout:
+            self._terminate(job_id, process)
+            self._finish(job_id, "timeout", f"Superato il timeout di {self.timeout}s")
+
+    def _dispatch_loop(self):
+        while not self._stopping.is_set():
+            with self._lock:
+                while len(self._running) < self.workers and self._start_next():
+                    pass
+                running = list(self._running.items())
+            if not running:
+                self._wakeup.wait(timeout=0.5)
+                self._wakeup.clear()
+                continue
+            handles = []
+            for _, (process, reader) in running:
+                handles += [reader, process.sentinel]
+            wait(handles, timeout=0.5)
+            for job_id, (process, reader) in running:
+                self._poll(job_id, process, reader)
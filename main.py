@@ -1,23 +1,43 @@
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
 from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, Form, status
-from fastapi import Request, Depends
-from fastapi.responses import HTMLResponse, FileResponse, RedirectResponse, Response
+from fastapi import Request, Query
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 from fastapi_socketio import SocketManager
 from typing import List
 import os
 from pathlib import Path
-from threading import Thread
 import asyncio
-from jinja2 import Environment, FileSystemLoader
+import sqlite3
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 import logging
-from .db import get_bases, get_all_tables, create_table
+from .auth import SESSION_MAX_AGE, password_fingerprint, signer, user_cache
+from .catalog import SORT_COLUMNS, catalog
+from .db import create_table
+from .dedup import all_stats as dedup_stats
+from .downloads import (
+    RangeNotSatisfiable,
+    compressed_sibling,
+    iter_compressed,
+    iter_file,
+    iter_zip,
+    negotiate_encoding,
+    parse_range,
+)
+from .geo import get_geo_index
+from .history import TOTAL_FIELDS, get_totals, list_runs
+from .jobs import JobManager, QueueFull
+from .metrics import DNS_CACHE_HIT_RATIO, DNS_CACHE_LOOKUPS, REGISTRY
+from .nocodb_client import NocoDBMetaClient
+from .store import UploadWriter, evict
 from pydantic import BaseModel
 from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from passlib.hash import bcrypt
-from sqlalchemy.orm import Session
 from fastapi import Cookie
 from typing import Optional
 from dotenv import load_dotenv
@@ -46,7 +66,7 @@ Path(OUTPUT_CSV_FOLDER).mkdir(exist_ok=True)
 OUTPUT_RAW_FOLDER = "output_raw_csv"
 Path(OUTPUT_RAW_FOLDER).mkdir(exist_ok=True)
 
-env = Environment(loader=FileSystemLoader("templates"))
+env = Environment(loader=FileSystemLoader("templates"), autoescape=select_autoescape(["html"]))
 
 templates = Jinja2Templates(directory="templates")
 
@@ -66,23 +86,28 @@ class User(Base):
     password_hash = Column(String)
 
 
+class SessionGeneration(Base):
+    """Generazione delle sessioni di un utente: il logout la incrementa."""
+
+    __tablename__ = "session_generations"
+    username = Column(String, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+
 # Create tables at bootstrap
 Base.metadata.create_all(bind=engine)
 
 
-# Utility function to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@app.on_event("startup")
+def preload_geo_index():
+    """Prepara all'avvio la cache binaria del riferimento comuni/CAP."""
+    get_geo_index()
 
 
 # Funzione per creare un utente
 def create_user():
-    users = os.environ["CLEAN_USERS"]
-    created: bool = bool(os.environ.get("USERS_CREATED", "False").lower())
+    users = os.environ.get("CLEAN_USERS", "")
+    created = os.environ.get("USERS_CREATED", "False").lower() == "true"
     if created:
         # logger.info("Utenti già creati.")
         return
@@ -90,7 +115,7 @@ def create_user():
     if users:
         users = users.split("|")
         for user in users:
-            username, password = user.split(":")
+            username, password = user.split(":", 1)
             db = SessionLocal()
             if db.query(User).filter_by(username=username).first():
                 logger.warning("Utente già esistente.")
@@ -99,20 +124,83 @@ def create_user():
                 user = User(username=username, password_hash=hashed)
                 db.add(user)
                 db.commit()
+                user_cache.invalidate(username)
                 logger.info("Utente creato.")
             db.close()
-        created = True
         os.environ["USERS_CREATED"] = "True"
         logger.info("Utenti creati con successo.")
 
 
-def get_current_user(
-    session: Optional[str] = Cookie(None), db: Session = Depends(get_db)
-):
+@app.on_event("startup")
+def provision_users():
+    """Crea all'avvio gli utenti configurati in CLEAN_USERS."""
+    create_user()
+
+
+def load_user(username):
+    """Legge l'utente dal database come dizionario, o None."""
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+        if user is None:
+            return None
+        sessions = db.get(SessionGeneration, username)
+        return {
+            "id": user.id,
+            "username": user.username,
+            "password_hash": user.password_hash,
+            "session_generation": sessions.generation if sessions else 0,
+        }
+    finally:
+        db.close()
+
+
+def end_sessions(username):
+    """Invalida tutte le sessioni dell'utente incrementandone la generazione."""
+    db = SessionLocal()
+    try:
+        updated = (
+            db.query(SessionGeneration)
+            .filter(SessionGeneration.username == username)
+            .update({SessionGeneration.generation: SessionGeneration.generation + 1})
+        )
+        if not updated:
+            db.add(SessionGeneration(username=username, generation=1))
+        db.commit()
+    finally:
+        db.close()
+
+
+async def session_user(session: Optional[str]):
+    """Utente del cookie di sessione firmato, o None se assente, scaduto o non valido.
+
+    La firma è verificata senza database; il record utente arriva dalla cache
+    e solo alla prima richiesta dal database.
+    """
+    if session is None:
+        return None
+    payload = signer.loads(session)
+    if payload is None:
+        return None
+    username, fingerprint, generation = payload
+    user = user_cache.get(username)
+    if user is None:
+        user = await run_in_threadpool(load_user, username)
+        if user is None:
+            return None
+        user_cache.put(user)
+    if password_fingerprint(user["password_hash"]) != fingerprint:
+        return None
+    if user["session_generation"] != generation:
+        return None
+    return user
+
+
+async def get_current_user(session: Optional[str] = Cookie(None)):
     if session is None:
         logger.warning("Session cookie is missing.")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
-    user = db.query(User).filter(User.username == session).first()
+    user = await session_user(session)
     if user is None:
         logger.warning("Invalid session cookie.")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
@@ -128,26 +216,68 @@ class TableCreateRequest(BaseModel):
     table_name: str
 
 
-async def notify_clients():
-    """Invia un messaggio a tutti i client connessi per ricaricare la pagina"""
-    for websocket in active_connections:
+# Event loop del server, l'unico che può scrivere sulle WebSocket
+app_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def notify_clients(message: Optional[dict] = None):
+    """Invia un messaggio a tutti i client connessi (di default: ricarica la pagina)"""
+    message = message or {"event": "task_completed"}
+    for websocket in list(active_connections):
         try:
-            logger.info("Notifying a client about task completion.")
-            await websocket.send_json({"event": "task_completed"})
+            await websocket.send_json(message)
         except Exception as e:
             logger.error(f"Errore durante l'invio del messaggio: {str(e)}")
 
 
-def execute_script_in_background(table_id, filename):
-    """Esegue la funzione di pulizia e notifica i client WebSocket al termine"""
+def publish(message: dict):
+    """Inoltra un messaggio ai client dal thread del dispatcher al loop del server"""
+    if app_loop is None or app_loop.is_closed():
+        return
+    asyncio.run_coroutine_threadsafe(notify_clients(message), app_loop)
+
+
+def notify_job_finished(job):
+    """Notifica i client WebSocket al termine di un job"""
+    logger.info(f"Job {job['id']} ({job['filename']}) terminato: {job['status']}")
+    publish({"event": "task_completed", "job_id": job["id"], "status": job["status"]})
+    evict_store()
+
+
+def evict_store():
+    """Applica all'archivio dei caricamenti i limiti di età e dimensione."""
     try:
-        logger.info(f"Starting cleaning process for file: {filename}, table_id: {table_id}")
-        from .clean import clean_data  # importa la funzione da un modulo Python
+        evict(keep=job_manager.active_inputs())
+    except OSError as e:
+        logger.error(f"Errore nella pulizia dell'archivio: {e}")
+
+
+def notify_job_progress(job_id, progress):
+    """Notifica i client WebSocket dell'avanzamento di una fase del job"""
+    publish({"event": "job_progress", "job_id": job_id, **progress})
+
+
+# Coda dei job di pulizia, eseguiti in processi worker
+job_manager = JobManager(
+    upload_folder=UPLOAD_FOLDER,
+    on_finish=notify_job_finished,
+    on_progress=notify_job_progress,
+)
+
+
+@app.on_event("startup")
+async def start_job_manager():
+    global app_loop
+    app_loop = asyncio.get_running_loop()
+    job_manager.start()
+    await run_in_threadpool(evict_store)
+    # Aggiunge al catalogo i file creati prima del catalogo stesso
+    await run_in_threadpool(catalog.sync, OUTPUT_FOLDER)
 
-        clean_data(table_id, filename)  # esegui la funzione direttamente
-        asyncio.run(notify_clients())  # Notifica i client WebSocket
-    except Exception as e:
-        logger.error(f"Errore nell'esecuzione della funzione di pulizia: {str(e)}")
+
+@app.on_event("shutdown")
+def stop_job_manager():
+    job_manager.stop()
 
 
 @app.websocket("/ws")
@@ -167,25 +297,16 @@ async def websocket_endpoint(websocket: WebSocket):
 # Route root: legge direttamente il cookie 'session', verifica utente, redirect se non valido
 @app.get("/", response_class=HTMLResponse)
 async def get_root(request: Request, session: Optional[str] = Cookie(None)):
-
-    db = SessionLocal()
-    try:
-        if session is None:
-            return RedirectResponse(url="/login", status_code=302)
-        user = db.query(User).filter(User.username == session).first()
-        if user is None:
-            return RedirectResponse(url="/login", status_code=302)
-        template = env.get_template("index.html")
-        return template.render()
-    finally:
-        db.close()
+    if await session_user(session) is None:
+        return RedirectResponse(url="/login", status_code=302)
+    template = env.get_template("index.html")
+    return template.render()
 
 
 # Login page GET
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
     logger.info("Rendering login page")
-    create_user()  # Crea l'utente se non esiste
     return templates.TemplateResponse("login.html", {"request": request})
 
 
@@ -195,13 +316,20 @@ async def login_post(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: SessionLocal = Depends(get_db),
 ):
     logger.info(f"Login attempt for user: {username}")
-    user = db.query(User).filter(User.username == username).first()
-    if user and bcrypt.verify(password, user.password_hash):
+    # Query e bcrypt (lento per costruzione) fuori dall'event loop
+    user = await run_in_threadpool(load_user, username)
+    if user and await run_in_threadpool(bcrypt.verify, password, user["password_hash"]):
+        user_cache.put(user)
         response = RedirectResponse(url="/", status_code=302)
-        response.set_cookie("session", username, httponly=True)
+        response.set_cookie(
+            "session",
+            signer.dumps(user),
+            max_age=SESSION_MAX_AGE,
+            httponly=True,
+            samesite="lax",
+        )
         return response
     return templates.TemplateResponse(
         "login.html", {"request": request, "error": "Credenziali non valide"}
@@ -212,30 +340,33 @@ async def login_post(
 async def upload_files(table_id: str = Form(...), files: List[UploadFile] = File(...)):
     logger.info(f"Uploading files for table_id: {table_id}")
     try:
+        if job_manager.capacity() < len(files):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Troppi file in elaborazione, riprovare più tardi",
+            )
 
-        Path(UPLOAD_FOLDER).mkdir(parents=True, exist_ok=True)
+        jobs = []
         for file in files:
-            if file.filename is not None:
-                file_path = os.path.join(
-                    UPLOAD_FOLDER,
-                    file.filename,
-                )
-                logger.info(f"Saving file to {file_path}")
-
-            with open(file_path, "wb") as f:
+            filename = os.path.basename(file.filename or "upload.xlsx")
+            logger.info(f"Saving file {filename} to the upload store")
+            # Il file è salvato con l'hash del contenuto, calcolato durante la scrittura
+            with UploadWriter() as writer:
                 while chunk := await file.read(1024 * 1024):
-                    f.write(chunk)
-            logger.info(f"File {file.filename} saved successfully")
-
-            # Avvia lo script in background
-            Thread(
-                target=execute_script_in_background,
-                daemon=True,
-                args=(table_id, file.filename),
-            ).start()
+                    writer.write(chunk)
+                input_hash = writer.commit()
+            logger.info(f"File {filename} saved successfully ({input_hash})")
+
+            # Accoda il job di pulizia
+            job = job_manager.submit(table_id, filename, input_hash)
+            jobs.append({"id": job["id"], "filename": job["filename"]})
         # Redirect alla pagina che mostra l'elenco dei file
         logger.info("Redirecting to /list_files")
-        return {"status": "processing", "redirect": "/list_files"}
+        return {"status": "queued", "jobs": jobs, "redirect": "/list_files"}
+    except HTTPException:
+        raise
+    except QueueFull as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Errore durante il caricamento: {str(e)}"
@@ -245,40 +376,229 @@ async def upload_files(table_id: str = Form(...), files: List[UploadFile] = File
             await file.close()
 
 
-@app.get("/list_files", response_class=HTMLResponse)
-async def list_files():
-    logger.info("Listing files in output folder")
+@app.get("/jobs")
+async def list_jobs(limit: int = 50):
+    """Elenco degli ultimi job con stato e avanzamento."""
+    return job_manager.list_jobs(limit)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Stato di un job e avanzamento per fase."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Annulla un job in coda o in esecuzione."""
+    logger.info(f"Cancelling job: {job_id}")
+    if not job_manager.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job non trovato o già terminato")
+    return {"status": "cancelled", "job_id": job_id}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Metriche della pipeline e della coda nel formato testuale di Prometheus."""
+    await run_in_threadpool(job_manager.update_metrics)
+    hits = DNS_CACHE_LOOKUPS.value(result="hit")
+    lookups = hits + DNS_CACHE_LOOKUPS.value(result="miss")
+    DNS_CACHE_HIT_RATIO.set(hits / lookups if lookups else 0.0)
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/history")
+async def history(page: int = 1, per_page: int = 50):
+    """Cronologia paginata delle esecuzioni, con i totali complessivi."""
+    if page < 1 or not 1 <= per_page <= 500:
+        raise HTTPException(status_code=400, detail="Parametri di paginazione non validi")
+    try:
+        totals = await run_in_threadpool(get_totals)
+        runs = await run_in_threadpool(list_runs, page, per_page)
+        available = True
+    except (SQLAlchemyError, ImportError) as e:
+        # Come record_run: senza database la cronologia risulta vuota, non è un errore
+        logger.error(f"Cronologia non disponibile: {e}")
+        totals = {field: 0 for field in TOTAL_FIELDS}
+        totals["rejections"] = {}
+        runs = []
+        available = False
+    return {
+        "page": page,
+        "per_page": per_page,
+        "pages": -(-totals["runs"] // per_page),
+        "available": available,
+        "totals": totals,
+        "runs": runs,
+    }
+
+
+@app.get("/dedup/stats")
+async def get_dedup_stats():
+    """Statistiche degli indici di deduplica: chiavi, ricerche e hit rate."""
+    return await run_in_threadpool(dedup_stats)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """Valuta If-None-Match e, in sua assenza, If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
     try:
-        files = [
-            f
-            for f in os.listdir(OUTPUT_FOLDER)
-            if os.path.isfile(os.path.join(OUTPUT_FOLDER, f))
-        ]
-        if not files:
-            template = env.get_template("list_files.html")
-            return template.render(files=None)
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    # Last-Modified ha la precisione del secondo
+    return int(last_modified) <= since
+
 
+@app.get("/list_files", response_class=HTMLResponse)
+async def list_files(
+    request: Request,
+    page: int = 1,
+    per_page: int = 50,
+    sort: str = "created_at",
+    order: str = "desc",
+    q: Optional[str] = None,
+    table_id: Optional[str] = None,
+):
+    """Elenco paginato dei file puliti, letto dal catalogo, con richieste condizionali."""
+    logger.info("Listing files in output catalog")
+    if (
+        page < 1
+        or not 1 <= per_page <= 500
+        or sort not in SORT_COLUMNS
+        or order not in ("asc", "desc")
+    ):
+        raise HTTPException(status_code=400, detail="Parametri dell'elenco non validi")
+    try:
+        updated_at = await run_in_threadpool(catalog.updated_at)
+        headers = {
+            "ETag": f'"{int(updated_at * 1e6):x}"',
+            "Last-Modified": formatdate(updated_at, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+        if is_not_modified(request, headers["ETag"], updated_at):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        total, files = await run_in_threadpool(
+            catalog.list_outputs, page, per_page, sort, order == "desc", q, table_id
+        )
         template = env.get_template("list_files.html")
-        return template.render(files=files)
+        content = template.render(
+            files=files,
+            total=total,
+            page=page,
+            pages=-(-total // per_page),
+            per_page=per_page,
+            sort=sort,
+            order=order,
+            q=q or "",
+            table_id=table_id or "",
+        )
+        return HTMLResponse(content, headers=headers)
 
-    except Exception as e:
+    except sqlite3.Error as e:
         logger.error(f"Errore durante la lettura dei file: {str(e)}")
         raise HTTPException(
             status_code=500, detail=f"Errore durante la lettura dei file: {str(e)}"
         )
 
 
-@app.get("/download/{filename}", response_class=FileResponse)
-async def download_file(filename: str):
-    logger.info(f"Downloading file: {filename}")
+def output_file_path(filename: str) -> str:
+    """Percorso di un file in uscita; 404 se non esiste o è fuori dalla cartella."""
     file_path = os.path.join(OUTPUT_FOLDER, filename)
-    if not os.path.exists(file_path):
+    if os.path.basename(filename) != filename or not os.path.isfile(file_path):
         raise HTTPException(status_code=404, detail="File non trovato")
+    return file_path
+
+
+@app.get("/download/{filename}")
+async def download_file(filename: str, request: Request):
+    """Scarica un file pulito, compresso se il client lo accetta, anche a intervalli.
+
+    Con gzip o zstd accettati si usa la copia compressa scritta da clean_data
+    o, se manca, una compressione al volo (senza intervalli). Le richieste
+    Range su un'unica rappresentazione permettono di riprendere i download.
+    """
+    logger.info(f"Downloading file: {filename}")
+    file_path = output_file_path(filename)
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    range_header = request.headers.get("range")
+    served_path = file_path
+    if encoding is not None:
+        sibling = compressed_sibling(file_path, encoding)
+        if sibling is not None:
+            served_path = sibling
+        elif range_header:
+            # La compressione al volo non ha una lunghezza nota: intervalli sull'originale
+            encoding = None
+
+    stat = os.stat(served_path)
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}{"-" + encoding if encoding else ""}"'
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Vary": "Accept-Encoding",
+    }
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    if is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    if served_path == file_path and encoding is not None:
+        headers["Accept-Ranges"] = "none"
+        return StreamingResponse(
+            iter_compressed(file_path, encoding),
+            media_type="application/octet-stream",
+            headers=headers,
+        )
 
-    return FileResponse(
-        path=file_path,
+    headers["Accept-Ranges"] = "bytes"
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        # Il file è cambiato dal download interrotto: si riparte dall'inizio
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, stat.st_size)
+    except RangeNotSatisfiable:
+        headers["Content-Range"] = f"bytes */{stat.st_size}"
+        return Response(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers
+        )
+    if byte_range is None:
+        headers["Content-Length"] = str(stat.st_size)
+        return StreamingResponse(
+            iter_file(served_path), media_type="application/octet-stream", headers=headers
+        )
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file(served_path, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
         media_type="application/octet-stream",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        headers=headers,
+    )
+
+
+@app.get("/download_zip")
+async def download_zip(files: List[str] = Query(...)):
+    """Archivio zip dei file selezionati, generato in streaming."""
+    logger.info(f"Downloading archive of {len(files)} files")
+    paths = [output_file_path(filename) for filename in dict.fromkeys(files)]
+    archive_name = datetime.now().strftime("puliti_%Y%m%d_%H%M%S.zip")
+    return StreamingResponse(
+        iter_zip(paths),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{archive_name}"'},
     )
 
 
@@ -290,6 +610,7 @@ async def clear_puliti():
             file_path = os.path.join(OUTPUT_FOLDER, filename)
             if os.path.isfile(file_path):
                 os.unlink(file_path)
+        await run_in_threadpool(catalog.sync, OUTPUT_FOLDER)
         logger.info("Output folder cleared successfully")
         return {"status": "success", "message": "Output folder cleared successfully"}
     except Exception as e:
@@ -322,11 +643,20 @@ async def clear_output():
         )
 
 
+# Client asincrono per i metadati di NocoDB, con cache
+nocodb_meta = NocoDBMetaClient()
+
+
+@app.on_event("shutdown")
+async def close_nocodb_meta():
+    await nocodb_meta.aclose()
+
+
 @app.get("/tables/{base_id}")
-def get_tables(base_id: str):
+async def get_tables(base_id: str):
     """Recupera tutte le tabelle da NocoDB."""
     logger.info(f"Retrieving tables for base_id: {base_id}")
-    tables = get_all_tables(base_id)
+    tables = await nocodb_meta.get_tables(base_id)
     if tables:
         return tables
     else:
@@ -334,10 +664,10 @@ def get_tables(base_id: str):
 
 
 @app.get("/bases")
-def get_nc_bases():
+async def get_nc_bases():
     """Recupera tutte le basi da NocoDB."""
     logger.info("Retrieving bases")
-    bases = get_bases()
+    bases = await nocodb_meta.get_bases()
     if bases:
         return bases
     else:
@@ -345,16 +675,26 @@ def get_nc_bases():
 
 
 @app.post("/create_table")
-def nc_create_table(table_create_request: TableCreateRequest):
+async def nc_create_table(table_create_request: TableCreateRequest):
     """Crea una nuova tabella in NocoDB."""
     logger.info(f"Creating table {table_create_request.table_name} in base {table_create_request.base_id}")
-    create_table(table_create_request.base_id, table_create_request.table_name)
+    created = await run_in_threadpool(
+        create_table, table_create_request.base_id, table_create_request.table_name
+    )
+    if not created:
+        raise HTTPException(status_code=502, detail="Errore nella creazione della tabella")
+    nocodb_meta.invalidate(table_create_request.base_id)
     return {"success": True, "message": "Tabella creata con successo"}
 
 
 # Logout route
 @app.get("/logout")
-async def logout():
+async def logout(session: Optional[str] = Cookie(None)):
+    user = await session_user(session)
+    if user is not None:
+        # Il cookie firmato resterebbe valido fino alla scadenza: lo si revoca
+        await run_in_threadpool(end_sessions, user["username"])
+        user_cache.invalidate(user["username"])
     response = RedirectResponse(url="/login", status_code=302)
     response.delete_cookie("session")
     return response
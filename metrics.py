@@ -0,0 +1,243 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Limiti (in secondi) degli istogrammi di durata
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Raccolta delle metriche del processo, esportate nel formato testuale di Prometheus.
+
+    I processi worker non vengono interrogati direttamente: `drain` restituisce
+    gli incrementi accumulati dall'ultima chiamata, che il processo principale
+    somma ai propri con `merge`.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self._metrics.values():
+                lines.append(f"# HELP {metric.name} {metric.documentation}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def drain(self):
+        """Incrementi di contatori e istogrammi dall'ultima chiamata, azzerandoli."""
+        with self.lock:
+            deltas = {}
+            for metric in self._metrics.values():
+                if metric.kind != "gauge" and metric.values:
+                    deltas[metric.name] = metric.values
+                    metric.values = {}
+            return deltas
+
+    def merge(self, deltas):
+        """Somma gli incrementi ricevuti da un altro processo.
+
+        Le somme degli istogrammi arrivano anche ai blocchi `collect` attivi.
+        """
+        with self.lock:
+            for name, values in deltas.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                for labels, value in values.items():
+                    metric.add(labels, value)
+                    for listener in getattr(metric, "listeners", ()):
+                        listener(value[1], dict(zip(metric.labelnames, labels)))
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        # valori delle etichette -> valore (per gli istogrammi [conteggi, somma])
+        self.values = {}
+        registry.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        with self.registry.lock:
+            self.add(self._key(labels), amount)
+
+    def add(self, key, amount):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.registry.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(name, documentation, labelnames, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.listeners = []
+
+    def observe(self, value, **labels):
+        counts = [0] * len(self.buckets)
+        counts[bisect.bisect_left(self.buckets, value)] = 1
+        with self.registry.lock:
+            self.add(self._key(labels), (counts, value))
+            for listener in self.listeners:
+                listener(value, labels)
+
+    @contextmanager
+    def collect(self, label):
+        """Raccoglie in un dizionario {valore di `label`: somma} le osservazioni del blocco.
+
+        Le osservazioni di tutti i thread del processo finiscono nel dizionario.
+        """
+        totals = {}
+
+        def listener(value, labels):
+            totals[labels[label]] = totals.get(labels[label], 0) + value
+
+        self.listeners.append(listener)
+        try:
+            yield totals
+        finally:
+            self.listeners.remove(listener)
+
+    def add(self, key, value):
+        counts, total = value
+        current = self.values.get(key)
+        if current is None:
+            self.values[key] = (list(counts), total)
+        else:
+            self.values[key] = ([a + b for a, b in zip(current[0], counts)], current[1] + total)
+
+    @contextmanager
+    def time(self, **labels):
+        """Misura la durata del blocco `with`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def value(self, **labels):
+        counts, total = self.values.get(self._key(labels), ([0], 0))
+        return sum(counts), total
+
+    def samples(self):
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+# Metriche della pipeline di pulizia
+STAGE_DURATION = Histogram(
+    "grezzi_stage_duration_seconds",
+    "Durata delle fasi della pipeline per blocco di righe.",
+    ["stage"],
+)
+ROWS_IN = Counter("grezzi_rows_in_total", "Righe lette dai file caricati.")
+ROWS_OUT = Counter("grezzi_rows_out_total", "Righe pulite scritte in uscita.")
+EMAIL_CHECKS = Counter(
+    "grezzi_email_checks_total",
+    "Email verificate, per esito (valid o motivo dello scarto).",
+    ["result"],
+)
+PHONE_CHECKS = Counter(
+    "grezzi_phone_checks_total",
+    "Telefoni verificati, per esito (tipo, foreign, invalid o empty).",
+    ["result"],
+)
+EMAIL_FIXES = Counter(
+    "grezzi_email_fixes_total",
+    "Correzioni cercate per le email non valide, per esito (fixed o unfixed).",
+    ["result"],
+)
+CITY_FIXES = Counter(
+    "grezzi_city_fixes_total",
+    "Città senza CAP noto cercate tra i comuni, per esito (fixed o unmatched).",
+    ["result"],
+)
+DNS_CACHE_LOOKUPS = Counter(
+    "grezzi_dns_cache_lookups_total",
+    "Domini cercati nella cache DNS, per esito (hit o miss).",
+    ["result"],
+)
+DNS_CACHE_HIT_RATIO = Gauge(
+    "grezzi_dns_cache_hit_ratio", "Quota di domini trovati nella cache DNS."
+)
+
+# Metriche di NocoDB
+NOCODB_BATCH_DURATION = Histogram(
+    "grezzi_nocodb_batch_duration_seconds",
+    "Durata dell'invio di un blocco a NocoDB, tentativi compresi.",
+    ["method"],
+)
+NOCODB_BATCH_ERRORS = Counter(
+    "grezzi_nocodb_batch_errors_total",
+    "Blocchi non salvati in NocoDB dopo tutti i tentativi.",
+    ["method"],
+)
+NOCODB_RETRIES = Counter(
+    "grezzi_nocodb_retries_total", "Richieste a NocoDB ripetute dopo un errore."
+)
+
+# Metriche della coda dei job
+JOB_QUEUE_DEPTH = Gauge("grezzi_job_queue_depth", "Job in attesa o in esecuzione.")
+JOBS_RUNNING = Gauge("grezzi_jobs_running", "Job in esecuzione.")
+JOBS_FINISHED = Counter(
+    "grezzi_jobs_finished_total", "Job terminati, per esito.", ["status"]
+)
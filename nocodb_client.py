@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+import time
+
+import httpx
+
+from .db import NC_META_URL, headers
+
+logger = logging.getLogger(__name__)
+
+# Durata della cache dei metadati (basi e tabelle), in secondi
+NC_META_TTL = float(os.getenv("NC_META_TTL", "60"))
+
+
+class NocoDBMetaClient:
+    """Client asincrono per i metadati di NocoDB, con cache TTL.
+
+    Le connessioni sono riusate da un unico httpx.AsyncClient e le richieste
+    identiche concorrenti vengono unite in una sola chiamata a NocoDB.
+    """
+
+    def __init__(self, base_url=NC_META_URL, ttl=NC_META_TTL):
+        self.base_url = base_url
+        self.ttl = ttl
+        self._client = None
+        self._cache = {}
+        self._inflight = {}
+        self._generation = 0
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={k: v for k, v in headers.items() if v is not None},
+                timeout=httpx.Timeout(10.0),
+                limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+            )
+        return self._client
+
+    async def _fetch(self, path):
+        try:
+            response = await self._get_client().get(path)
+        except httpx.HTTPError as e:
+            logger.error(f"Errore nel recupero di {path}: {e}")
+            return None
+        if response.status_code != 200:
+            logger.error(f"Errore nel recupero di {path}: {response.status_code}")
+            return None
+        return response.json().get("list", [])
+
+    async def _load(self, path, generation):
+        result = await self._fetch(path)
+        # Gli errori non vengono memorizzati, così la richiesta successiva riprova;
+        # né i risultati di richieste partite prima di un'invalidazione
+        if result is not None and generation == self._generation:
+            self._cache[path] = (time.monotonic() + self.ttl, result)
+        return result
+
+    async def _get(self, path):
+        """Restituisce la lista dei metadati per `path`, dalla cache se valida."""
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        task = self._inflight.get(path)
+        if task is None:
+            task = asyncio.ensure_future(self._load(path, self._generation))
+            self._inflight[path] = task
+            task.add_done_callback(
+                lambda done: self._inflight.pop(path, None)
+                if self._inflight.get(path) is done
+                else None
+            )
+        return await asyncio.shield(task)
+
+    async def get_bases(self):
+        """Recupera tutte le basi da NocoDB."""
+        bases = await self._get("/bases/")
+        if bases is None:
+            return None
+        return [{"id": base["id"], "title": base["title"]} for base in bases]
+
+    async def get_tables(self, base_id):
+        """Recupera tutte le tabelle di una base da NocoDB."""
+        return await self._get(f"/bases/{base_id}/tables")
+
+    def invalidate(self, base_id=None):
+        """Svuota la cache: solo le tabelle della base indicata, o tutto."""
+        self._generation += 1
+        if base_id is None:
+            self._cache.clear()
+            self._inflight.clear()
+        else:
+            path = f"/bases/{base_id}/tables"
+            self._cache.pop(path, None)
+            self._inflight.pop(path, None)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
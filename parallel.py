@@ -0,0 +1,253 @@
+import logging
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Processi per le fasi riga per riga (0 o 1: esecuzione seriale) e righe per porzione
+PARALLEL_WORKERS = int(os.getenv("PARALLEL_WORKERS", "0"))
+PARALLEL_CHUNK_ROWS = int(os.getenv("PARALLEL_CHUNK_ROWS", "10000"))
+
+# Tipo di ciascun valore delle colonne object
+NONE, STR, FLOAT, INT, BOOL, OTHER = range(6)
+_TAGS = {
+    type(None): NONE,
+    str: STR,
+    float: FLOAT,
+    np.float64: FLOAT,
+    int: INT,
+    np.int64: INT,
+    bool: BOOL,
+    np.bool_: BOOL,
+}
+_ALIGN = 8
+
+
+class _Buffers:
+    """Array numpy da copiare in un unico blocco di memoria condivisa."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def add(self, array):
+        array = np.ascontiguousarray(array)
+        offset = -(-self.size // _ALIGN) * _ALIGN
+        self.parts.append((offset, array))
+        self.size = offset + array.nbytes
+        return offset, array.dtype.str, array.shape[0]
+
+
+def _view(buf, spec):
+    offset, dtype, length = spec
+    return np.frombuffer(buf, dtype=dtype, count=length, offset=offset)
+
+
+def _encode_strings(strings, buffers):
+    # Lunghezze in caratteri: la decodifica divide un'unica stringa con lo slicing
+    lengths = np.fromiter(map(len, strings), np.int64, len(strings))
+    text = "".join(strings).encode("utf-8", "surrogatepass")
+    return {"lengths": buffers.add(lengths), "text": buffers.add(np.frombuffer(text, np.uint8))}
+
+
+def _decode_strings(buf, spec):
+    lengths = _view(buf, spec["lengths"])
+    text = _view(buf, spec["text"]).tobytes().decode("utf-8", "surrogatepass")
+    ends = np.cumsum(lengths).tolist()
+    starts = [0] + ends[:-1]
+    return [text[start:end] for start, end in zip(starts, ends)]
+
+
+def _encode_column(series, buffers):
+    """Descrizione di una colonna, con i dati aggiunti a `buffers`.
+
+    Le colonne numpy non object sono copiate così come sono; le colonne
+    object sono scomposte per tipo di valore, così che testi e numeri
+    tornino identici (None resta None, 3.0 resta un float).
+    """
+    if not isinstance(series.dtype, np.dtype):
+        # Tipi estesi di pandas, rari negli export: serializzati per non perdere il tipo
+        return _encode_pickled(series, buffers)
+    if series.dtype != object:
+        return {"kind": "array", "data": buffers.add(series.to_numpy())}
+    values = series.to_numpy()
+    if pd.api.types.infer_dtype(values, skipna=False) == "string":
+        return {"kind": "str", **_encode_strings(values.tolist(), buffers)}
+    tags = np.fromiter((_TAGS.get(type(v), OTHER) for v in values), np.uint8, len(values))
+    try:
+        floats = np.array(values[tags == FLOAT], dtype=np.float64)
+        ints = np.array(values[(tags == INT) | (tags == BOOL)], dtype=np.int64)
+    except OverflowError:
+        # Interi oltre i 64 bit
+        return _encode_pickled(series, buffers)
+    others = pickle.dumps(values[tags == OTHER].tolist())
+    return {
+        "kind": "mixed",
+        "tags": buffers.add(tags),
+        "floats": buffers.add(floats),
+        "ints": buffers.add(ints),
+        "strings": _encode_strings(values[tags == STR].tolist(), buffers),
+        "others": buffers.add(np.frombuffer(others, np.uint8)),
+    }
+
+
+def _encode_pickled(series, buffers):
+    data = np.frombuffer(pickle.dumps(series), np.uint8)
+    return {"kind": "pickle", "data": buffers.add(data)}
+
+
+def _decode_column(buf, spec):
+    kind = spec["kind"]
+    if kind == "array":
+        return _view(buf, spec["data"]).copy()
+    if kind == "pickle":
+        return pickle.loads(_view(buf, spec["data"]).tobytes()).array
+    values = np.empty(spec["lengths"][2] if kind == "str" else spec["tags"][2], dtype=object)
+    if kind == "str":
+        values[:] = _decode_strings(buf, spec)
+        return values
+    tags = _view(buf, spec["tags"])
+    _fill(values, tags == STR, _decode_strings(buf, spec["strings"]))
+    _fill(values, tags == FLOAT, _view(buf, spec["floats"]).tolist())
+    ints = _view(buf, spec["ints"])
+    int_or_bool = tags[(tags == INT) | (tags == BOOL)]
+    _fill(values, tags == INT, ints[int_or_bool == INT].tolist())
+    _fill(values, tags == BOOL, ints[int_or_bool == BOOL].astype(bool).tolist())
+    _fill(values, tags == OTHER, pickle.loads(_view(buf, spec["others"]).tobytes()))
+    return values
+
+
+def _fill(values, mask, items):
+    # Assegnazione elemento per elemento: numpy non deve convertire le liste
+    for position, item in zip(np.flatnonzero(mask).tolist(), items):
+        values[position] = item
+
+
+def pack_frame(df):
+    """Copia un DataFrame in un blocco di memoria condivisa.
+
+    Restituisce il blocco (da chiudere e rimuovere dopo l'uso) e la
+    descrizione necessaria a unpack_frame, piccola da serializzare.
+    """
+    buffers = _Buffers()
+    if isinstance(df.index, pd.RangeIndex):
+        index = {"kind": "range", "start": df.index.start, "step": df.index.step}
+    else:
+        index = _encode_column(df.index.to_series(), buffers)
+    columns = [(name, _encode_column(df[name], buffers)) for name in df.columns]
+    shm = SharedMemory(create=True, size=max(buffers.size, 1), track=False)
+    for offset, array in buffers.parts:
+        shm.buf[offset : offset + array.nbytes] = array.view(np.uint8).reshape(-1)
+    layout = {"rows": len(df), "index": index, "columns": columns}
+    return shm, layout
+
+
+def unpack_frame(name, layout, unlink=False):
+    """Ricostruisce il DataFrame copiandolo dal blocco `name`; con `unlink` lo rimuove."""
+    shm = SharedMemory(name=name, track=False)
+    try:
+        buf = shm.buf
+        index = layout["index"]
+        if index["kind"] == "range":
+            start, step = index["start"], index["step"]
+            index = pd.RangeIndex(start, start + step * layout["rows"], step)
+        else:
+            index = pd.Index(_decode_column(buf, index))
+        data = {name: _decode_column(buf, spec) for name, spec in layout["columns"]}
+        del buf
+        return pd.DataFrame(data, index=index, columns=[name for name, _ in layout["columns"]])
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _init_worker():
+    # Il riferimento geografico viene caricato una volta per processo
+    from .geo import get_geo_index
+
+    get_geo_index()
+
+
+def _run_stage(stage, name, layout):
+    """Esegue nel worker la fase `stage` di clean su una porzione del blocco."""
+    from . import clean
+
+    df = unpack_frame(name, layout)
+    result = getattr(clean, stage)(df)
+    shm, result_layout = pack_frame(result)
+    shm.close()
+    return shm.name, result_layout, REGISTRY.drain()
+
+
+class ChunkPool:
+    """Pool di processi per le fasi riga per riga della pulizia.
+
+    Ogni blocco viene diviso in porzioni di `chunk_rows` righe, passate ai
+    worker in memoria condivisa come colonne compatte (testi UTF-8 con
+    lunghezze, array numerici) invece che come DataFrame serializzati;
+    i risultati sono ricomposti nell'ordine originale. Le metriche dei
+    worker vengono sommate a quelle del processo.
+    """
+
+    def __init__(self, workers=PARALLEL_WORKERS, chunk_rows=PARALLEL_CHUNK_ROWS):
+        self.workers = workers
+        self.chunk_rows = chunk_rows
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        logger.info(f"Pool di {workers} processi per le fasi riga per riga")
+
+    def map_frame(self, stage, df):
+        """Applica la funzione `stage` di clean a `df` per porzioni, in parallelo."""
+        if len(df) == 0:
+            from . import clean
+
+            return getattr(clean, stage)(df)
+        inputs, futures, results = [], [], []
+        try:
+            for start in range(0, len(df), self.chunk_rows):
+                shm, layout = pack_frame(df.iloc[start : start + self.chunk_rows])
+                inputs.append(shm)
+                futures.append(self._executor.submit(_run_stage, stage, shm.name, layout))
+            for future in futures:
+                name, layout, deltas = future.result()
+                results.append(unpack_frame(name, layout, unlink=True))
+                REGISTRY.merge(deltas)
+        except BaseException:
+            # Rimuove i risultati già prodotti e non ancora letti, compreso quello
+            # in lettura: il suo worker può essere fallito (e result() risolleva
+            # l'errore) oppure l'interruzione è arrivata durante l'attesa
+            for future in futures[len(results) :]:
+                if future.cancel():
+                    continue
+                try:
+                    name, _, _ = future.result()
+                    SharedMemory(name=name, track=False).unlink()
+                except Exception:
+                    pass
+            raise
+        finally:
+            for shm in inputs:
+                shm.close()
+                shm.unlink()
+        return pd.concat(results)
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
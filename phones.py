@@ -0,0 +1,214 @@
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+from .metrics import PHONE_CHECKS
+
+logger = logging.getLogger(__name__)
+
+# Primo numero in un testo con altre parole: "+" facoltativo, cifre e separatori
+# (spazi solo prima di una cifra, così "333 1234567 / 06 123456" si ferma al primo)
+NUMBER_PATTERN = re.compile(r"\+?\d(?:[\d().\-/]|\s+(?=[\d(]))*\d")
+
+COUNTRY_CODE = 39
+# Regole dei numeri italiani per prefisso (senza prefisso internazionale):
+# tipo e lunghezza minima e massima in cifre
+ITALIAN_PREFIXES = {
+    "0": ("landline", 6, 11),
+    "3": ("mobile", 9, 10),
+    # Numeri verdi, a costo ripartito e a pagamento
+    "80": ("other", 6, 10),
+    "84": ("other", 6, 10),
+    "89": ("other", 6, 10),
+}
+# Limiti E.164: al massimo 15 cifre, prefisso del paese compreso
+E164_MIN_DIGITS = 8
+E164_MAX_DIGITS = 15
+
+NUMERIC_TYPES = (int, float, np.int64, np.float64)
+# Caratteri ammessi tra le cifre di un numero, come code point
+SEPARATOR_POINTS = np.array([ord(c) for c in " \t()-./"], dtype=np.uint32)
+SPLIT_POINTS = np.array([ord("-"), ord("/")], dtype=np.uint32)
+ZERO, PLUS, DOT, SPACE = ord("0"), ord("+"), ord("."), ord(" ")
+# Cifre iniziali conservate per riga ("00", prefisso del paese e due cifre)
+LEAD_DIGITS = 6
+# Cifre oltre le quali il valore intero non serve (e non starebbe in un int64)
+MAX_DIGITS = 17
+POWERS = 10 ** np.arange(MAX_DIGITS + 1, dtype=np.int64)
+
+
+def _prefix_tables():
+    """Tipo e lunghezze ammesse per ognuna delle 100 coppie di cifre iniziali."""
+    kinds = np.full(100, None, dtype=object)
+    minimum = np.zeros(100, dtype=np.int64)
+    maximum = np.full(100, -1, dtype=np.int64)
+    for prefix in range(100):
+        text = f"{prefix:02d}"
+        rule = ITALIAN_PREFIXES.get(text) or ITALIAN_PREFIXES.get(text[0])
+        if rule is not None:
+            kinds[prefix], minimum[prefix], maximum[prefix] = rule
+    return kinds, minimum, maximum
+
+
+# Calcolate una volta: la classificazione diventa un'indicizzazione per prefisso
+PREFIX_KINDS, PREFIX_MIN, PREFIX_MAX = _prefix_tables()
+
+
+def phone_text(values):
+    """Valori di una colonna di telefoni come lista di testi ("" per i mancanti).
+
+    I numeri delle celle numeriche sono scritti come interi, senza ".0".
+    """
+    values = pd.Series(values, dtype=object)
+    kinds = values.map(type)
+    raw = values.to_numpy()
+    text = np.where(kinds.eq(str).to_numpy(), raw, "")
+    numeric = kinds.isin(NUMERIC_TYPES).to_numpy()
+    if numeric.any():
+        numbers = pd.to_numeric(pd.Series(raw[numeric]), errors="coerce").to_numpy(dtype=float)
+        with np.errstate(invalid="ignore"):
+            integral = np.isfinite(numbers) & (numbers == np.floor(numbers))
+            integral &= np.abs(numbers) < 1e15
+        text[np.flatnonzero(numeric)[integral]] = numbers[integral].astype(np.int64).astype(str)
+    return text.tolist()
+
+
+def _rows_of(positions, ends):
+    """Righe a cui appartengono i caratteri in `positions`."""
+    return np.searchsorted(ends, positions, side="right")
+
+
+def _scan(texts):
+    """Cifre dei numeri in `texts`, calcolate su tutti i caratteri della colonna insieme.
+
+    Come in parallel, i testi sono uniti in un'unica stringa con le
+    lunghezze a parte, qui letta come array di code point. Restituisce per
+    riga il numero di cifre, il loro valore intero (fino a MAX_DIGITS
+    cifre), le prime LEAD_DIGITS cifre (-1 se mancanti), il "+" iniziale e
+    le righe con altri caratteri, da cui estrarre il numero con
+    NUMBER_PATTERN.
+    """
+    n = len(texts)
+    lengths = np.fromiter(map(len, texts), np.int64, n)
+    points = np.frombuffer("".join(texts).encode("utf-32-le", "surrogatepass"), np.uint32)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    filled = lengths > 0
+
+    digit = (points >= ZERO) & (points <= ZERO + 9)
+    has_plus = np.zeros(n, dtype=bool)
+    has_plus[filled] = points[starts[filled]] == PLUS
+    # "+" ammesso solo come primo carattere; gli altri caratteri sono rari
+    allowed = digit | np.isin(points, SEPARATOR_POINTS)
+    allowed[starts[has_plus]] = True
+    wordy = np.zeros(n, dtype=bool)
+    wordy[_rows_of(np.flatnonzero(~allowed), ends)] = True
+    # Spazio seguito da "-" o "/" nella stessa cella: più numeri
+    split = np.flatnonzero((points[:-1] == SPACE) & np.isin(points[1:], SPLIT_POINTS))
+    split_rows = _rows_of(split, ends)
+    wordy[split_rows[split + 1 < ends[split_rows]]] = True
+
+    # ".0" finale di un numero salvato come testo da un float: lo zero non è una cifra
+    tail = np.flatnonzero((lengths >= 3) & ~has_plus & ~wordy)
+    tail = tail[(points[ends[tail] - 1] == ZERO) & (points[ends[tail] - 2] == DOT)]
+    tail = [i for i in tail.tolist() if texts[i][:-2].isdigit()]
+    digit[ends[tail] - 1] = False
+
+    positions = np.flatnonzero(digit)
+    count = np.zeros(n, dtype=np.int64)
+    # Solo le righe non vuote: reduceat su un intervallo vuoto non dà zero
+    count[filled] = np.add.reduceat(digit, starts[filled], dtype=np.int64)
+    offsets = np.cumsum(count) - count
+    # Valore e cifre iniziali, una posizione alla volta per tutte le righe
+    value = np.zeros(n, dtype=np.int64)
+    lead = np.full((n, LEAD_DIGITS), -1, dtype=np.int64)
+    for k in range(MAX_DIGITS):
+        present = np.flatnonzero(count > k)
+        if not len(present):
+            break
+        digits = points[positions[offsets[present] + k]].astype(np.int64) - ZERO
+        value[present] = value[present] * 10 + digits
+        if k < LEAD_DIGITS:
+            lead[present, k] = digits
+    return count, value, lead, has_plus, wordy
+
+
+def normalize_phones(values):
+    """Normalizza una colonna di telefoni italiani e internazionali in formato E.164.
+
+    Restituisce un DataFrame con lo stesso indice e le colonne `phone` (il
+    numero E.164, solo per i validi), `valid` e `type` ("mobile",
+    "landline", "other" per i numeri speciali italiani, None per gli
+    stranieri e i non validi). Senza prefisso internazionale il numero è
+    considerato italiano. L'elaborazione è colonnare: solo le celle con
+    parole o più numeri passano da NUMBER_PATTERN. I conteggi per esito
+    finiscono nelle metriche.
+    """
+    index = pd.Series(values, dtype=object).index
+    texts = phone_text(values)
+    count, value, lead, has_plus, wordy = _scan(texts)
+    # Celle senza cifre né parole: vuote, spazi o solo separatori ("-")
+    empty = (count == 0) & ~wordy
+    if wordy.any():
+        rows = np.flatnonzero(wordy)
+        matches = (NUMBER_PATTERN.search(texts[i]) for i in rows)
+        found = _scan([match.group() if match else "" for match in matches])
+        found_count, found_value, found_lead, found_plus, found_wordy = found
+        # Un numero estratto con spazi insoliti (tabulazioni, a capo) resta non valido
+        found_count[found_wordy] = 0
+        count[rows], value[rows], lead[rows], has_plus[rows] = (
+            found_count, found_value, found_lead, found_plus
+        )
+
+    # Prefisso internazionale "00": seguono le cifre del numero E.164
+    double_zero = ~has_plus & (lead[:, 0] == 0) & (lead[:, 1] == 0)
+    skip = np.where(double_zero, 2, 0)
+    count = count - skip
+    value = np.where(double_zero, value % POWERS[np.clip(count, 0, MAX_DIGITS)], value)
+    rows = np.arange(len(texts))
+    first = lead[rows, skip]
+    international = has_plus | double_zero
+    with_code = first * 10 + lead[rows, skip + 1] == COUNTRY_CODE
+    # Prefisso 39 senza "+", da una cella numerica: il numero nazionale ha al
+    # più 10 cifre e non inizia con 390
+    international |= with_code & (count >= 11)
+    italian = ~international | with_code
+
+    national_count = np.where(international, count - 2, count)
+    national_value = np.where(
+        international, value % POWERS[np.clip(national_count, 0, MAX_DIGITS)], value
+    )
+    national_start = np.where(international, skip + 2, 0)
+    n0, n1 = lead[rows, national_start], lead[rows, national_start + 1]
+    prefix = np.clip(n0 * 10 + n1, 0, 99)
+    italian_valid = (
+        italian
+        & (n0 >= 0)
+        & (n1 >= 0)
+        & (national_count >= PREFIX_MIN[prefix])
+        & (national_count <= PREFIX_MAX[prefix])
+    )
+    foreign_valid = (
+        ~italian & (count >= E164_MIN_DIGITS) & (count <= E164_MAX_DIGITS) & (first > 0)
+    )
+    valid = italian_valid | foreign_valid
+
+    e164 = np.where(
+        italian_valid,
+        COUNTRY_CODE * POWERS[np.clip(national_count, 0, MAX_DIGITS)] + national_value,
+        value,
+    )
+    phone = np.full(len(texts), None, dtype=object)
+    phone[valid] = ["+%d" % number for number in e164[valid].tolist()]
+    kind = np.where(italian_valid, PREFIX_KINDS[prefix], None)
+    result = pd.DataFrame({"phone": phone, "valid": valid, "type": kind}, index=index)
+
+    outcome = np.where(valid, np.where(italian_valid, kind, "foreign"), "invalid")
+    outcome[empty] = "empty"
+    counts = pd.Series(outcome).value_counts()
+    for name, rows_count in counts.items():
+        PHONE_CHECKS.inc(int(rows_count), result=name)
+    logger.info(f"Telefoni verificati: {counts.to_dict()}")
+    return result
@@ -0,0 +1,35 @@
+import time
+
+
+class ProgressTracker:
+    """Calcola l'avanzamento per fase (righe, righe/sec, ETA) di un job.
+
+    Ogni aggiornamento viene passato a `emit` come dizionario; le fasi sono
+    quelle della pipeline: parse, dns, reconcile, nocodb.
+    """
+
+    def __init__(self, emit, total=None):
+        self.emit = emit
+        self.total = total
+        self.started = time.monotonic()
+        self.rows = {}
+
+    def update(self, stage, rows):
+        """Registra `rows` nuove righe completate nella fase `stage`."""
+        done = self.rows.get(stage, 0) + rows
+        self.rows[stage] = done
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        rate = done / elapsed
+        eta = None
+        if self.total and rate > 0:
+            eta = round(max(self.total - done, 0) / rate, 1)
+        self.emit(
+            {
+                "stage": stage,
+                "rows": done,
+                "total": self.total,
+                "rows_per_sec": round(rate, 1),
+                "eta": eta,
+                "elapsed": round(elapsed, 1),
+            }
+        )
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from .metrics import DNS_CACHE_LOOKUPS
+from .store import output_setting
+
+logger = logging.getLogger(__name__)
+
+# Parametri del resolver, configurabili da ambiente
+DNS_MAX_WORKERS = int(os.getenv("DNS_MAX_WORKERS", "32"))
+# Il timeout cambia quali domini risultano sconosciuti
+DNS_TIMEOUT = output_setting("DNS_TIMEOUT", float(os.getenv("DNS_TIMEOUT", "3")))
+DNS_CACHE_TTL = float(os.getenv("DNS_CACHE_TTL", "3600"))
+DNS_NEGATIVE_TTL = float(os.getenv("DNS_NEGATIVE_TTL", "300"))
+
+
+class DomainCache:
+    """Cache dei verdetti DNS, positivi e negativi, con scadenza (TTL)."""
+
+    def __init__(self, ttl=DNS_CACHE_TTL, negative_ttl=DNS_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, domains):
+        """Restituisce i verdetti validi in cache e l'elenco dei domini mancanti."""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for domain in domains:
+                entry = self._entries.get(domain)
+                if entry is not None and entry[1] > now:
+                    found[domain] = entry[0]
+                else:
+                    missing.append(domain)
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def set_many(self, verdicts):
+        """Memorizza i verdetti, con TTL diverso per risposte positive e negative.
+
+        I verdetti sconosciuti (None) non vengono memorizzati.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for domain, reachable in verdicts.items():
+                if reachable is None:
+                    continue
+                ttl = self.ttl if reachable else self.negative_ttl
+                self._entries[domain] = (reachable, now + ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# Cache condivisa da tutti i job del processo
+CACHE = DomainCache()
+# Pool condiviso per le risoluzioni: i thread restano vivi tra una chiamata e
+# l'altra e le risoluzioni scadute terminano da sole senza bloccare nessuno
+EXECUTOR = ThreadPoolExecutor(max_workers=DNS_MAX_WORKERS, thread_name_prefix="dns")
+
+
+async def _resolve_all(domains, resolver, timeout, max_workers, on_error):
+    loop = asyncio.get_running_loop()
+    # Oltre la dimensione del pool le risoluzioni aspetterebbero in coda e il
+    # timeout conterebbe anche l'attesa
+    semaphore = asyncio.Semaphore(min(max_workers, EXECUTOR._max_workers))
+
+    async def resolve(domain):
+        # Il posto nel pool si libera quando il thread termina, anche dopo un
+        # timeout: una risoluzione avviata trova sempre un thread libero e il
+        # timeout conta solo il tempo della risoluzione, non l'attesa in coda
+        await semaphore.acquire()
+        lookup = loop.run_in_executor(EXECUTOR, resolver, domain)
+        lookup.add_done_callback(lambda _: semaphore.release())
+        try:
+            await asyncio.wait_for(asyncio.shield(lookup), timeout)
+            return domain, True
+        except asyncio.TimeoutError:
+            # Esito sconosciuto: il dominio non è dichiarato irraggiungibile
+            error, verdict = TimeoutError(f"timeout dopo {timeout}s"), None
+            logger.warning(f"DNS: Errore: {error}, Dominio: {domain}")
+        except Exception as e:
+            error, verdict = e, False
+            logger.error(f"DNS: Errore: {error}, Dominio: {domain}")
+        if on_error is not None:
+            on_error(domain, error)
+        return domain, verdict
+
+    return dict(await asyncio.gather(*(resolve(d) for d in domains)))
+
+
+def resolve_domains(
+    domains,
+    resolver=None,
+    cache=CACHE,
+    timeout=DNS_TIMEOUT,
+    max_workers=DNS_MAX_WORKERS,
+    on_error=None,
+):
+    """Risolve in parallelo i domini distinti e restituisce {dominio: raggiungibile}.
+
+    Il verdetto è None per i domini la cui risoluzione è scaduta: non viene
+    memorizzato nella cache e vale come sconosciuto. Senza `resolver` usa
+    `socket.gethostbyname`, cercato al momento della chiamata così che possa
+    essere sostituito (per esempio nei benchmark).
+    """
+    if resolver is None:
+        resolver = socket.gethostbyname
+    domains = list(dict.fromkeys(d for d in domains if d))
+    verdicts, missing = cache.get_many(domains) if cache is not None else ({}, domains)
+    DNS_CACHE_LOOKUPS.inc(len(verdicts), result="hit")
+    DNS_CACHE_LOOKUPS.inc(len(missing), result="miss")
+    if missing:
+        logger.info(
+            f"DNS: {len(missing)} domini da risolvere, {len(verdicts)} in cache"
+        )
+        resolved = asyncio.run(
+            _resolve_all(missing, resolver, timeout, max_workers, on_error)
+        )
+        if cache is not None:
+            cache.set_many(resolved)
+        verdicts.update(resolved)
+    return verdicts
+
+
+def check_domains_reachable(emails, valid=None, domains=None, **kwargs):
+    """Verifica la raggiungibilità dei domini di una colonna di email.
+
+    I domini vengono deduplicati e risolti una sola volta; i verdetti sono poi
+    riportati sulle righe con un'unica `map`. Le righe non valide sono False,
+    quelle con una risoluzione scaduta None (sconosciuto). `domains`, se già
+    estratti (vedi validate_emails), evita di ridividere le email.
+    """
+    emails = emails.astype("string")
+    if valid is None:
+        valid = pd.Series(True, index=emails.index)
+    valid = valid.astype(bool)
+    if domains is None:
+        domains = emails.str.split("@").str[1]
+    domains = domains.where(valid)
+    verdicts = resolve_domains(domains.dropna().unique(), **kwargs)
+    reachable = domains.map(verdicts).astype(object)
+    reachable = reachable.where(reachable.notna(), None)
+    reachable[~valid] = False
+    return reachable
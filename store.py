@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Archivio dei file caricati, indicizzati per hash del contenuto, e dei
+# risultati della pulizia già calcolati
+STORE_DIR = os.getenv("STORE_DIR", "store")
+RESULT_CACHE = os.getenv("RESULT_CACHE", "true").lower() == "true"
+# Limiti dell'archivio: età massima in secondi e dimensione totale in byte
+STORE_MAX_AGE = float(os.getenv("STORE_MAX_AGE", str(7 * 24 * 3600)))
+STORE_MAX_BYTES = int(os.getenv("STORE_MAX_BYTES", str(5 * 1024**3)))
+
+# Versione del formato dei risultati in cache, da incrementare se cambia
+PIPELINE_VERSION = "1"
+# Moduli il cui codice determina il risultato della pulizia
+PIPELINE_MODULES = (
+    "clean.py", "emails.py", "phones.py", "domains.py", "geo.py", "resolver.py", "dedup.py",
+)
+
+HASH_CHUNK = 1024 * 1024
+
+# Impostazioni da ambiente che cambiano il risultato della pulizia, registrate
+# dai moduli della pipeline con output_setting: fanno parte dell'impronta
+OUTPUT_SETTINGS = {}
+
+
+def output_setting(name, value):
+    """Registra un'impostazione che determina il risultato della pulizia e la restituisce."""
+    OUTPUT_SETTINGS[name] = value
+    return value
+
+
+def upload_path(input_hash, directory=STORE_DIR):
+    return os.path.join(directory, "uploads", f"{input_hash}.xlsx")
+
+
+def result_paths(key, directory=STORE_DIR):
+    """Percorsi del CSV pulito e dei suoi metadati per la chiave indicata."""
+    base = os.path.join(directory, "results", key)
+    return f"{base}.csv", f"{base}.json"
+
+
+class UploadWriter:
+    """Scrive un file caricato calcolandone l'hash SHA-256 durante la scrittura.
+
+    Il file viene scritto in un temporaneo e, con `commit`, spostato nel
+    percorso indicizzato dall'hash; un contenuto già presente non viene
+    duplicato. Uscendo dal blocco `with` senza commit il temporaneo è rimosso.
+    """
+
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "uploads"), exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(
+            dir=os.path.join(directory, "uploads"), suffix=".part"
+        )
+        self._file = os.fdopen(fd, "wb")
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.input_hash = None
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        """Completa la scrittura e restituisce l'hash del contenuto."""
+        self._file.close()
+        self.input_hash = self._hash.hexdigest()
+        path = upload_path(self.input_hash, self.directory)
+        if os.path.exists(path):
+            os.remove(self._tmp_path)
+            # Un nuovo caricamento rinnova il file rispetto alla scadenza
+            os.utime(path)
+            logger.info(f"File già presente nell'archivio: {self.input_hash}")
+        else:
+            os.replace(self._tmp_path, path)
+        return self.input_hash
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.input_hash is None:
+            self.abort()
+
+
+def _source_digest(hasher, path):
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            hasher.update(chunk)
+
+
+def file_hash(path):
+    """Hash SHA-256 del contenuto di `path`, come quello dei file caricati."""
+    hasher = hashlib.sha256()
+    _source_digest(hasher, path)
+    return hasher.hexdigest()
+
+
+def config_fingerprint(table_id, dedup_mode, chunk_rows):
+    """Impronta della configurazione che determina il risultato della pulizia.
+
+    Comprende il codice della pipeline, il riferimento geografico, le
+    impostazioni registrate in OUTPUT_SETTINGS e la dimensione dei blocchi
+    (i suggerimenti per le email dipendono dai domini dei blocchi già letti).
+    Con la deduplica attiva il risultato dipende dagli invii precedenti alla
+    tabella, che fa quindi parte dell'impronta.
+    """
+    # L'import di clean carica tutti i moduli della pipeline e le loro impostazioni
+    from . import clean  # noqa: F401
+    from .geo import GEO_CSV
+
+    hasher = hashlib.sha256(f"v{PIPELINE_VERSION}:{dedup_mode}:{chunk_rows}".encode())
+    hasher.update(json.dumps(OUTPUT_SETTINGS, sort_keys=True).encode())
+    if dedup_mode != "off":
+        hasher.update(f":{table_id}".encode())
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in PIPELINE_MODULES:
+        _source_digest(hasher, os.path.join(package_dir, module))
+    if os.path.exists(GEO_CSV):
+        _source_digest(hasher, GEO_CSV)
+    return hasher.hexdigest()
+
+
+def result_key(input_hash, fingerprint):
+    return hashlib.sha256(f"{input_hash}:{fingerprint}".encode()).hexdigest()
+
+
+def load_result(key, directory=STORE_DIR):
+    """Metadati del risultato in cache, o None se assente."""
+    csv_path, meta_path = result_paths(key, directory)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if not os.path.exists(csv_path):
+        return None
+    now = time.time()
+    os.utime(csv_path, (now, now))
+    os.utime(meta_path, (now, now))
+    return meta
+
+
+def iter_result_chunks(key, chunksize, directory=STORE_DIR):
+    """Legge a blocchi il CSV pulito in cache, con i valori come testo."""
+    csv_path, _ = result_paths(key, directory)
+    yield from pd.read_csv(csv_path, dtype=str, keep_default_na=False, chunksize=chunksize)
+
+
+def save_result(key, output_path, meta, directory=STORE_DIR):
+    """Aggiunge alla cache il CSV pulito `output_path` con i suoi metadati."""
+    os.makedirs(os.path.join(directory, "results"), exist_ok=True)
+    csv_path, meta_path = result_paths(key, directory)
+    # Una copia, non un collegamento: il file in uscita può essere riscritto
+    shutil.copyfile(output_path, f"{csv_path}.part")
+    os.replace(f"{csv_path}.part", csv_path)
+    with open(f"{meta_path}.part", "w") as f:
+        json.dump(meta, f)
+    os.replace(f"{meta_path}.part", meta_path)
+    logger.info(f"Risultato salvato in cache: {key}")
+
+
+def evict(keep=(), max_age=STORE_MAX_AGE, max_bytes=STORE_MAX_BYTES, directory=STORE_DIR):
+    """Rimuove file caricati e risultati scaduti, poi i meno usati oltre `max_bytes`.
+
+    I file caricati con hash in `keep` (quelli dei job attivi) non vengono
+    rimossi. Restituisce il numero di file rimossi.
+    """
+    keep = {upload_path(input_hash, directory) for input_hash in keep}
+    now = time.time()
+    entries = []
+    for folder in ("uploads", "results"):
+        path = os.path.join(directory, folder)
+        if not os.path.isdir(path):
+            continue
+        for name in os.listdir(path):
+            file_path = os.path.join(path, name)
+            if file_path in keep:
+                continue
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            # I temporanei in scrittura si rimuovono solo se abbandonati
+            if name.endswith(".part") and now - stat.st_mtime <= max_age:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for mtime, size, file_path in entries:
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    if removed:
+        logger.info(f"Archivio: rimossi {removed} file, {total} byte occupati")
+    return removed
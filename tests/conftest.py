@@ -0,0 +1,30 @@
+import pytest
+
+
+@pytest.fixture(scope="session")
+def main_module(tmp_path_factory):
+    """Modulo dell'applicazione, importato in una cartella di lavoro temporanea."""
+    work = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("DATABASE_URL", f"sqlite:///{work}/users.db")
+        patch.chdir(work)
+        from .. import main
+    return main
+
+
+@pytest.fixture
+def client(main_module):
+    from fastapi.testclient import TestClient
+
+    # Senza il blocco `with` gli eventi di avvio (dispatcher, utenti) non partono
+    return TestClient(main_module.app)
+
+
+@pytest.fixture
+def history_db(tmp_path, monkeypatch):
+    """Cronologia delle esecuzioni su un database SQLite temporaneo."""
+    from .. import history
+
+    monkeypatch.setattr(history, "DATABASE_URL", f"sqlite:///{tmp_path}/history.db")
+    monkeypatch.setattr(history, "_session_factory", None)
+    return history
@@ -0,0 +1,113 @@
+import os
+import time
+
+import pytest
+from itsdangerous import URLSafeTimedSerializer
+
+from ..auth import SessionSigner, UserCache, password_fingerprint
+
+USER = {"username": "mario", "password_hash": "$2b$12$hash", "session_generation": 3}
+
+
+def test_token_round_trip():
+    signer = SessionSigner("secret", max_age=60)
+    fingerprint = password_fingerprint(USER["password_hash"])
+    assert signer.loads(signer.dumps(USER)) == ("mario", fingerprint, 3)
+
+
+def test_token_rejected_when_tampered_or_foreign():
+    signer = SessionSigner("secret", max_age=60)
+    token = signer.dumps(USER)
+    assert signer.loads(token + "x") is None
+    assert SessionSigner("other", max_age=60).loads(token) is None
+
+
+def test_token_expires(monkeypatch):
+    signer = SessionSigner("secret", max_age=60)
+    token = signer.dumps(USER)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert signer.loads(token) is None
+
+
+def test_token_without_generation():
+    # Token emesso prima dell'introduzione della generazione
+    token = URLSafeTimedSerializer("secret", salt="grezzi-session").dumps({"u": "mario", "p": "x"})
+    assert SessionSigner("secret").loads(token) == ("mario", "x", 0)
+
+
+def test_user_cache_lru_and_ttl(monkeypatch):
+    cache = UserCache(size=2, ttl=10)
+    for name in ("a", "b"):
+        cache.put({"username": name})
+    cache.get("a")
+    cache.put({"username": "c"})
+    # "b" era il meno recente
+    assert cache.get("b") is None and cache.get("a") and cache.get("c")
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+
+
+@pytest.fixture
+def user(main_module, monkeypatch):
+    """Utente "mario" con password "segreta" e cache degli utenti vuota."""
+    from passlib.hash import bcrypt
+
+    monkeypatch.chdir(os.path.dirname(main_module.__file__))
+    db = main_module.SessionLocal()
+    db.query(main_module.User).filter_by(username="mario").delete()
+    db.query(main_module.SessionGeneration).filter_by(username="mario").delete()
+    db.add(main_module.User(username="mario", password_hash=bcrypt.hash("segreta")))
+    db.commit()
+    db.close()
+    main_module.user_cache.invalidate()
+    yield "mario"
+    main_module.user_cache.invalidate()
+
+
+def login(client):
+    response = client.post(
+        "/login", data={"username": "mario", "password": "segreta"}, follow_redirects=False
+    )
+    assert response.status_code == 302
+    return response.cookies["session"]
+
+
+def logged_in(client, token):
+    client.cookies.set("session", token)
+    return client.get("/", follow_redirects=False).status_code == 200
+
+
+def test_login_and_wrong_password(client, user):
+    token = login(client)
+    assert logged_in(client, token)
+    response = client.post(
+        "/login", data={"username": "mario", "password": "sbagliata"}, follow_redirects=False
+    )
+    assert "session" not in response.cookies
+
+
+def test_password_change_invalidates_sessions(client, user, main_module):
+    from passlib.hash import bcrypt
+
+    token = login(client)
+    db = main_module.SessionLocal()
+    db.query(main_module.User).filter_by(username="mario").update(
+        {"password_hash": bcrypt.hash("nuova")}
+    )
+    db.commit()
+    db.close()
+    main_module.user_cache.invalidate("mario")
+    assert not logged_in(client, token)
+
+
+def test_logout_revokes_signed_token(client, user):
+    first = login(client)
+    second = login(client)
+    client.cookies.set("session", first)
+    assert client.get("/logout", follow_redirects=False).status_code == 302
+    # Il cookie copiato altrove non è più valido, come le altre sessioni dell'utente
+    assert not logged_in(client, first)
+    assert not logged_in(client, second)
+    assert logged_in(client, login(client))
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from ..catalog import OutputCatalog
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / "puliti"
+    folder.mkdir()
+    for name in ("a.csv", "b_1.csv", "b%1.csv", "a.csv.gz", "c.csv.part"):
+        (folder / name).write_text("Email\nmario@example.it\n")
+    return folder
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    return OutputCatalog(str(tmp_path / "catalog.sqlite3"))
+
+
+def names(catalog, **kwargs):
+    _, rows = catalog.list_outputs(sort="filename", descending=False, **kwargs)
+    return [row["filename"] for row in rows]
+
+
+def test_sync_adds_and_removes(catalog, folder):
+    catalog.sync(str(folder))
+    # Le copie compresse e i file parziali non sono elencati
+    assert names(catalog) == ["a.csv", "b%1.csv", "b_1.csv"]
+    os.remove(folder / "b_1.csv")
+    (folder / "d.csv").write_text("Email\n")
+    catalog.sync(str(folder))
+    assert names(catalog) == ["a.csv", "b%1.csv", "d.csv"]
+
+
+def test_sync_keeps_metadata_of_known_files(catalog, folder):
+    catalog.add(str(folder / "a.csv"), rows=1, source="a.xlsx", table_id="t1", job_id="j1")
+    catalog.sync(str(folder))
+    total, rows = catalog.list_outputs(table_id="t1")
+    assert total == 1
+    assert (rows[0]["filename"], rows[0]["rows"], rows[0]["source"]) == ("a.csv", 1, "a.xlsx")
+    # I file trovati solo sul disco non hanno righe né origine
+    _, rows = catalog.list_outputs(search="b_1")
+    assert (rows[0]["rows"], rows[0]["source"]) == (None, None)
+    assert rows[0]["size"] == os.path.getsize(folder / "b_1.csv")
+
+
+def test_updated_at_changes_only_on_changes(catalog, folder):
+    assert catalog.updated_at() == 0
+    catalog.sync(str(folder))
+    first = catalog.updated_at()
+    assert first > 0
+    catalog.sync(str(folder))
+    assert catalog.updated_at() == first
+    os.remove(folder / "a.csv")
+    catalog.sync(str(folder))
+    assert catalog.updated_at() > first
+
+
+def test_search_escapes_wildcards(catalog, folder):
+    catalog.sync(str(folder))
+    assert names(catalog, search="b_") == ["b_1.csv"]
+    assert names(catalog, search="%") == ["b%1.csv"]
+    assert names(catalog, search="CSV") == ["a.csv", "b%1.csv", "b_1.csv"]
+
+
+def test_pagination_and_sort(catalog, folder):
+    catalog.sync(str(folder))
+    total, rows = catalog.list_outputs(page=2, per_page=2, sort="filename", descending=True)
+    assert total == 3 and [row["filename"] for row in rows] == ["a.csv"]
+    with pytest.raises(ValueError):
+        catalog.list_outputs(sort="filename; DROP TABLE outputs")
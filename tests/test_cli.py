@@ -0,0 +1,112 @@
+import os
+import shutil
+
+import pytest
+
+from .. import cli
+from ..cli import Checkpoint, find_inputs, run_batch
+
+
+class StubClean:
+    """clean_data finto: registra i file elaborati, fallisce o si interrompe a comando."""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = set()
+        self.interrupt = set()
+
+    def __call__(self, table_id, filename, input_path, input_hash, **options):
+        self.calls.append(filename)
+        if filename in self.interrupt:
+            raise KeyboardInterrupt
+        if filename in self.fail:
+            raise ValueError("file illeggibile")
+        return {"rows_in": 10, "rows_out": 8, "stages": {"read": 0.1}}
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    folder = tmp_path / "in"
+    folder.mkdir()
+    for name in ("a", "b", "c"):
+        (folder / f"{name}.xlsx").write_bytes(f"contenuto {name}".encode())
+    return folder
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = StubClean()
+    monkeypatch.setattr(cli, "clean_data", stub)
+    return stub
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    return Checkpoint(str(tmp_path / "checkpoint.sqlite3"))
+
+
+def paths(folder):
+    return find_inputs([str(folder)])
+
+
+def test_find_inputs(inputs):
+    (inputs / "~$a.xlsx").write_bytes(b"lock")
+    (inputs / "note.txt").write_text("")
+    found = find_inputs([str(inputs), str(inputs / "a.xlsx"), str(inputs / "*.xlsx")])
+    assert [os.path.basename(path) for path in found] == ["a.xlsx", "b.xlsx", "c.xlsx"]
+
+
+def test_resume_after_failure(inputs, stub, checkpoint, capsys):
+    stub.fail.add("b.xlsx")
+    outcomes, skipped = run_batch(paths(inputs), "t1", {}, checkpoint=checkpoint)
+    assert [r["status"] for r in outcomes] == ["completed", "failed", "completed"]
+    assert "ValueError" in outcomes[1]["error"] and skipped == 0
+
+    stub.fail.clear()
+    stub.calls.clear()
+    outcomes, skipped = run_batch(paths(inputs), "t1", {}, checkpoint=checkpoint)
+    # Si riprende solo dal file fallito
+    assert stub.calls == ["b.xlsx"] and skipped == 2
+    assert "2 file già completati" in capsys.readouterr().err
+
+
+def test_resume_after_interruption(inputs, stub, checkpoint):
+    stub.interrupt.add("b.xlsx")
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(paths(inputs), "t1", {}, checkpoint=checkpoint)
+    assert checkpoint.completed("t1", True) != set()
+
+    stub.interrupt.clear()
+    stub.calls.clear()
+    outcomes, skipped = run_batch(paths(inputs), "t1", {}, checkpoint=checkpoint)
+    assert stub.calls == ["b.xlsx", "c.xlsx"] and skipped == 1
+    assert len(checkpoint.completed("t1", True)) == 3
+
+
+def test_files_identified_by_content_table_and_push(inputs, stub, checkpoint):
+    run_batch(paths(inputs), "t1", {}, checkpoint=checkpoint)
+    # Rinominato o copiato: stesso contenuto, non viene rielaborato
+    os.rename(inputs / "a.xlsx", inputs / "z.xlsx")
+    shutil.copy(inputs / "b.xlsx", inputs / "b copia.xlsx")
+    stub.calls.clear()
+    _, skipped = run_batch(paths(inputs), "t1", {}, checkpoint=checkpoint)
+    assert stub.calls == [] and skipped == 4
+
+    run_batch(paths(inputs), "t2", {}, checkpoint=checkpoint)
+    run_batch(paths(inputs), "t1", {"push": False}, checkpoint=checkpoint)
+    assert len(stub.calls) == 6
+
+
+def test_duplicates_processed_once(inputs, stub):
+    shutil.copy(inputs / "a.xlsx", inputs / "a copia.xlsx")
+    outcomes, skipped = run_batch(paths(inputs), "t1", {})
+    assert len(outcomes) == 3 and skipped == 1
+    assert stub.calls == ["a copia.xlsx", "b.xlsx", "c.xlsx"]
+
+
+def test_clear_restarts_batch(inputs, stub, checkpoint):
+    run_batch(paths(inputs), "t1", {}, checkpoint=checkpoint)
+    checkpoint.clear()
+    stub.calls.clear()
+    run_batch(paths(inputs), "t1", {}, checkpoint=checkpoint)
+    assert len(stub.calls) == 3
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+from .. import db
+
+
+class StubNocoDB(BaseHTTPRequestHandler):
+    """Server NocoDB finto: registra le richieste e risponde secondo `script`.
+
+    `script` è una lista di codici HTTP consumati una richiesta alla volta
+    (poi 200); un blocco che contiene il record {"fail": True} riceve sempre 500.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        with server.lock:
+            server.requests.append((self.command, body))
+            status = server.script.pop(0) if server.script else 200
+        if body and any(record.get("fail") for record in body):
+            status = 500
+        time.sleep(server.delay)
+        payload = json.dumps([{"id": i} for i in range(len(body or []))]).encode()
+        try:
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except OSError:
+            pass
+
+    do_GET = do_POST = do_PATCH = _handle
+
+
+@pytest.fixture
+def nocodb(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubNocoDB)
+    server.lock = threading.Lock()
+    server.requests, server.script, server.delay = [], [], 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(db, "NC_BACKOFF", 0.001)
+    monkeypatch.setattr(db, "NC_TIMEOUT", 0.3)
+    monkeypatch.setattr(db, "NC_DATA_URL", f"http://127.0.0.1:{server.server_port}")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_port}/records"
+
+
+@pytest.mark.parametrize("status", [429, 503])
+@pytest.mark.parametrize("method", ["POST", "GET"])
+def test_retries_unprocessed_statuses(nocodb, method, status):
+    nocodb.script = [status, status]
+    response, result = db.request_with_retry(method, url(nocodb), max_retries=4, json=[{}])
+    assert result["ok"] and result["attempts"] == 3
+    assert response is not None
+    assert len(nocodb.requests) == 3
+
+
+def test_post_not_retried_after_server_error(nocodb):
+    nocodb.script = [500]
+    response, result = db.request_with_retry("POST", url(nocodb), max_retries=4, json=[{}])
+    assert response is None and result["status"] == 500
+    assert len(nocodb.requests) == 1
+
+
+def test_get_retried_after_server_error(nocodb):
+    nocodb.script = [500]
+    _, result = db.request_with_retry("GET", url(nocodb), max_retries=4)
+    assert result["ok"] and len(nocodb.requests) == 2
+
+
+def test_post_not_replayed_after_read_timeout(nocodb):
+    # La richiesta è arrivata al server: ripeterla potrebbe duplicare le righe
+    nocodb.delay = 0.6
+    response, result = db.request_with_retry("POST", url(nocodb), max_retries=4, json=[{}])
+    assert response is None and not result["ok"]
+    assert result["attempts"] == 1
+    assert len(nocodb.requests) == 1
+
+
+def test_post_retried_when_not_sent(monkeypatch):
+    monkeypatch.setattr(db, "NC_BACKOFF", 0.001)
+    # Porta chiusa: la connessione non si stabilisce e la richiesta non parte
+    _, result = db.request_with_retry("POST", "http://127.0.0.1:1/x", max_retries=3, json=[])
+    assert result["attempts"] == 3 and not result["ok"]
+
+
+def test_send_batches_splits_and_keeps_order(nocodb):
+    df = pd.DataFrame({"n": range(25)})
+    results = db.send_batches(
+        url(nocodb), db.iter_record_batches(df, batch_size=10), max_concurrency=2
+    )
+    assert [r["batch"] for r in results] == [0, 1, 2]
+    assert [r["rows"] for r in results] == [10, 10, 5]
+    assert all(r["ok"] for r in results)
+    sent = sorted(record["n"] for _, body in nocodb.requests for record in body)
+    assert sent == list(range(25))
+
+
+def test_save_to_table_raises_on_failed_batch(nocodb):
+    df = pd.DataFrame({"n": range(30), "fail": [False] * 30})
+    df.loc[15, "fail"] = True
+    with pytest.raises(RuntimeError, match="1 blocchi su 3 non salvati \\(10 righe\\)"):
+        db.save_to_table("t1", df, batch_size=10)
+    # Gli altri blocchi restano salvati, quello fallito non viene ripetuto
+    assert len(nocodb.requests) == 3
+
+
+def test_save_to_table(nocodb):
+    results = db.save_to_table("t1", pd.DataFrame({"n": range(5)}), batch_size=2)
+    assert [r["rows"] for r in results] == [2, 2, 1]
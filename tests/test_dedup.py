@@ -0,0 +1,176 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .. import clean, dedup
+from ..dedup import BloomFilter, DedupFilter, DedupIndex, email_digests
+
+
+def emails(prefix, count):
+    return [f"{prefix}{i}@example.it" for i in range(count)]
+
+
+def test_email_digests_normalize():
+    assert email_digests([" Mario@Example.IT "]) == email_digests(["mario@example.it"])
+
+
+def test_bloom_filter_has_no_false_negatives(tmp_path):
+    bloom = BloomFilter(10_000, false_positive=0.01)
+    added = email_digests(emails("a", 10_000))
+    bloom.add(added)
+    assert bloom.contains(added).all()
+    # Tasso di falsi positivi vicino a quello richiesto
+    others = bloom.contains(email_digests(emails("b", 20_000)))
+    assert others.mean() < 0.02
+
+    path = tmp_path / "t.bloom"
+    bloom.save(path)
+    loaded = BloomFilter.load(path)
+    assert loaded.count == 10_000 and loaded.capacity == 10_000
+    np.testing.assert_array_equal(loaded.bits, bloom.bits)
+    assert loaded.contains(added).all()
+
+
+def test_bloom_filter_empty():
+    bloom = BloomFilter(100)
+    assert bloom.contains([]).shape == (0,)
+    bloom.add([])
+    assert bloom.count == 0
+
+
+def test_index_persists_keys(tmp_path):
+    index = DedupIndex("t1", tmp_path)
+    first = email_digests(emails("a", 50))
+    index.add(first)
+    index.close()
+
+    index = DedupIndex("t1", tmp_path)
+    second = email_digests(emails("b", 50))
+    assert index.contains(first).all()
+    assert not index.contains(second).any()
+    index.record_lookups(100, 50, 3)
+    stats = index.stats()
+    assert stats["keys"] == 50 and stats["hit_rate"] == 0.5
+    assert stats["file_duplicates"] == 3
+    index.close()
+
+
+def test_index_rebuilds_missing_bloom(tmp_path):
+    index = DedupIndex("t1", tmp_path)
+    keys = email_digests(emails("a", 50))
+    index.add(keys)
+    index.close()
+    os.remove(tmp_path / "t1.bloom")
+
+    index = DedupIndex("t1", tmp_path)
+    assert index.contains(keys).all()
+    assert index._get_bloom().count == 50
+    index.close()
+
+
+def test_index_grows_bloom_past_capacity(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_CAPACITY", 100)
+    index = DedupIndex("t1", tmp_path)
+    keys = email_digests(emails("a", 300))
+    for start in range(0, 300, 60):
+        index.add(keys[start : start + 60])
+    bloom = index._get_bloom()
+    assert bloom.capacity >= 300 and bloom.count == 300
+    assert index.contains(keys).all()
+    index.close()
+
+
+def _add_keys(directory, worker):
+    index = DedupIndex("t1", directory)
+    for batch in range(10):
+        index.add(email_digests(emails(f"w{worker}b{batch}k", 100)))
+    index.close()
+
+
+def test_concurrent_writers_keep_each_others_keys(tmp_path):
+    # Processi distinti che aggiornano lo stesso filtro: nessuna chiave persa
+    DedupIndex("t1", tmp_path).close()
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=_add_keys, args=(str(tmp_path), n)) for n in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    index = DedupIndex("t1", tmp_path)
+    keys = email_digests(
+        [e for n in range(3) for b in range(10) for e in emails(f"w{n}b{b}k", 100)]
+    )
+    bloom = index._get_bloom()
+    assert bloom.contains(keys).all()
+    assert bloom.count == index._key_count() == 3000
+    index.close()
+
+
+def frame(addresses, valid):
+    return pd.DataFrame({"Email Corretta": addresses, "Email Valida": valid})
+
+
+@pytest.mark.parametrize("mode", ["flag", "drop"])
+def test_filter_in_file_and_previous_uploads(tmp_path, mode):
+    previous = DedupFilter("t1", mode, tmp_path)
+    previous.commit(frame(["old@example.it"], [True]))
+    previous.close()
+
+    dedup_filter = DedupFilter("t1", mode, tmp_path)
+    df = frame(
+        ["old@example.it", "new@example.it", "NEW@example.it", "x", None],
+        [True, True, True, False, False],
+    )
+    result = dedup_filter.apply(df)
+    if mode == "flag":
+        assert result["Duplicato"].tolist() == [True, False, True, False, False]
+    else:
+        assert result["Email Corretta"].tolist() == ["new@example.it", "x", None]
+        assert dedup_filter.dropped == 2
+    dedup_filter.close()
+
+
+def test_filter_reads_cached_text_flags(tmp_path):
+    # Dal risultato in cache "Email Valida" arriva come testo
+    dedup_filter = DedupFilter("t1", "flag", tmp_path)
+    df = frame(["a@example.it", "a@example.it", "b@example.it"], ["False", "False", "True"])
+    assert dedup_filter.apply(df)["Duplicato"].tolist() == [False, False, False]
+    dedup_filter.close()
+
+
+def test_filter_across_chunks_and_commit(tmp_path):
+    dedup_filter = DedupFilter("t1", "flag", tmp_path)
+    first = dedup_filter.apply(frame(["a@example.it", "b@example.it"], [True, True]))
+    dedup_filter.commit(first.iloc[:1])
+    # a è ora nell'indice, b solo in memoria: entrambi duplicati nel blocco successivo
+    assert set(dedup_filter._seen) == set(email_digests(["b@example.it"]))
+    second = dedup_filter.apply(frame(["a@example.it", "b@example.it"], [True, True]))
+    assert second["Duplicato"].tolist() == [True, True]
+    dedup_filter.close()
+
+
+def test_filter_bounds_seen(tmp_path):
+    dedup_filter = DedupFilter("t1", "flag", tmp_path, seen_limit=10)
+    dedup_filter.apply(frame(emails("a", 25), [True] * 25))
+    assert len(dedup_filter._seen) == 10
+    # Restano le più recenti
+    assert set(dedup_filter._seen) == set(email_digests(emails("a", 25)[-10:]))
+    dedup_filter.close()
+
+
+def test_flag_column_not_sent_to_nocodb(tmp_path, monkeypatch):
+    sent = []
+    monkeypatch.setattr(clean.db, "save_to_table", lambda table_id, df: sent.append(df))
+    dedup_filter = DedupFilter("t1", "flag", tmp_path)
+    df = dedup_filter.apply(frame(["a@example.it", "a@example.it"], [True, True]))
+    clean._write_chunk("t1", df, None, dedup_filter)
+    assert "Duplicato" not in sent[0].columns and "Duplicato" in df.columns
+    assert dedup_filter.index.contains(email_digests(["a@example.it"])).all()
+    dedup_filter.close()
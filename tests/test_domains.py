@@ -0,0 +1,93 @@
+import random
+import string
+
+import pytest
+
+from ..domains import DomainIndex, bounded_distance
+
+VOCABULARY = [
+    "gmail.com", "libero.it", "hotmail.it", "hotmail.com", "yahoo.it", "virgilio.it",
+    "alice.it", "tin.it", "pec.it", "aruba.it", "tiscali.it", "outlook.it",
+    "pizzeriadamario.it", "studiorossi.com", "ferramentabianchi.it", "hotelmiramare.it",
+    "autofficinaverdi.it", "farmaciacentrale.it", "barsport.it", "ottica-neri.it",
+]
+
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        previous = current
+    return previous[-1]
+
+
+def brute_force(domain, vocabulary, max_distance=2):
+    """Stesso criterio di DomainIndex.suggest, confrontando tutto il vocabolario."""
+    domain = domain.lower().strip()
+    if domain in vocabulary:
+        return domain
+    bound = max_distance if len(domain) > 5 else 1
+    best = None
+    for i, candidate in enumerate(vocabulary):
+        distance = levenshtein(domain, candidate)
+        if "." not in domain:
+            distance = min(distance, levenshtein(domain, candidate.rsplit(".", 1)[0]))
+        if distance <= bound and (best is None or (distance, i) < best):
+            best = (distance, i)
+    return vocabulary[best[1]] if best else None
+
+
+def typo(rng, text):
+    i = rng.randrange(len(text))
+    kind = rng.randrange(4)
+    letter = rng.choice(string.ascii_lowercase)
+    if kind == 0:
+        return text[:i] + text[i + 1 :]
+    if kind == 1:
+        return text[:i] + letter + text[i:]
+    if kind == 2:
+        return text[:i] + letter + text[i + 1 :]
+    return text[:i] + text[i + 1 : i + 2] + text[i : i + 1] + text[i + 2 :]
+
+
+def queries(seed=0):
+    rng = random.Random(seed)
+    result = []
+    for domain in VOCABULARY:
+        for _ in range(10):
+            query = domain
+            for _ in range(rng.choice((1, 1, 2, 3))):
+                query = typo(rng, query)
+            result.append(query)
+        result.append(domain.rsplit(".", 1)[0])
+    return result + ["", "x.it", "example.org", "gmial", "GMAIL.COM ", "libero"]
+
+
+@pytest.mark.parametrize("a, b", [("kitten", "sitting"), ("", "abc"), ("gmail.com", "gmial.com")])
+def test_bounded_distance(a, b):
+    distance = levenshtein(a, b)
+    assert bounded_distance(a, b, 5) == distance
+    # Oltre il limite restituisce limite + 1
+    assert bounded_distance(a, b, distance - 1) == distance
+
+
+def test_suggest_matches_brute_force():
+    index = DomainIndex(VOCABULARY, providers=())
+    for query in queries():
+        assert index.suggest(query) == brute_force(query, VOCABULARY), query
+
+
+def test_suggest_is_memoized_and_reset_on_add():
+    index = DomainIndex(["studiorossi.com"], providers=())
+    assert index.suggest("studiorosi.it") is None
+    index.add(["studiorossi.it"])
+    assert index.suggest("studiorosi.it") == "studiorossi.it"
+
+
+def test_add_ignores_invalid_domains():
+    index = DomainIndex([None, 3, "", "not a domain", " Example.IT "], providers=())
+    assert len(index) == 1 and "example.it" in index
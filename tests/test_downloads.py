@@ -0,0 +1,136 @@
+import gzip
+import io
+import os
+import random
+import zipfile
+
+import pytest
+
+from ..downloads import (
+    STREAM_CHUNK,
+    RangeNotSatisfiable,
+    iter_compressed,
+    iter_zip,
+    parse_range,
+    precompress,
+)
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=900-2000", (900, 999)),
+        ("bytes=500-", (500, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        (" bytes=10-10 ", (10, 10)),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=2000-3000", "bytes=-0", "bytes=5-2"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, SIZE)
+
+
+@pytest.mark.parametrize(
+    "header", [None, "", "bytes=-", "bytes=0-1,5-6", "items=0-10", "bytes=a-b"]
+)
+def test_parse_range_ignored(header):
+    # Header mancante o non supportato: si risponde con il file intero
+    assert parse_range(header, SIZE) is None
+
+
+def write_file(path, size, seed=0):
+    # Metà testo ripetuto e metà byte casuali: comprimibile solo in parte
+    rng = random.Random(seed)
+    data = (b"Email,Nome\nmario@example.it,Mario\n" * size)[: size // 2]
+    data += rng.randbytes(size - len(data))
+    path.write_bytes(data)
+    return data
+
+
+def test_iter_compressed_gzip(tmp_path):
+    data = write_file(tmp_path / "a.csv", 3 * STREAM_CHUNK + 17)
+    chunks = list(iter_compressed(str(tmp_path / "a.csv"), "gzip"))
+    assert len(chunks) > 1
+    assert gzip.decompress(b"".join(chunks)) == data
+
+
+def test_precompress_writes_siblings(tmp_path):
+    data = write_file(tmp_path / "a.csv", 5000)
+    paths = precompress(str(tmp_path / "a.csv"))
+    assert str(tmp_path / "a.csv.gz") in paths
+    assert gzip.decompress((tmp_path / "a.csv.gz").read_bytes()) == data
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_iter_zip_is_readable(tmp_path):
+    contents = {
+        "a.csv": write_file(tmp_path / "a.csv", 2 * STREAM_CHUNK + 5, seed=1),
+        "b.csv": write_file(tmp_path / "b.csv", 10, seed=2),
+        "empty.csv": write_file(tmp_path / "empty.csv", 0),
+    }
+    chunks = list(iter_zip([str(tmp_path / name) for name in contents]))
+    # L'archivio esce a pezzi mentre viene compresso
+    assert len(chunks) > 2
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(contents)
+        for name, data in contents.items():
+            assert archive.read(name) == data
+
+
+@pytest.fixture
+def output_file(main_module, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(main_module.OUTPUT_FOLDER)
+    return write_file(tmp_path / main_module.OUTPUT_FOLDER / "a.csv", 4000)
+
+
+IDENTITY = {"Accept-Encoding": "identity"}
+
+
+def test_download_range(client, output_file):
+    response = client.get("/download/a.csv", headers={**IDENTITY, "Range": "bytes=-100"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 3900-3999/4000"
+    assert response.content == output_file[-100:]
+
+
+def test_download_if_range(client, output_file):
+    etag = client.get("/download/a.csv", headers=IDENTITY).headers["ETag"]
+    resumed = client.get(
+        "/download/a.csv", headers={**IDENTITY, "Range": "bytes=100-", "If-Range": etag}
+    )
+    assert resumed.status_code == 206 and resumed.content == output_file[100:]
+    # ETag diverso: il file è cambiato, si riparte dall'inizio
+    stale = client.get(
+        "/download/a.csv", headers={**IDENTITY, "Range": "bytes=100-", "If-Range": '"0-0"'}
+    )
+    assert stale.status_code == 200 and stale.content == output_file
+
+
+def test_download_unsatisfiable_range(client, output_file):
+    response = client.get("/download/a.csv", headers={**IDENTITY, "Range": "bytes=4000-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */4000"
+
+
+def test_download_gzip(client, output_file):
+    response = client.get("/download/a.csv", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.content == output_file
+
+
+def test_download_zip(client, output_file):
+    response = client.get("/download_zip", params={"files": ["a.csv", "a.csv"]})
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.namelist() == ["a.csv"]
+        assert archive.read("a.csv") == output_file
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..clean import extract_domain, is_valid_email
+from ..emails import REASONS, extract_domains, normalize_emails, validate_emails
+from ..metrics import EMAIL_CHECKS
+
+CASES = [
+    ("mario.rossi@example.it", None),
+    (" Mario.Rossi@Example.IT ", None),
+    ("a+b_c-d@sub.example.co.uk", None),
+    ("", "empty"),
+    ("   ", "empty"),
+    (None, "empty"),
+    (np.nan, "empty"),
+    ("mario.example.it", "missing_at"),
+    ("mario rossi@example.it", "invalid_local"),
+    ("@example.it", "invalid_local"),
+    ("mario@@example.it", "invalid_domain"),
+    ("mario@example", "invalid_domain"),
+    ("mario@exa mple.it", "invalid_domain"),
+    ("mario@", "invalid_domain"),
+]
+
+
+def test_reasons():
+    emails = pd.Series([email for email, _ in CASES], index=range(10, 10 + len(CASES)))
+    result = validate_emails(emails)
+    assert list(result.index) == list(emails.index)
+    assert result["reason"].tolist() == [reason for _, reason in CASES]
+    assert set(result["reason"].dropna()) <= set(REASONS)
+    assert result["valid"].tolist() == [reason is None for _, reason in CASES]
+    assert result["domain"].tolist()[:3] == ["example.it", "example.it", "sub.example.co.uk"]
+    assert result["domain"].iloc[3:].isna().all()
+
+
+def test_agrees_with_is_valid_email():
+    emails = normalize_emails([email for email, _ in CASES])
+    result = validate_emails(emails, normalize=False)
+    assert result["valid"].tolist() == [is_valid_email(email) for email in emails]
+
+
+def test_without_normalization():
+    result = validate_emails(["Mario@Example.it ", 3, None], normalize=False)
+    assert result["email"].tolist() == ["Mario@Example.it ", 3, None]
+    # Lo spazio finale rende il dominio non valido; i non testi sono vuoti
+    assert result["reason"].tolist() == ["invalid_domain", "empty", "empty"]
+
+
+def test_empty_column():
+    result = validate_emails(pd.Series([], dtype=object))
+    assert result.empty and list(result.columns) == ["email", "valid", "domain", "reason"]
+
+
+def test_outcomes_counted_in_metrics():
+    before = {outcome: EMAIL_CHECKS.value(result=outcome) for outcome in ("valid", "empty")}
+    validate_emails(["a@example.it", "b@example.it", ""])
+    assert EMAIL_CHECKS.value(result="valid") == before["valid"] + 2
+    assert EMAIL_CHECKS.value(result="empty") == before["empty"] + 1
+
+
+@pytest.mark.parametrize(
+    "url", ["www.example.it/contatti", "https://example.it/a", "example.it", "", None, np.nan]
+)
+def test_extract_domains_agrees_with_extract_domain(url):
+    assert extract_domains([url]).tolist() == [extract_domain(url)]
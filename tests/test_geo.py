@@ -0,0 +1,151 @@
+import functools
+import os
+import random
+
+import pytest
+
+from .. import geo
+from ..geo import GEO_CSV, ComuneMatcher, get_geo_index, load_records, normalize_city
+from .test_domains import levenshtein, typo
+
+COMUNI = [
+    "Castro", "Taviano", "Casarano", "Racale", "Alliste", "Melissano", "Ugento",
+    "Gallipoli", "Lecce", "Bergamo", "Castione della Presolana", "Clusone",
+    "San Giovanni Rotondo", "San Giovanni in Persiceto", "Reggio di Calabria",
+    "Reggio nell'Emilia", "Roma", "Milano", "Sant'Agata de' Goti", "Forlì",
+]
+
+
+@pytest.fixture(scope="module")
+def frame():
+    df = get_geo_index()._frame()
+    return df[df["comune"].isin(COMUNI)]
+
+
+def brute_force(query, frame, threshold, province=None):
+    """Comune più simile secondo lo stesso criterio di ComuneMatcher, senza indice."""
+    query = normalize_city(query)
+    comuni = frame.drop_duplicates("codice_istat")
+    if province is not None:
+        comuni = comuni[comuni["sigla_provincia"] == province]
+    best, best_score = [], 0.0
+    for comune, sigla in zip(comuni["comune"], comuni["sigla_provincia"]):
+        name = normalize_city(comune)
+        longest = max(len(query), len(name))
+        distance = levenshtein(query, name)
+        if not query or distance > int(longest * (1 - threshold)):
+            continue
+        score = 1 - distance / longest
+        if score > best_score:
+            best, best_score = [(comune, sigla)], score
+        elif score == best_score:
+            best.append((comune, sigla))
+    return best[0] if len(best) == 1 else None
+
+
+def queries(seed=0):
+    rng = random.Random(seed)
+    result = []
+    for comune in COMUNI:
+        for _ in range(8):
+            query = normalize_city(comune)
+            for _ in range(rng.choice((1, 1, 2, 3))):
+                query = typo(rng, query)
+            result.append(query)
+        result += [comune, comune.upper(), comune.replace("'", " ")]
+    return result + ["", "xyzzy", "Reggio Calabria", "San Giovanni"]
+
+
+@pytest.mark.parametrize("threshold", [0.7, 0.8, 0.9])
+def test_match_agrees_with_brute_force(frame, threshold):
+    matcher = ComuneMatcher(frame, threshold)
+    for query in queries():
+        result = matcher.match(query)
+        found = (result["comune"], result["sigla_provincia"]) if result else None
+        assert found == brute_force(query, frame, threshold), query
+
+
+def test_match_within_province(frame):
+    matcher = ComuneMatcher(frame)
+    for query in queries():
+        result = matcher.match(query, "LE")
+        found = (result["comune"], result["sigla_provincia"]) if result else None
+        assert found == brute_force(query, frame, matcher.threshold, "LE"), query
+
+
+def test_homonyms_need_a_province(frame):
+    matcher = ComuneMatcher(frame)
+    assert matcher.match("Castro") is None
+    assert matcher.match("Castro", "LE")["sigla_provincia"] == "LE"
+    assert matcher.match("Castro", "bg ")["sigla_provincia"] == "BG"
+    assert matcher.match("Castro LE")["sigla_provincia"] == "LE"
+
+
+@pytest.mark.parametrize("name", ["Taviano LE", "Taviano (LE)", "taviano le", "Tavianno LE"])
+def test_trailing_province_code(frame, name):
+    result = ComuneMatcher(frame).match(name)
+    assert (result["comune"], result["sigla_provincia"]) == ("Taviano", "LE")
+
+
+def test_trailing_code_of_another_province(frame):
+    matcher = ComuneMatcher(frame)
+    # La sigla nel nome contraddice la provincia indicata: vale la provincia
+    assert matcher.match("Taviano BG", "LE") is None
+    # Senza comuni simili nella provincia della sigla si cerca il nome intero
+    assert matcher.match("Taviano RM") is None
+
+
+def test_full_reference():
+    matcher = get_geo_index().matcher
+    assert matcher.match("Castro") is None
+    assert matcher.match("Taviano LE")["cap_min"] == "73057"
+    assert matcher.match("San Giovani Rotondo")["comune"] == "San Giovanni Rotondo"
+    roma = matcher.match("Roma RM")
+    assert (roma["cap_min"], roma["cap_max"]) == ("00118", "00199")
+
+
+@pytest.fixture
+def small_csv(tmp_path):
+    with open(GEO_CSV, encoding="utf-8") as f:
+        lines = [next(f) for _ in range(21)]
+    path = tmp_path / "comuni.csv"
+    path.write_text("".join(lines), encoding="utf-8")
+    return path
+
+
+def cache_files(directory):
+    return sorted(os.listdir(directory))
+
+
+def test_records_cache_rebuilt_when_csv_changes(small_csv, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    records = load_records(str(small_csv), str(cache_dir))
+    assert len(records) == 20
+    first = cache_files(cache_dir)
+    assert len(first) == 1 and first[0].endswith(".npy")
+
+    # Stesso CSV: la cache viene riusata, non ricostruita
+    monkeypatch.setattr(geo, "_build_records", lambda path: pytest.fail("ricostruita"))
+    assert len(load_records(str(small_csv), str(cache_dir))) == 20
+    monkeypatch.undo()
+
+    lines = small_csv.read_text(encoding="utf-8").splitlines(keepends=True)
+    small_csv.write_text("".join(lines[:11]), encoding="utf-8")
+    records = load_records(str(small_csv), str(cache_dir))
+    assert len(records) == 10
+    # La versione precedente viene rimossa
+    second = cache_files(cache_dir)
+    assert len(second) == 1 and second != first
+
+
+def test_geo_index_reloaded_when_csv_changes(small_csv, monkeypatch, tmp_path):
+    monkeypatch.setattr(geo, "_index", None)
+    monkeypatch.setattr(geo, "_index_stat", None)
+    cache_dir = str(tmp_path / "cache")
+    monkeypatch.setattr(geo, "load_records", functools.partial(load_records, cache_dir=cache_dir))
+    index = get_geo_index(str(small_csv))
+    assert get_geo_index(str(small_csv)) is index
+    lines = small_csv.read_text(encoding="utf-8").splitlines(keepends=True)
+    small_csv.write_text("".join(lines[:6]), encoding="utf-8")
+    reloaded = get_geo_index(str(small_csv))
+    assert reloaded is not index and len(reloaded) == 5
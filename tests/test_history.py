@@ -0,0 +1,69 @@
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def broken_db(tmp_path, monkeypatch):
+    """Cronologia su un database irraggiungibile (cartella inesistente)."""
+    from .. import history
+
+    monkeypatch.setattr(history, "DATABASE_URL", f"sqlite:///{tmp_path}/missing/history.db")
+    monkeypatch.setattr(history, "_session_factory", None)
+    return history
+
+
+def test_record_run_updates_totals(history_db):
+    started = datetime.now() - timedelta(seconds=2)
+    first = history_db.record_run(
+        "a.xlsx", table_id="t1", started_at=started, rows_in=10, rows_out=7,
+        stage_timings={"read": 0.12345}, rejections={"syntax": 2, "mx": 1, "dns": 0},
+    )
+    second = history_db.record_run("b.xlsx", status="failed", error="boom", rejections={"mx": 4})
+    assert second > first
+
+    totals = history_db.get_totals()
+    assert totals["runs"] == 2 and totals["failed_runs"] == 1
+    assert (totals["rows_in"], totals["rows_out"], totals["rows_rejected"]) == (10, 7, 7)
+    assert totals["duration"] >= 2
+    assert totals["rejections"] == {"syntax": 2, "mx": 5}
+
+    runs = history_db.list_runs()
+    assert [run["filename"] for run in runs] == ["b.xlsx", "a.xlsx"]
+    assert runs[1]["stage_timings"] == {"read": 0.123}
+    assert runs[1]["rejections"] == {"syntax": 2, "mx": 1}
+    assert history_db.list_runs(page=2, per_page=1)[0]["filename"] == "a.xlsx"
+
+
+def test_record_run_without_database(broken_db, caplog):
+    assert broken_db.record_run("a.xlsx", rows_in=10) is None
+    assert "cronologia" in caplog.text
+
+
+def test_record_run_without_driver(monkeypatch):
+    from .. import history
+
+    # Driver PostgreSQL non installato: ImportError alla creazione dell'engine
+    monkeypatch.setitem(sys.modules, "psycopg2", None)
+    monkeypatch.setattr(history, "DATABASE_URL", "postgresql://user@localhost/db")
+    monkeypatch.setattr(history, "_session_factory", None)
+    assert history.record_run("a.xlsx") is None
+
+
+def test_history_endpoint(client, history_db):
+    history_db.record_run("a.xlsx", rows_in=3, rows_out=3)
+    body = client.get("/history", params={"per_page": 10}).json()
+    assert body["available"] and body["pages"] == 1
+    assert body["totals"]["runs"] == 1
+    assert [run["filename"] for run in body["runs"]] == ["a.xlsx"]
+    assert client.get("/history", params={"page": 0}).status_code == 400
+
+
+def test_history_endpoint_without_database(client, broken_db):
+    response = client.get("/history")
+    assert response.status_code == 200
+    body = response.json()
+    assert not body["available"]
+    assert body["runs"] == [] and body["pages"] == 0
+    assert body["totals"]["runs"] == 0
@@ -0,0 +1,148 @@
+import multiprocessing
+import signal
+import time
+
+import pytest
+
+from .. import jobs
+from ..jobs import JobManager, QueueFull
+
+
+def sleep_forever():
+    while True:
+        time.sleep(1)
+
+
+def job_with_child(job_id, table_id, filename, input_hash, conn):
+    """Job finto che, come un ChunkPool, avvia un processo figlio e lo chiude uscendo."""
+    jobs._init_job_process()
+    if table_id == "stubborn":
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    child = multiprocessing.get_context("spawn").Process(target=sleep_forever)
+    child.start()
+    try:
+        conn.send(("progress", {"stage": "child", "pid": child.pid}))
+        if table_id == "quick":
+            conn.send(("completed", None))
+            return
+        sleep_forever()
+    finally:
+        child.terminate()
+        child.join()
+        conn.close()
+
+
+def alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "_run_job", job_with_child)
+    managers = []
+
+    def create(**kwargs):
+        manager = JobManager(
+            db_path=str(tmp_path / "jobs.sqlite3"), upload_folder=str(tmp_path), **kwargs
+        )
+        managers.append(manager)
+        return manager
+
+    yield create
+    for manager in managers:
+        manager.stop()
+
+
+def child_pid(manager, job_id):
+    assert wait_for(lambda: "child" in manager.get(job_id)["progress"])
+    return manager.get(job_id)["progress"]["child"]["pid"]
+
+
+def test_queue_capacity(manager):
+    jobs_manager = manager(queue_size=2)
+    first = jobs_manager.submit("t1", "a.xlsx", "hash-a")
+    jobs_manager.submit("t1", "b.xlsx", "hash-b")
+    assert jobs_manager.capacity() == 0
+    with pytest.raises(QueueFull):
+        jobs_manager.submit("t1", "c.xlsx", "hash-c")
+    # Un job annullato libera il suo posto
+    assert jobs_manager.cancel(first["id"])
+    assert jobs_manager.get(first["id"])["status"] == "cancelled"
+    assert jobs_manager.submit("t1", "c.xlsx", "hash-c")["status"] == "queued"
+    assert jobs_manager.active_inputs() == {"hash-b", "hash-c"}
+
+
+def test_completed_job(manager):
+    jobs_manager = manager(workers=1)
+    jobs_manager.start()
+    job = jobs_manager.submit("quick", "a.xlsx", "hash-a")
+    assert wait_for(lambda: jobs_manager.get(job["id"])["status"] == "completed")
+    assert wait_for(lambda: not jobs_manager._running)
+
+
+def test_cancel_stops_job_and_children(manager):
+    jobs_manager = manager(workers=1)
+    jobs_manager.start()
+    job = jobs_manager.submit("t1", "a.xlsx", "hash-a")
+    pid = child_pid(jobs_manager, job["id"])
+    assert jobs_manager.cancel(job["id"])
+    assert jobs_manager.get(job["id"])["status"] == "cancelled"
+    assert not jobs_manager.cancel(job["id"])
+    assert wait_for(lambda: not jobs_manager._running)
+    assert not alive(pid)
+
+
+def test_timeout_frees_slot_for_next_job(manager):
+    jobs_manager = manager(workers=1, timeout=1)
+    jobs_manager.start()
+    slow = jobs_manager.submit("t1", "a.xlsx", "hash-a")
+    queued = jobs_manager.submit("quick", "b.xlsx", "hash-b")
+    pid = child_pid(jobs_manager, slow["id"])
+    assert jobs_manager.get(queued["id"])["status"] == "queued"
+    assert wait_for(lambda: jobs_manager.get(slow["id"])["status"] == "timeout")
+    assert "timeout" in jobs_manager.get(slow["id"])["error"]
+    assert wait_for(lambda: jobs_manager.get(queued["id"])["status"] == "completed")
+    assert not alive(pid)
+
+
+def test_stubborn_job_killed_with_its_group(manager):
+    jobs_manager = manager(workers=1, kill_grace=0.5)
+    jobs_manager.start()
+    job = jobs_manager.submit("stubborn", "a.xlsx", "hash-a")
+    pid = child_pid(jobs_manager, job["id"])
+    jobs_manager.cancel(job["id"])
+    assert wait_for(lambda: not jobs_manager._running)
+    assert wait_for(lambda: not alive(pid), timeout=5)
+
+
+def test_restart_requeues_running_jobs(manager):
+    jobs_manager = manager()
+    job = jobs_manager.submit("t1", "a.xlsx", "hash-a")
+    jobs_manager._execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job["id"],))
+    restarted = manager(workers=0)
+    restarted.start()
+    assert restarted.get(job["id"])["status"] == "queued"
+
+
+def test_upload_over_capacity_is_429(manager, main_module, client, monkeypatch):
+    jobs_manager = manager(queue_size=1)
+    jobs_manager.submit("t1", "a.xlsx", "hash-a")
+    monkeypatch.setattr(main_module, "job_manager", jobs_manager)
+    response = client.post(
+        "/upload", data={"table_id": "t1"}, files={"files": ("b.xlsx", b"data")}
+    )
+    assert response.status_code == 429
+    assert jobs_manager.queue_depth() == 1
@@ -0,0 +1,78 @@
+import multiprocessing
+
+import pytest
+
+from ..metrics import REGISTRY, ROWS_IN, STAGE_DURATION, Counter, Gauge, Histogram, Registry
+
+
+@pytest.fixture
+def registry():
+    registry = Registry()
+    counter = Counter("t_rows_total", "Righe.", ["result"], registry=registry)
+    gauge = Gauge("t_queue", "Coda.", registry=registry)
+    histogram = Histogram("t_seconds", "Durata.", ["stage"], buckets=(1, 5), registry=registry)
+    return registry, counter, gauge, histogram
+
+
+def test_drain_resets_counters_not_gauges(registry):
+    registry, counter, gauge, histogram = registry
+    counter.inc(result="valid")
+    counter.inc(2, result="valid")
+    gauge.set(7)
+    histogram.observe(0.5, stage="read")
+    histogram.observe(3, stage="read")
+    deltas = registry.drain()
+    assert deltas == {
+        "t_rows_total": {("valid",): 3},
+        "t_seconds": {("read",): ([1, 1, 0], 3.5)},
+    }
+    assert counter.value(result="valid") == 0
+    assert gauge.value() == 7
+    # Nessun incremento nuovo: niente da inviare
+    assert registry.drain() == {}
+
+
+def test_merge_sums_deltas_and_reaches_collect(registry):
+    registry, counter, _, histogram = registry
+    counter.inc(result="valid")
+    with histogram.collect("stage") as totals:
+        registry.merge(
+            {
+                "t_rows_total": {("valid",): 2, ("syntax",): 1},
+                "t_seconds": {("read",): ([0, 1, 0], 2.0)},
+                "t_unknown_total": {(): 5},
+            }
+        )
+    assert counter.value(result="valid") == 3
+    assert counter.value(result="syntax") == 1
+    assert histogram.value(stage="read") == (1, 2.0)
+    assert totals == {"read": 2.0}
+
+
+def test_render(registry):
+    registry, counter, _, histogram = registry
+    counter.inc(result='a"b')
+    histogram.observe(10, stage="read")
+    text = registry.render()
+    assert 't_rows_total{result="a\\"b"} 1' in text
+    assert 't_seconds_bucket{stage="read",le="5"} 0' in text
+    assert 't_seconds_bucket{stage="read",le="+Inf"} 1' in text
+    assert 't_seconds_count{stage="read"} 1' in text
+
+
+def work_in_child(rows):
+    """Come un worker di ChunkPool: conta le righe e restituisce gli incrementi."""
+    ROWS_IN.inc(rows)
+    STAGE_DURATION.observe(0.2, stage="read")
+    return REGISTRY.drain()
+
+
+def test_merge_across_processes():
+    REGISTRY.drain()
+    with multiprocessing.get_context("spawn").Pool(2) as pool:
+        deltas = pool.map(work_in_child, [10, 20, 30])
+    for delta in deltas:
+        REGISTRY.merge(delta)
+    assert ROWS_IN.value() == 60
+    count, total = STAGE_DURATION.value(stage="read")
+    assert count == 3 and total == pytest.approx(0.6)
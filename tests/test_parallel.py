@@ -0,0 +1,88 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..bench import generate_workbook
+from ..clean import clean_frame, iter_xls_chunks, prepare_columns
+from ..parallel import ChunkPool, pack_frame, unpack_frame
+
+
+def round_trip(df):
+    shm, layout = pack_frame(df)
+    shm.close()
+    return unpack_frame(shm.name, layout, unlink=True)
+
+
+def test_round_trip_mixed_dtypes():
+    df = pd.DataFrame(
+        {
+            "text": ["Roma", "", "città", "😀", "a\x00b"],
+            "mixed": ["1", 2, 3.5, None, True],
+            "missing": [None, np.nan, "", None, "x"],
+            "flags": [True, False, True, False, True],
+            "object_flags": pd.Series([True, False, None, True, False], dtype=object),
+            "ints": np.arange(5, dtype=np.int64),
+            "floats": [0.1, np.nan, -2.0, np.inf, 1e300],
+            "big": [2**70, 1, 2, 3, 4],
+            "nullable": pd.array([1, None, 3, 4, 5], dtype="Int64"),
+            "empty_strings": [""] * 5,
+        },
+        index=[10, 3, 7, 8, 1],
+    )
+    result = round_trip(df)
+    pd.testing.assert_frame_equal(result, df)
+    # I valori object tornano con lo stesso tipo, non solo uguali
+    for column in ("mixed", "missing", "object_flags"):
+        assert [type(v) for v in result[column]] == [type(v) for v in df[column]]
+
+
+def test_round_trip_range_index_and_empty_frame():
+    df = pd.DataFrame({"a": ["x", "y", "z"]}, index=pd.RangeIndex(20, 26, 2))
+    pd.testing.assert_frame_equal(round_trip(df), df)
+    empty = pd.DataFrame({"a": pd.Series([], dtype=object)})
+    pd.testing.assert_frame_equal(round_trip(empty), empty)
+
+
+@pytest.fixture(scope="module")
+def export_frame(tmp_path_factory):
+    path = tmp_path_factory.mktemp("export") / "export.xlsx"
+    generate_workbook(path, 300)
+    return pd.concat(iter_xls_chunks(path), ignore_index=True)
+
+
+@pytest.fixture(scope="module")
+def pool():
+    with ChunkPool(2, chunk_rows=70) as pool:
+        yield pool
+
+
+def shared_memory_blocks():
+    return set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+
+
+def test_map_frame_matches_serial(export_frame, pool):
+    expected = prepare_columns(export_frame.copy())
+    result = pool.map_frame("prepare_columns", export_frame.copy())
+    pd.testing.assert_frame_equal(result, expected)
+
+    prepared = export_frame.copy()
+    prepared[expected.columns] = expected
+    expected = clean_frame(prepared.copy())
+    result = pool.map_frame("clean_frame", prepared.copy())
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_map_frame_empty(pool):
+    df = pd.DataFrame({"City": pd.Series([], dtype=object)})
+    assert pool.map_frame("split_city_cap", df).empty
+
+
+def test_map_frame_error_releases_shared_memory(export_frame, pool):
+    before = shared_memory_blocks()
+    with pytest.raises(AttributeError):
+        pool.map_frame("missing_stage", export_frame)
+    assert shared_memory_blocks() == before
+    # Il pool resta utilizzabile
+    assert len(pool.map_frame("split_city_cap", export_frame[["City"]])) == len(export_frame)
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..clean import normalize_phone_columns
+from ..phones import normalize_phones
+
+KNOWN_NUMBERS = {
+    "mobile": ("333 1234567", "+393331234567", "mobile"),
+    "mobile_plus_39": ("+39 333 123 4567", "+393331234567", "mobile"),
+    "mobile_00_39": ("0039 333 1234567", "+393331234567", "mobile"),
+    "mobile_39_without_plus": ("393331234567", "+393331234567", "mobile"),
+    "mobile_numeric_cell": (3331234567, "+393331234567", "mobile"),
+    "mobile_float_cell": (3331234567.0, "+393331234567", "mobile"),
+    "mobile_in_text": ("tel. 333 1234567 ufficio", "+393331234567", "mobile"),
+    "first_of_two_numbers": ("333 1234567 / 06 123456", "+393331234567", "mobile"),
+    "landline_rome": ("06 1234567", "+39061234567", "landline"),
+    "landline_plus_39": ("+39 06 12345678", "+390612345678", "landline"),
+    "landline_dash": ("02-12345678", "+390212345678", "landline"),
+    "toll_free": ("800 123456", "+39800123456", "other"),
+    "foreign_plus": ("+44 20 7946 0958", "+442079460958", None),
+    "foreign_00": ("0044 20 7946 0958", "+442079460958", None),
+}
+
+JUNK = {
+    "letters": "abc",
+    "empty": "",
+    "dash": "-",
+    "none": None,
+    "nan": np.nan,
+    "too_short": "123",
+    "prefix_only": "+39 333",
+    "too_long": "33312345678901",
+}
+
+
+@pytest.mark.parametrize(
+    "value, phone, kind", KNOWN_NUMBERS.values(), ids=KNOWN_NUMBERS.keys()
+)
+def test_known_numbers(value, phone, kind):
+    result = normalize_phones([value]).iloc[0]
+    assert result["valid"]
+    assert result["phone"] == phone
+    assert result["type"] == kind
+
+
+@pytest.mark.parametrize("value", JUNK.values(), ids=JUNK.keys())
+def test_junk_is_invalid(value):
+    result = normalize_phones([value]).iloc[0]
+    assert not result["valid"]
+    assert result["phone"] is None and result["type"] is None
+
+
+def test_keeps_index():
+    values = pd.Series(["333 1234567", "abc"], index=[10, 20])
+    assert normalize_phones(values).index.tolist() == [10, 20]
+
+
+def test_phone_columns_have_their_own_flags():
+    df = pd.DataFrame({"Phone": ["06 1234567", "abc"], "Cell": ["333 1234567", "333 1234567"]})
+    df = normalize_phone_columns(df)
+    assert df["Phone"].tolist() == ["+39061234567", None]
+    assert df["Phone Valido"].tolist() == [True, False]
+    assert df["Phone Tipo"].tolist() == ["landline", None]
+    assert df["Cell Valido"].tolist() == [True, True]
+    assert df["Cell Tipo"].tolist() == ["mobile", "mobile"]
+
+
+def test_invalid_numbers_move_to_text_column():
+    df = normalize_phone_columns(pd.DataFrame({"Cell": ["non disponibile", "333 1234567"]}))
+    assert df["Cell"].tolist() == [None, "+393331234567"]
+    assert df["Cell Originale"].tolist() == ["non disponibile", None]
@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+
+from ..clean import reconcile_cap_city
+
+# (City, CAP, Province, Address) -> (City, CAP, Province, Region, Address)
+CASES = {
+    "known_cap_fixes_city": (
+        ("tavano", "73057", "", "Via Roma 1"),
+        ("Taviano", "73057", "LE", "Puglia", "Via Roma 1"),
+    ),
+    "cap_from_address": (
+        ("", "", "", "Via Roma 1, 73057 Taviano"),
+        ("Taviano", "73057", "LE", "Puglia", "Via Roma 1,  Taviano"),
+    ),
+    "generic_cap_matched_by_name": (
+        ("Roma", "00100", "", "Via del Corso 1"),
+        ("Roma", "00100", "RM", "Lazio", "Via del Corso 1"),
+    ),
+    "ambiguous_homonym": (
+        ("Castro", "", "", ""),
+        ("Castro", "", "", "", ""),
+    ),
+    "homonym_with_province": (
+        ("Castro", "", "BG", ""),
+        ("Castro", "24063", "BG", "Lombardia", ""),
+    ),
+    "province_not_overwritten": (
+        ("Milano", "20121", "XX", ""),
+        ("Milano", "20121", "XX", "Lombardia", ""),
+    ),
+    "empty_row": (("", "", "", ""), ("", "", "", "", "")),
+}
+
+
+def reconcile(rows):
+    df = pd.DataFrame(rows, columns=["City", "CAP", "Province", "Address"])
+    result = reconcile_cap_city(df)
+    return result[["City", "CAP", "Province", "Region", "Address"]]
+
+
+@pytest.mark.parametrize("row, expected", CASES.values(), ids=CASES.keys())
+def test_reconcile_row(row, expected):
+    assert tuple(reconcile([row]).iloc[0]) == expected
+
+
+def test_reconcile_mixed_frame_keeps_rows_independent():
+    rows = [row for row, _ in CASES.values()]
+    expected = [expected for _, expected in CASES.values()]
+    assert [tuple(values) for values in reconcile(rows).to_numpy()] == expected
+
+
+def test_existing_region_is_kept():
+    df = pd.DataFrame(
+        {"City": ["x"], "CAP": ["73057"], "Province": [""], "Address": [""], "Region": ["R"]}
+    )
+    assert reconcile_cap_city(df)["Region"].tolist() == ["R"]
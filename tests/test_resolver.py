@@ -0,0 +1,101 @@
+import socket
+import threading
+import time
+
+import pandas as pd
+
+from .. import resolver
+from ..resolver import DomainCache, check_domains_reachable, resolve_domains
+
+
+class StubResolver:
+    """Resolver finto: conta le chiamate e simula domini lenti o inesistenti."""
+
+    def __init__(self, slow_seconds=1.0):
+        self.slow_seconds = slow_seconds
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, domain):
+        with self._lock:
+            self.calls.append(domain)
+        if domain.startswith("slow"):
+            time.sleep(self.slow_seconds)
+        if domain.startswith("bad"):
+            raise socket.gaierror("Name or service not known")
+        return "192.0.2.1"
+
+
+def test_verdicts():
+    stub = StubResolver()
+    verdicts = resolve_domains(
+        ["ok.it", "bad.it", "ok.it", "", None], resolver=stub, cache=None
+    )
+    assert verdicts == {"ok.it": True, "bad.it": False}
+    assert sorted(stub.calls) == ["bad.it", "ok.it"]
+
+
+def test_cache_hit_skips_resolver():
+    stub = StubResolver()
+    cache = DomainCache()
+    resolve_domains(["ok.it", "bad.it"], resolver=stub, cache=cache)
+    verdicts = resolve_domains(["ok.it", "bad.it"], resolver=stub, cache=cache)
+    assert verdicts == {"ok.it": True, "bad.it": False}
+    assert len(stub.calls) == 2
+    assert cache.hits == 2
+
+
+def test_negative_ttl_expires(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(resolver.time, "monotonic", lambda: clock[0])
+    stub = StubResolver()
+    cache = DomainCache(ttl=3600, negative_ttl=60)
+    resolve_domains(["ok.it", "bad.it"], resolver=stub, cache=cache)
+
+    clock[0] += 30
+    resolve_domains(["ok.it", "bad.it"], resolver=stub, cache=cache)
+    assert len(stub.calls) == 2
+
+    # Scaduto solo il verdetto negativo: viene risolto di nuovo solo bad.it
+    clock[0] += 60
+    resolve_domains(["ok.it", "bad.it"], resolver=stub, cache=cache)
+    assert sorted(stub.calls) == ["bad.it", "bad.it", "ok.it"]
+
+
+def test_timeout_is_unknown_and_not_cached():
+    stub = StubResolver(slow_seconds=0.5)
+    cache = DomainCache()
+    errors = []
+    verdicts = resolve_domains(
+        ["slow.it", "ok.it", "bad.it"],
+        resolver=stub,
+        cache=cache,
+        timeout=0.1,
+        on_error=lambda domain, error: errors.append((domain, type(error))),
+    )
+    assert verdicts == {"slow.it": None, "ok.it": True, "bad.it": False}
+    assert sorted(errors) == [
+        ("bad.it", socket.gaierror),
+        ("slow.it", TimeoutError),
+    ]
+    found, missing = cache.get_many(["slow.it", "ok.it", "bad.it"])
+    assert missing == ["slow.it"]
+
+
+def test_executor_is_reused():
+    stub = StubResolver()
+    resolve_domains(["a.it"], resolver=stub, cache=None)
+    executor = resolver.EXECUTOR
+    resolve_domains(["b.it"], resolver=stub, cache=None)
+    assert resolver.EXECUTOR is executor
+    assert not executor._shutdown
+
+
+def test_check_domains_reachable():
+    stub = StubResolver(slow_seconds=0.5)
+    emails = pd.Series(["a@ok.it", "b@bad.it", "c@slow.it", "nope", None])
+    valid = pd.Series([True, True, True, False, False])
+    reachable = check_domains_reachable(
+        emails, valid, resolver=stub, cache=None, timeout=0.1
+    )
+    assert reachable.tolist() == [True, False, None, False, False]
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..bench import city_frame
+from ..clean import _split_city_cap_rows, split_city_cap
+
+EDGE_CASES = {
+    "cap_and_province": "00184 Roma RM",
+    "missing_cap": "Milano MI",
+    "city_only": "Bologna",
+    "extra_whitespace": "   20121   Milano  ",
+    "cap_only": "20121",
+    "province_only": "TO",
+    "empty": "",
+    "nan": np.nan,
+    "none": None,
+    "int": 20121,
+    "float": 20121.0,
+    "four_digit_cap": "8020 Napoli NA",
+}
+
+
+def assert_same_split(values):
+    df = pd.DataFrame({"City": values, "Other": range(len(values))})
+    expected = _split_city_cap_rows(df.copy())
+    result = split_city_cap(df.copy())
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    return result
+
+
+@pytest.mark.parametrize("value", EDGE_CASES.values(), ids=EDGE_CASES.keys())
+def test_matches_row_wise_version(value):
+    assert_same_split([value])
+
+
+def test_matches_row_wise_version_on_mixed_column():
+    assert_same_split(list(EDGE_CASES.values()))
+
+
+def test_matches_row_wise_version_on_synthetic_exports():
+    assert_same_split(city_frame(2000)["City"].tolist())
+
+
+def test_split_values():
+    result = split_city_cap(pd.DataFrame({"City": ["00184 Roma RM", "20121", "Milano MI", 20121]}))
+    assert result["CAP"].tolist() == ["00184", "20121", None, None]
+    assert result["Province"].tolist() == ["RM", None, "MI", None]
+    # Con un CAP la sigla di provincia resta nel testo della città
+    assert result["City"].tolist() == ["Roma RM", "", "Milano", 20121]
+
+
+def test_without_city_column():
+    df = pd.DataFrame({"Other": [1, 2]})
+    pd.testing.assert_frame_equal(split_city_cap(df.copy()), df)
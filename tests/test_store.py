@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from .. import clean, resolver, store
+from ..bench import generate_workbook, stub_resolver, workspace
+from ..clean import clean_data
+from ..store import OUTPUT_SETTINGS, UploadWriter, config_fingerprint
+
+
+def fingerprint(**kwargs):
+    settings = {"table_id": "t1", "dedup_mode": "off", "chunk_rows": 1000, **kwargs}
+    return config_fingerprint(**settings)
+
+
+def test_fingerprint_is_stable():
+    assert fingerprint() == fingerprint()
+
+
+def test_every_output_setting_changes_fingerprint(monkeypatch):
+    base = fingerprint()
+    # Dopo la prima impronta tutti i moduli della pipeline sono importati
+    assert {"CITY_MATCH_THRESHOLD", "DNS_TIMEOUT", "DEDUP_DIR"} <= OUTPUT_SETTINGS.keys()
+    for name, value in list(OUTPUT_SETTINGS.items()):
+        changed = value + 1 if isinstance(value, (int, float)) else f"{value}-altro"
+        with monkeypatch.context() as patch:
+            patch.setitem(OUTPUT_SETTINGS, name, changed)
+            assert fingerprint() != base, name
+    assert fingerprint() == base
+
+
+def test_fingerprint_depends_on_table_only_with_dedup():
+    assert fingerprint(table_id="t1") == fingerprint(table_id="t2")
+    assert fingerprint(table_id="t1", dedup_mode="flag") != fingerprint(
+        table_id="t2", dedup_mode="flag"
+    )
+    assert fingerprint(chunk_rows=10) != fingerprint(chunk_rows=20)
+
+
+def test_save_and_load_result(tmp_path):
+    output = tmp_path / "out.csv"
+    output.write_text("Email\na@example.it\n")
+    assert store.load_result("k", tmp_path) is None
+    store.save_result("k", output, {"rows_in": 1}, tmp_path)
+    # Il risultato in cache è una copia: il file in uscita può cambiare
+    output.write_text("altro")
+    assert store.load_result("k", tmp_path) == {"rows_in": 1}
+    chunks = list(store.iter_result_chunks("k", 10, tmp_path))
+    assert chunks[0]["Email"].tolist() == ["a@example.it"]
+
+
+@pytest.fixture
+def upload(tmp_path, history_db, monkeypatch):
+    """Cartella di lavoro con un export caricato due volte nell'archivio."""
+    workbook = tmp_path / "export.xlsx"
+    generate_workbook(workbook, 120)
+    monkeypatch.setattr("socket.gethostbyname", stub_resolver(0))
+    resolver.CACHE.clear()
+    with workspace():
+        hashes = []
+        for _ in range(2):
+            with UploadWriter() as writer:
+                writer.write(workbook.read_bytes())
+                hashes.append(writer.commit())
+        yield hashes
+
+
+def run(input_hash):
+    return clean_data(
+        "t1", "export.xlsx", input_hash=input_hash, dedup_mode="off", push=False,
+        write_side_csv=False, workers=0,
+    )
+
+
+def test_same_upload_reuses_cached_result(upload, monkeypatch):
+    first_hash, second_hash = upload
+    assert first_hash == second_hash
+    first = run(first_hash)
+    parsed = []
+    original = clean.iter_parsed_chunks
+    monkeypatch.setattr(
+        clean, "iter_parsed_chunks", lambda *a, **k: parsed.append(1) or original(*a, **k)
+    )
+    second = run(second_hash)
+    assert parsed == []
+    assert second["rows_out"] == first["rows_out"]
+    assert second["rejections"] == first["rejections"]
+    with open(first["output_path"]) as a, open(second["output_path"]) as b:
+        assert a.read() == b.read()
+
+
+def test_changed_setting_invalidates_cached_result(upload, monkeypatch):
+    input_hash, _ = upload
+    run(input_hash)
+    parsed = []
+    original = clean.iter_parsed_chunks
+    monkeypatch.setattr(
+        clean, "iter_parsed_chunks", lambda *a, **k: parsed.append(1) or original(*a, **k)
+    )
+    monkeypatch.setitem(OUTPUT_SETTINGS, "CITY_MATCH_THRESHOLD", 0.99)
+    run(input_hash)
+    assert parsed == [1]
+    assert len(os.listdir(os.path.join(store.STORE_DIR, "results"))) == 4
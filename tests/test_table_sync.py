@@ -0,0 +1,109 @@
+import itertools
+
+import pandas as pd
+import pytest
+
+from .. import db
+from ..db import HASH_COLUMN, TableSync, row_hashes, sync_keys
+
+
+class StubBatches:
+    """send_batches finto: registra i record inviati e assegna id progressivi."""
+
+    def __init__(self, with_ids=True):
+        self.sent = []
+        self.with_ids = with_ids
+        self._ids = itertools.count(100)
+
+    def __call__(self, url, batches, method="POST", keep_response=False, **kwargs):
+        results = []
+        for i, records in enumerate(batches):
+            self.sent.append((method, records))
+            result = {"batch": i, "rows": len(records), "ok": True, "status": 200, "attempts": 1}
+            if keep_response:
+                ids = [{"Id": next(self._ids)} for _ in records] if self.with_ids else {}
+                result["response"] = ids
+            results.append(result)
+        return results
+
+    def records(self, method):
+        return [record for m, batch in self.sent if m == method for record in batch]
+
+
+def frame(rows):
+    return pd.DataFrame(rows, columns=["Email Corretta", "Name"])
+
+
+@pytest.fixture
+def table(monkeypatch):
+    stub = StubBatches()
+    monkeypatch.setattr(db, "send_batches", stub)
+    sync = TableSync("t1", key_columns=["Email Corretta"])
+    stored = frame([("a@example.it", "Anna"), ("b@example.it", "Bruno")])
+    stored[HASH_COLUMN] = row_hashes(stored)
+    # b è cambiato dall'ultimo caricamento
+    stored.loc[1, HASH_COLUMN] = "0"
+    stored["Id"] = [1, 2]
+    stored.index = sync_keys(stored, sync.key_columns)
+    sync.existing = stored[["Id", "Email Corretta", HASH_COLUMN]]
+    return sync, stub
+
+
+def test_insert_update_unchanged_split(table):
+    sync, stub = table
+    df = frame(
+        [
+            ("a@example.it", "Anna"),
+            ("B@example.it ", "Bruno"),
+            ("c@example.it", "Carla"),
+            ("d@example.it", "Dario"),
+            ("d@example.it", "Dario Rossi"),
+        ]
+    )
+    stats = sync.sync(df)
+    assert stats == {"inserted": 2, "updated": 1, "unchanged": 1, "collapsed": 1}
+    inserted = stub.records("POST")
+    assert [r["Email Corretta"] for r in inserted] == ["c@example.it", "d@example.it"]
+    # Delle righe con la stessa chiave resta l'ultima
+    assert inserted[1]["Name"] == "Dario Rossi"
+    updated = stub.records("PATCH")
+    assert [(r["Id"], r["Email Corretta"]) for r in updated] == [(2, "B@example.it ")]
+
+
+def test_rows_written_are_remembered(table):
+    sync, stub = table
+    df = frame([("b@example.it", "Bruno"), ("c@example.it", "Carla")])
+    sync.sync(df)
+    assert sync.existing.loc["c@example.it", "Id"] == 100
+    # Lo stesso blocco inviato di nuovo non produce scritture
+    stub.sent.clear()
+    stats = sync.sync(df)
+    assert stub.sent == []
+    assert stats["unchanged"] == 2
+
+
+def test_remember_inserts_reloads_without_ids(table, monkeypatch):
+    sync, _ = table
+    monkeypatch.setattr(db, "send_batches", StubBatches(with_ids=False))
+    loads = []
+    monkeypatch.setattr(sync, "load", lambda: loads.append(True))
+    sync.sync(frame([("c@example.it", "Carla")]))
+    assert loads == [True]
+    assert "c@example.it" not in sync.existing.index
+
+
+def test_remember_inserts_per_batch(table):
+    sync, _ = table
+    inserts = frame(
+        [("c@example.it", "Carla"), ("d@example.it", "Dario"), ("e@example.it", "Elena")]
+    )
+    inserts[HASH_COLUMN] = row_hashes(inserts)
+    inserts.index = sync_keys(inserts, sync.key_columns)
+    results = [
+        {"rows": 2, "ok": True, "response": [{"Id": 7}, {"Id": 8}]},
+        {"rows": 1, "ok": False},
+    ]
+    sync._remember_inserts(inserts, results)
+    assert sync.existing.loc[["c@example.it", "d@example.it"], "Id"].tolist() == [7, 8]
+    # Il blocco fallito non viene registrato
+    assert "e@example.it" not in sync.existing.index